@@ -0,0 +1,142 @@
+"""Admission control for expensive streaming endpoints.
+
+AdmissionQueue caps how many requests run at once and how many may wait for
+a slot; RateLimiter is a per-client token bucket. Both answer synchronously,
+so a handler can reject with 429 before it starts streaming.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Callable, Optional
+
+
+class RateLimiter:
+    """Token bucket per client key: ``rate`` tokens per second, up to ``burst``.
+
+    A rate of 0 disables limiting. At most ``max_clients`` buckets are kept;
+    the least recently seen client is forgotten first (and starts full again).
+    """
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 10_000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.rejected = 0
+        self._clock = clock
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str) -> Optional[float]:
+        """Take a token for ``key``. Returns None if allowed, else seconds until one is available."""
+        if self.rate <= 0:
+            return None
+        now = self._clock()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            if allowed:
+                return None
+            self.rejected += 1
+            return (1 - tokens) / self.rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self.rejected = 0
+
+
+class Ticket:
+    """A request's place in an AdmissionQueue: running, or waiting for a slot."""
+
+    def __init__(self, queue: "AdmissionQueue", admitted: bool, weight: int = 1):
+        self.admitted = admitted
+        self.released = False
+        self.weight = weight
+        self._queue = queue
+        self._moved = asyncio.Event()
+
+    @property
+    def position(self) -> int:
+        """1-based place in the wait queue, 0 once admitted."""
+        return 0 if self.admitted else self._queue._waiting.index(self) + 1
+
+    async def wait_turn(self) -> AsyncIterator[int]:
+        """Yield the queue position each time it changes, until admitted."""
+        while not self.admitted:
+            self._moved.clear()
+            yield self.position
+            await self._moved.wait()
+
+    def release(self):
+        """Give up the slot, or the place in line. Safe to call more than once."""
+        if self.released:
+            return
+        self.released = True
+        self._queue._release(self)
+
+
+class AdmissionQueue:
+    """At most ``limit`` slots in use at once; at most ``max_waiting`` tickets wait, first come first served.
+
+    A ticket takes ``weight`` slots (capped at ``limit``), e.g. one per
+    upstream stream; its holder must not open more than ``weight`` at a time.
+    """
+
+    def __init__(self, limit: int, max_waiting: int):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.rejected = 0
+        self._waiting: deque[Ticket] = deque()
+
+    def admit(self, weight: int = 1) -> Optional[Ticket]:
+        """A running or waiting ticket, or None when the wait queue is full."""
+        weight = max(1, min(weight, self.limit))
+        if self.active + weight <= self.limit and not self._waiting:
+            self.active += weight
+            return Ticket(self, admitted=True, weight=weight)
+        if len(self._waiting) >= self.max_waiting:
+            self.rejected += 1
+            return None
+        ticket = Ticket(self, admitted=False, weight=weight)
+        self._waiting.append(ticket)
+        return ticket
+
+    def try_acquire(self) -> Optional[Ticket]:
+        """One extra slot if it is free right now and nobody is waiting, else None."""
+        if self.active < self.limit and not self._waiting:
+            self.active += 1
+            return Ticket(self, admitted=True)
+        return None
+
+    def _release(self, ticket: Ticket):
+        if ticket.admitted:
+            self.active -= ticket.weight
+        else:
+            self._waiting.remove(ticket)
+        # Hand freed slots to the head of the line, in order
+        while self._waiting and self.active + self._waiting[0].weight <= self.limit:
+            successor = self._waiting.popleft()
+            successor.admitted = True
+            self.active += successor.weight
+            successor._moved.set()
+        for waiting in self._waiting:
+            waiting._moved.set()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "limit": self.limit,
+            "waiting": len(self._waiting),
+            "max_waiting": self.max_waiting,
+            "rejected": self.rejected,
+        }
@@ -4,13 +4,15 @@ import json
 import logging
 import random
 from datetime import datetime
+from typing import Optional
 
 import anthropic
 import httpx
 
 from app.config import CLAUDE_API_KEY
-from app.database import SessionLocal
+from app.database import AsyncSessionLocal
 from app.agents.utils import save_new_phrases
+from app.llm import create_llm_client
 
 logger = logging.getLogger(__name__)
 
@@ -98,8 +100,11 @@ def _build_prompt(trending: str, date: datetime, categories: list[str], n: int)
 返回纯JSON数组（不要markdown代码块）: [{{"content":"...","category":"...","tags":"tag1,tag2"}}]"""
 
 
-async def generate_phrases_job():
-    """Main job entry point — called by scheduler."""
+async def generate_phrases_job(client: Optional[anthropic.AsyncAnthropic] = None):
+    """Main job entry point — called by scheduler with the app's shared client.
+
+    Run standalone, it creates a client of its own and closes it afterwards.
+    """
     if not CLAUDE_API_KEY:
         logger.warning("CLAUDE_API_KEY not set, skipping phrase generation")
         return
@@ -115,9 +120,11 @@ async def generate_phrases_job():
     trending = await _fetch_trending_topics()
     prompt = _build_prompt(trending, now, categories, n_per_category)
 
+    own_client = client is None
+    if own_client:
+        client = create_llm_client()
     try:
-        client = anthropic.Anthropic(api_key=CLAUDE_API_KEY)
-        response = client.messages.create(
+        response = await client.messages.create(
             model="claude-sonnet-4-6",
             max_tokens=2048,
             messages=[{"role": "user", "content": prompt}],
@@ -142,12 +149,9 @@ async def generate_phrases_job():
             if 15 <= len(content) <= 80 and p.get("category"):
                 valid.append(p)
 
-        db = SessionLocal()
-        try:
-            added = save_new_phrases(db, valid)
+        async with AsyncSessionLocal() as db:
+            added = await save_new_phrases(db, valid)
             logger.info("AI generator: %d new phrases added (from %d generated)", added, len(valid))
-        finally:
-            db.close()
 
     except json.JSONDecodeError as e:
         logger.error("Failed to parse Claude response as JSON: %s", e)
@@ -155,3 +159,6 @@ async def generate_phrases_job():
         logger.error("Claude API error: %s", e)
     except Exception as e:
         logger.error("Unexpected error in generator: %s", e)
+    finally:
+        if own_client:
+            await client.close()
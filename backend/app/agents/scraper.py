@@ -7,7 +7,7 @@ import re
 import httpx
 from bs4 import BeautifulSoup
 
-from app.database import SessionLocal
+from app.database import AsyncSessionLocal
 from app.agents.utils import save_new_phrases
 
 logger = logging.getLogger(__name__)
@@ -112,9 +112,6 @@ async def scrape_phrases_job():
     # Take 5-10 random phrases
     selected = random.sample(phrases, k=min(random.randint(5, 10), len(phrases)))
 
-    db = SessionLocal()
-    try:
-        added = save_new_phrases(db, selected)
+    async with AsyncSessionLocal() as db:
+        added = await save_new_phrases(db, selected)
         logger.info("Scraper: %d new phrases added (from %d scraped)", added, len(selected))
-    finally:
-        db.close()
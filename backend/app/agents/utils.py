@@ -1,18 +1,19 @@
 import logging
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models import Phrase
 
 logger = logging.getLogger(__name__)
 
 
-def save_new_phrases(db: Session, phrases: list[dict]) -> int:
+async def save_new_phrases(db: AsyncSession, phrases: list[dict]) -> int:
     """Write new phrases to DB, skip duplicates by content. Returns count of newly added."""
     added = 0
     for p in phrases:
         content = p.get("content", "").strip()
         if not content:
             continue
-        exists = db.query(Phrase).filter(Phrase.content == content).first()
+        exists = await db.scalar(select(Phrase.id).where(Phrase.content == content).limit(1))
         if exists:
             logger.debug("Skipping duplicate: %s", content[:30])
             continue
@@ -24,5 +25,5 @@ def save_new_phrases(db: Session, phrases: list[dict]) -> int:
         ))
         added += 1
     if added:
-        db.commit()
+        await db.commit()
     return added
@@ -0,0 +1,148 @@
+"""Exact-match cache of finished chat replies.
+
+Users send the same few openers ("在吗", "晚安", ...) over and over; a cached
+reply is replayed instead of paying for a new generation. Requests are keyed
+by a hash of the normalized message, the effective style, the context and the
+digests of any images, so only requests that would build the very same
+prompt share an entry.
+
+Entries live in an in-memory LRU with a TTL and, when CHAT_CACHE_PERSIST is
+on, in the chat_replies table so they survive restarts.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, Sequence, Union
+
+from sqlalchemy import delete
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.cache import LRUCache
+from app.config import CHAT_CACHE_SIZE, CHAT_CACHE_TTL, CHAT_CACHE_PERSIST
+from app.database import AsyncSessionLocal
+from app.images import ImageSource, LoadedImage, load_image
+from app.models import CachedReply
+from app.schemas import ChatRequest
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(text: Optional[str]) -> str:
+    """Fold width, case and runs of whitespace, which don't change the prompt's meaning."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text or "")).strip().casefold()
+
+
+def chat_cache_key(request: ChatRequest, style_label: str,
+                   images: Optional[Sequence[Union[ImageSource, LoadedImage]]] = None) -> str:
+    """``images`` defaults to the request's own; uploads and base64 copies of an image hash alike.
+
+    Pass LoadedImages from the event loop: anything else is read and hashed here.
+    """
+    if images is None:
+        images = request.images or []
+    images = [load_image(image).digest for image in images]
+    payload = [_normalize(request.their_message), style_label, _normalize(request.context), images]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class CachedChatReply:
+    text: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+class ChatReplyCache:
+    """LRU + TTL cache of replies, optionally backed by the chat_replies table."""
+
+    def __init__(self, maxsize: int, ttl: Optional[float], persist: bool = False):
+        self.ttl = ttl
+        self.persist = persist
+        self._memory = LRUCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.input_tokens_saved = 0
+        self.output_tokens_saved = 0
+
+    async def get(self, key: str) -> Optional[CachedChatReply]:
+        reply = self._memory.get(key)
+        if reply is None and self.persist:
+            reply = await self._load(key)
+            if reply is not None:
+                self._memory.put(key, reply)
+        with self._lock:
+            if reply is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.input_tokens_saved += reply.input_tokens
+                self.output_tokens_saved += reply.output_tokens
+        return reply
+
+    async def put(self, key: str, reply: CachedChatReply):
+        self._memory.put(key, reply)
+        if self.persist:
+            await self._store(key, reply)
+
+    def _expiry(self) -> Optional[datetime]:
+        return datetime.utcnow() - timedelta(seconds=self.ttl) if self.ttl else None
+
+    async def _load(self, key: str) -> Optional[CachedChatReply]:
+        try:
+            async with AsyncSessionLocal() as db:
+                row = await db.get(CachedReply, key)
+        except SQLAlchemyError as e:
+            logger.warning("Chat cache lookup failed: %s", e)
+            return None
+        expiry = self._expiry()
+        if row is None or (expiry and row.created_at < expiry):
+            return None
+        return CachedChatReply(row.reply, row.input_tokens, row.output_tokens)
+
+    async def _store(self, key: str, reply: CachedChatReply):
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.merge(CachedReply(
+                    key=key, reply=reply.text, input_tokens=reply.input_tokens,
+                    output_tokens=reply.output_tokens, created_at=datetime.utcnow(),
+                ))
+                expiry = self._expiry()
+                if expiry:
+                    await db.execute(delete(CachedReply).where(CachedReply.created_at < expiry))
+                await db.commit()
+        except SQLAlchemyError as e:
+            logger.warning("Chat cache write failed: %s", e)
+
+    def clear(self):
+        """Empty the in-memory entries and reset the counters (persisted rows stay)."""
+        self._memory.clear()
+        with self._lock:
+            self._reset_counters()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._memory),
+            "maxsize": self._memory.maxsize,
+            "persist": self.persist,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "input_tokens_saved": self.input_tokens_saved,
+            "output_tokens_saved": self.output_tokens_saved,
+        }
+
+
+chat_cache = ChatReplyCache(CHAT_CACHE_SIZE, CHAT_CACHE_TTL, CHAT_CACHE_PERSIST)
@@ -6,3 +6,77 @@ load_dotenv()
 CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY", "")
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/rizz.db")
 AGENT_ENABLED = os.getenv("AGENT_ENABLED", "true").lower() == "true"
+
+PHRASE_CACHE_SIZE = int(os.getenv("PHRASE_CACHE_SIZE", "1024"))
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "60"))
+HTTP_CACHE_STALE_WHILE_REVALIDATE = int(os.getenv("HTTP_CACHE_STALE_WHILE_REVALIDATE", "300"))
+
+SQLITE_TUNING = os.getenv("SQLITE_TUNING", "true").lower() == "true"
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # negative: KiB, i.e. 64 MiB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# Shared upstream LLM client (one connection pool for chat and agents)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+
+# Exact-match cache of finished chat replies
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "512"))
+CHAT_CACHE_TTL = int(os.getenv("CHAT_CACHE_TTL", str(24 * 3600)))
+CHAT_CACHE_PERSIST = os.getenv("CHAT_CACHE_PERSIST", "false").lower() == "true"
+
+# Admission control for /api/chat: concurrent upstream streams, requests
+# allowed to wait for one, and a per-client token bucket (0 disables it)
+CHAT_MAX_CONCURRENT = int(os.getenv("CHAT_MAX_CONCURRENT", "8"))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "32"))
+CHAT_QUEUE_RETRY_AFTER = int(os.getenv("CHAT_QUEUE_RETRY_AFTER", "5"))
+CHAT_RATE_PER_MINUTE = float(os.getenv("CHAT_RATE_PER_MINUTE", "10"))
+CHAT_RATE_BURST = int(os.getenv("CHAT_RATE_BURST", "5"))
+# Take the client address from X-Forwarded-For (only behind a trusted proxy)
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+# Time-to-first-token deadline for the primary chat model (seconds, 0 disables).
+# "hedge" starts the fallback model alongside and streams whichever answers
+# first; "cancel" abandons the primary and switches to the fallback.
+CHAT_TTFT_DEADLINE = float(os.getenv("CHAT_TTFT_DEADLINE", "5"))
+CHAT_TTFT_STRATEGY = os.getenv("CHAT_TTFT_STRATEGY", "hedge")
+
+# Screenshot preprocessing: longest edge in pixels (0 keeps the size), output
+# format (JPEG or WEBP) and encoder quality
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1280"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+
+# Multipart chat uploads: whole-body size cap (bytes) and image count, both
+# enforced while the body is still arriving
+CHAT_UPLOAD_MAX_BYTES = int(os.getenv("CHAT_UPLOAD_MAX_BYTES", str(16 * 1024 * 1024)))
+CHAT_UPLOAD_MAX_FILES = int(os.getenv("CHAT_UPLOAD_MAX_FILES", "3"))
+
+# SSE coalescing: text deltas that arrive within CHAT_COALESCE_MS of the last
+# frame are merged into one frame, flushed early at CHAT_COALESCE_CHARS
+# characters (0 ms sends one frame per delta)
+CHAT_COALESCE_MS = float(os.getenv("CHAT_COALESCE_MS", "30"))
+CHAT_COALESCE_CHARS = int(os.getenv("CHAT_COALESCE_CHARS", "64"))
+
+# Resumable chat streams: frames of running and recently finished generations
+# are kept for clients that reconnect with Last-Event-ID
+CHAT_REPLAY_TTL = float(os.getenv("CHAT_REPLAY_TTL", "120"))
+CHAT_REPLAY_MAX_BYTES = int(os.getenv("CHAT_REPLAY_MAX_BYTES", str(16 * 1024 * 1024)))
+# A generation left with no connected client is cancelled, upstream stream
+# included, after this many seconds without a resume (0: right away)
+CHAT_DISCONNECT_GRACE = float(os.getenv("CHAT_DISCONNECT_GRACE", "3"))
+
+# Phrase-library suggestions sent as the first chat event while the model
+# starts up (0 turns them off)
+CHAT_SUGGESTIONS = int(os.getenv("CHAT_SUGGESTIONS", "3"))
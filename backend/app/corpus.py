@@ -0,0 +1,168 @@
+"""Derived views of the phrase corpus, kept in step with phrase writes.
+
+category_stats rows are maintained by mapper events in app.models, inside
+the writing transaction; ensure_category_stats() repairs them at startup if
+rows were written behind the ORM's back.
+
+For the in-process views below, session events collect the phrases each
+flush writes and apply them once the transaction commits, so every ORM
+write path (save_new_phrases, seed_phrases, ...) updates these views
+without having to call into them explicitly.
+
+Every committed change also bumps a process-wide corpus version, which
+response caches use as part of their keys.
+
+State is kept per database so that several engines in one process (tests,
+benchmarks) never see each other's rows.
+"""
+
+import os
+import random
+import threading
+from typing import Optional
+
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.models import CategoryStat, Phrase
+
+_PENDING_KEY = "corpus_inserts"
+_RESET_KEY = "corpus_reset"
+
+_version = 0
+_version_lock = threading.Lock()
+
+
+def database_key(bind) -> str:
+    """Identify the database behind an engine or connection."""
+    engine = bind.engine if isinstance(bind, Connection) else bind
+    path = engine.url.database
+    if not path or path == ":memory:":
+        return f"memory:{id(engine)}"
+    return os.path.abspath(path)
+
+
+class RandomIndex:
+    """Per-category arrays of phrase ids for O(1) random picks.
+
+    A pick is one random index into an array plus a primary-key lookup,
+    instead of ``ORDER BY random()`` sorting every matching row.
+    """
+
+    def __init__(self):
+        # database key -> category (None for all phrases) -> phrase ids
+        self._ids: dict[str, dict[Optional[str], list[int]]] = {}
+        self._lock = threading.Lock()
+
+    def loaded(self, bind) -> bool:
+        return database_key(bind) in self._ids
+
+    def load(self, db: Session):
+        """Read all phrase ids. Takes a sync Session; use AsyncSession.run_sync from async code."""
+        ids: dict[Optional[str], list[int]] = {None: []}
+        for phrase_id, category in db.execute(select(Phrase.id, Phrase.category)):
+            ids[None].append(phrase_id)
+            ids.setdefault(category, []).append(phrase_id)
+        with self._lock:
+            self._ids[database_key(db.get_bind())] = ids
+
+    def add(self, bind, rows: list[tuple[int, str]]):
+        with self._lock:
+            ids = self._ids.get(database_key(bind))
+            if ids is None:
+                return  # not loaded yet, the first pick will load everything
+            for phrase_id, category in rows:
+                ids[None].append(phrase_id)
+                ids.setdefault(category, []).append(phrase_id)
+
+    def reset(self, bind):
+        with self._lock:
+            self._ids.pop(database_key(bind), None)
+
+    def sample(self, bind, category: Optional[str] = None, n: int = 1) -> list[int]:
+        """Pick up to ``n`` distinct phrase ids, optionally from one category.
+
+        Returns nothing until the index has been loaded for this database.
+        """
+        ids = self._ids.get(database_key(bind), {}).get(category, [])
+        return random.sample(ids, min(n, len(ids)))
+
+
+random_index = RandomIndex()
+
+
+def corpus_version() -> int:
+    """Counter that changes whenever any phrase write is committed."""
+    return _version
+
+
+def bump_version():
+    global _version
+    with _version_lock:
+        _version += 1
+
+
+def invalidate(bind):
+    """Drop derived state for a database, e.g. after writing phrases with raw SQL."""
+    random_index.reset(bind)
+    bump_version()
+
+
+def ensure_category_stats(connection: Connection) -> bool:
+    """Rebuild category_stats if it disagrees with the phrases table.
+
+    Returns True if the counters had drifted and were rebuilt.
+    """
+    actual = dict(connection.execute(
+        select(Phrase.category, func.count(Phrase.id)).group_by(Phrase.category)
+    ).all())
+    stored = dict(connection.execute(
+        select(CategoryStat.category, CategoryStat.count).where(CategoryStat.count != 0)
+    ).all())
+    if actual == stored:
+        return False
+    connection.execute(delete(CategoryStat))
+    if actual:
+        connection.execute(insert(CategoryStat), [
+            {"category": category, "count": count} for category, count in actual.items()
+        ])
+    return True
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    inserted = [(obj.id, obj.category) for obj in session.new if isinstance(obj, Phrase)]
+    if inserted:
+        session.info.setdefault(_PENDING_KEY, []).extend(inserted)
+    if any(isinstance(obj, Phrase) for obj in session.deleted) or any(
+        isinstance(obj, Phrase) for obj in session.dirty
+    ):
+        # Rare (the app only ever inserts): simply reload on next use
+        session.info[_RESET_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session):
+    inserted = session.info.pop(_PENDING_KEY, None)
+    reset = session.info.pop(_RESET_KEY, False)
+    if not inserted and not reset:
+        return
+    bind = session.get_bind()
+    if reset:
+        random_index.reset(bind)
+    elif inserted:
+        random_index.add(bind, inserted)
+    bump_version()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_RESET_KEY, None)
+
+
+@event.listens_for(Phrase.__table__, "after_create")
+@event.listens_for(Phrase.__table__, "after_drop")
+def _schema_changed(target, connection, **kw):
+    invalidate(connection)
@@ -1,19 +1,164 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
-from app.config import DATABASE_URL
+from typing import AsyncIterator, Callable, Protocol, TypeVar
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Engine, Result, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+from starlette.concurrency import run_in_threadpool
+
+from app.config import (
+    DATABASE_URL, SQLITE_TUNING, SQLITE_PRAGMAS, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+)
+
+T = TypeVar("T")
+
+# DATABASE_URL may name either a sync or an async driver (e.g. sqlite:// or
+# sqlite+aiosqlite://); each engine below gets the variant it needs
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"}
+
+
+def sync_url(url: str) -> URL:
+    parsed = make_url(url)
+    if parsed.get_driver_name() in ASYNC_DRIVERS.values():
+        return parsed.set(drivername=parsed.get_backend_name())
+    return parsed
+
+
+def async_url(url: str) -> URL:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if parsed.get_driver_name() in ASYNC_DRIVERS.values() or backend not in ASYNC_DRIVERS:
+        return parsed
+    return parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+def pool_options(url: str, poolclass: type[Pool]) -> dict:
+    """Queue pool sizing; in-memory SQLite uses a single shared connection instead.
+
+    The pool class is explicit because aiosqlite file databases would
+    otherwise default to NullPool and reconnect on every request.
+    """
+    database = make_url(url).database
+    if url.startswith("sqlite") and (not database or database == ":memory:"):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+
+
+def apply_sqlite_pragmas(engine: Engine, pragmas: dict = SQLITE_PRAGMAS):
+    """Run the PRAGMA profile on every new connection of ``engine``.
+
+    WAL lets readers proceed while the scheduler jobs write, and
+    synchronous=NORMAL skips the fsync on each commit (still durable across
+    application crashes, only the last commits can be lost on power failure).
+    """
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
 
 connect_args = {}
 if DATABASE_URL.startswith("sqlite"):
     connect_args["check_same_thread"] = False
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
+# Sync engine: startup (create_all, seeding) and scripts
+engine = create_engine(sync_url(DATABASE_URL), connect_args=connect_args, **pool_options(DATABASE_URL, QueuePool))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine: request handlers and scheduler jobs, without tying up threads
+async_engine = create_async_engine(async_url(DATABASE_URL), **pool_options(DATABASE_URL, AsyncAdaptedQueuePool))
+
+if DATABASE_URL.startswith("sqlite") and SQLITE_TUNING:
+    apply_sqlite_pragmas(engine)
+    apply_sqlite_pragmas(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 
+# Request handlers await the database either way. With an async driver in
+# DATABASE_URL (sqlite+aiosqlite://, postgresql+asyncpg://) they use an
+# AsyncSession on the event loop; with a sync one (sqlite://, the default) a
+# sync Session on Starlette's threadpool, which serves short CPU-bound SQLite
+# queries faster than aiosqlite's per-call thread hop
+ASYNC_HANDLERS = make_url(DATABASE_URL).get_driver_name() in ASYNC_DRIVERS.values()
+
+
+class HandlerSession(Protocol):
+    """What request handlers may use of the session get_async_db yields.
+
+    Both AsyncSession and ThreadedSession provide it. Calls need not share a
+    transaction (ThreadedSession runs each in its own), so handlers only read
+    and must not rely on two calls seeing the same snapshot.
+    """
+
+    def get_bind(self): ...
+
+    async def execute(self, statement, params=None) -> Result: ...
+
+    async def run_sync(self, fn: Callable[..., T], *args, **kwargs) -> T: ...
+
+
+class ThreadedSession:
+    """HandlerSession over a sync Session whose calls run on the threadpool.
+
+    Each call is a transaction of its own: rows are fetched and the connection
+    goes back to the pool on the worker thread, before control returns to the
+    event loop. Holding it across awaits would let threads blocked on an empty
+    pool starve the sessions that could give a connection back.
+    """
+
+    def __init__(self, session: Session):
+        self.sync_session = session
+
+    def get_bind(self):
+        return self.sync_session.get_bind()
+
+    async def _call(self, fn: Callable[[], T]) -> T:
+        def run():
+            try:
+                return fn()
+            finally:
+                self.sync_session.close()
+
+        return await run_in_threadpool(run)
+
+    async def execute(self, statement, params=None) -> Result:
+        return await self._call(lambda: self.sync_session.execute(statement, params).freeze()())
+
+    async def run_sync(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        return await self._call(lambda: fn(self.sync_session, *args, **kwargs))
+
+    async def close(self):
+        # Every call already closed the session behind it
+        pass
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncIterator[HandlerSession]:
+    """Session for the async handlers: an AsyncSession, or a ThreadedSession
+    when DATABASE_URL names a sync driver (see ASYNC_HANDLERS)."""
+    if ASYNC_HANDLERS:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+    db = ThreadedSession(SessionLocal())
+    try:
+        yield db
+    finally:
+        await db.close()
@@ -0,0 +1,204 @@
+"""Screenshot preprocessing before images are sent upstream.
+
+Phone screenshots arrive as multi-megabyte PNGs at full resolution, but the
+model only needs to read the chat bubbles. Each image is decoded, rotated
+upright, downscaled to IMAGE_MAX_EDGE, and re-encoded as IMAGE_FORMAT at
+IMAGE_QUALITY without any metadata. Identical images within a request are
+sent once.
+
+Images come either base64-encoded in a JSON body (ImageContent) or as
+multipart uploads whose content sits in a spooled temporary file
+(UploadFile). load_images() decodes or reads each one and hashes it once,
+off the event loop; the digest serves both the reply cache key and dedupe.
+"""
+
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import math
+import threading
+from dataclasses import dataclass, field
+from typing import Sequence, Union
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from starlette.datastructures import UploadFile
+
+from app.config import IMAGE_FORMAT, IMAGE_MAX_EDGE, IMAGE_QUALITY
+from app.schemas import ImageContent
+
+logger = logging.getLogger(__name__)
+
+# The API scales anything larger down to fit these before counting tokens
+API_MAX_EDGE = 1568
+API_MAX_TOKENS = 1600
+PIXELS_PER_TOKEN = 750
+
+MEDIA_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+ImageSource = Union[ImageContent, UploadFile]
+
+
+class ImageTooLarge(ValueError):
+    """An image declares more pixels than Pillow will decode (a decompression bomb)."""
+
+
+def read_image(image: ImageSource) -> bytes:
+    """The image's binary content (undecodable base64 is returned as its raw text)."""
+    if isinstance(image, UploadFile):
+        image.file.seek(0)
+        return image.file.read()
+    try:
+        return base64.b64decode(image.data, validate=True)
+    except (binascii.Error, ValueError):
+        return image.data.encode()
+
+
+def image_media_type(image: ImageSource) -> str:
+    if isinstance(image, UploadFile):
+        return image.content_type or "image/jpeg"
+    return image.media_type
+
+
+@dataclass(frozen=True)
+class LoadedImage:
+    """An image's bytes, read once, with the digest that identifies it."""
+    source: ImageSource
+    media_type: str
+    raw: bytes
+    digest: str
+
+
+def load_image(image: Union[ImageSource, LoadedImage]) -> LoadedImage:
+    """Read and hash ``image``. Blocking: run it off the event loop."""
+    if isinstance(image, LoadedImage):
+        return image
+    raw = read_image(image)
+    media_type = image_media_type(image)
+    digest = hashlib.sha256(media_type.encode() + b":" + raw).hexdigest()
+    return LoadedImage(image, media_type, raw, digest)
+
+
+def load_images(images: Sequence[Union[ImageSource, LoadedImage]]) -> list[LoadedImage]:
+    return [load_image(image) for image in images]
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Approximate image tokens billed for a ``width`` x ``height`` image."""
+    scale = min(1.0, API_MAX_EDGE / max(width, height))
+    tokens = math.ceil(round(width * scale) * round(height * scale) / PIXELS_PER_TOKEN)
+    return min(tokens, API_MAX_TOKENS)
+
+
+@dataclass
+class PreparedImages:
+    images: list[ImageContent] = field(default_factory=list)
+    duplicates: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+def _reencode(raw: bytes, max_edge: int, fmt: str, quality: int) -> tuple[bytes, tuple[int, int], tuple[int, int]]:
+    with Image.open(io.BytesIO(raw)) as image:
+        original_size = image.size
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            # JPEG has no alpha channel: flatten transparent areas onto white
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, "white")
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        if max_edge and max(image.size) > max_edge:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        out = io.BytesIO()
+        # Saving without exif/icc_profile/pnginfo drops all metadata
+        image.save(out, format=fmt, quality=quality, optimize=True)
+        return out.getvalue(), original_size, image.size
+
+
+def prepare_images(
+    images: Sequence[Union[ImageSource, LoadedImage]],
+    max_edge: int = IMAGE_MAX_EDGE,
+    fmt: str = IMAGE_FORMAT,
+    quality: int = IMAGE_QUALITY,
+) -> PreparedImages:
+    """Downscale, re-encode and dedupe ``images``. CPU-bound: run it off the event loop.
+
+    Images that fail to decode are passed through unchanged, leaving the
+    upstream API to report the problem. Raises ImageTooLarge for images over
+    Pillow's pixel limit, which must not be decoded at all.
+    """
+    result = PreparedImages()
+    seen: dict[str, int] = {}  # digest -> tokens the first copy would have cost
+    for image in map(load_image, images):
+        raw, digest = image.raw, image.digest
+        result.bytes_before += len(raw)
+        if digest in seen:
+            result.duplicates += 1
+            result.tokens_before += seen[digest]
+            continue
+        try:
+            encoded, before, after = _reencode(raw, max_edge, fmt, quality)
+        except Image.DecompressionBombError as e:
+            raise ImageTooLarge(str(e)) from e
+        except (UnidentifiedImageError, OSError, ValueError) as e:
+            logger.warning("Forwarding undecodable image unchanged: %s", e)
+            seen[digest] = 0
+            if isinstance(image.source, ImageContent):
+                result.images.append(image.source)
+            else:
+                result.images.append(ImageContent(data=base64.b64encode(raw).decode(), media_type=image.media_type))
+            result.bytes_after += len(raw)
+            continue
+        seen[digest] = estimate_image_tokens(*before)
+        result.images.append(ImageContent(
+            data=base64.b64encode(encoded).decode(), media_type=MEDIA_TYPES[fmt],
+        ))
+        result.bytes_after += len(encoded)
+        result.tokens_before += seen[digest]
+        result.tokens_after += estimate_image_tokens(*after)
+    return result
+
+
+class ImageSavings:
+    """Running totals of what preprocessing saved across chat requests."""
+
+    FIELDS = ("images", "duplicates", "bytes_before", "bytes_after", "tokens_before", "tokens_after")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def record(self, prepared: PreparedImages):
+        with self._lock:
+            self.requests += 1
+            self.totals["images"] += len(prepared.images) + prepared.duplicates
+            for name in self.FIELDS[1:]:
+                self.totals[name] += getattr(prepared, name)
+
+    def clear(self):
+        with self._lock:
+            self.requests = 0
+            self.totals = dict.fromkeys(self.FIELDS, 0)
+
+    def stats(self) -> dict:
+        totals = dict(self.totals)
+        return {
+            "requests": self.requests,
+            **totals,
+            "bytes_saved": totals["bytes_before"] - totals["bytes_after"],
+            "tokens_saved": totals["tokens_before"] - totals["tokens_after"],
+        }
+
+
+image_savings = ImageSavings()
@@ -0,0 +1,219 @@
+"""Shared upstream LLM client.
+
+One AsyncAnthropic client, and so one httpx connection pool, is created in
+the app lifespan and reused by the chat router and the agents, so requests
+reuse warm keep-alive connections instead of paying client construction and
+a TLS handshake each time.
+"""
+
+import threading
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Callable, Optional, Sequence
+
+import anthropic
+import httpx
+from fastapi import Request
+
+from app.config import (
+    CLAUDE_API_KEY,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_KEEPALIVE_EXPIRY,
+    LLM_CONNECT_TIMEOUT,
+    LLM_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def create_llm_client(api_key: Optional[str] = None, **kwargs) -> anthropic.AsyncAnthropic:
+    """Build an AsyncAnthropic client over a tuned, long-lived httpx pool."""
+    # The SDK's own client class keeps its defaults (TCP keepalive, redirects)
+    http_client = anthropic.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=anthropic.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+    return anthropic.AsyncAnthropic(
+        api_key=api_key or CLAUDE_API_KEY or None, http_client=http_client, **kwargs
+    )
+
+
+def get_llm_client(request: Request) -> anthropic.AsyncAnthropic:
+    """FastAPI dependency returning the client created by the lifespan."""
+    return request.app.state.llm_client
+
+
+class TokenUsage:
+    """Running totals of upstream token usage, including prompt-cache reads and writes."""
+
+    FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def record(self, usage):
+        """Add one response's ``usage``; cache fields are None when the prompt had no breakpoints."""
+        with self._lock:
+            self.requests += 1
+            for field in self.FIELDS:
+                self.totals[field] += getattr(usage, field, None) or 0
+
+    def record_cancelled(self, generated_tokens: int, max_tokens: int):
+        """Count a generation stopped before it finished.
+
+        The output it would still have produced is estimated from the average
+        completed reply (``max_tokens`` until there is one).
+        """
+        with self._lock:
+            expected = round(self.totals["output_tokens"] / self.requests) if self.requests else max_tokens
+            self.cancelled += 1
+            self.output_tokens_saved += max(0, expected - generated_tokens)
+
+    def clear(self):
+        with self._lock:
+            self.requests = 0
+            self.cancelled = 0
+            self.output_tokens_saved = 0
+            self.totals = dict.fromkeys(self.FIELDS, 0)
+
+    def stats(self) -> dict:
+        totals = dict(self.totals)
+        # input_tokens counts only the uncached part of the prompt
+        prompt = totals["input_tokens"] + totals["cache_creation_input_tokens"] + totals["cache_read_input_tokens"]
+        return {
+            "requests": self.requests,
+            **totals,
+            "cache_read_ratio": round(totals["cache_read_input_tokens"] / prompt, 4) if prompt else 0.0,
+            "cancelled": self.cancelled,
+            "output_tokens_saved": self.output_tokens_saved,
+        }
+
+
+llm_usage = TokenUsage()
+
+
+class StreamAttempt:
+    """One model's message stream, opened up to its first text delta."""
+
+    def __init__(self, client: anthropic.AsyncAnthropic, model: str, kwargs: dict):
+        self.model = model
+        self.ttft: Optional[float] = None
+        self.started: Optional[float] = None
+        self.first_text: Optional[str] = None
+        self.stream = None
+        self._client = client
+        self._kwargs = kwargs
+        self._manager = None
+        self._texts: Optional[AsyncIterator[str]] = None
+
+    async def open(self) -> "StreamAttempt":
+        self.started = started = time.monotonic()
+        self._manager = self._client.messages.stream(model=self.model, **self._kwargs)
+        self.stream = await self._manager.__aenter__()
+        self._texts = self.stream.text_stream.__aiter__()
+        try:
+            self.first_text = await self._texts.__anext__()
+        except StopAsyncIteration:
+            pass
+        self.ttft = time.monotonic() - started
+        return self
+
+    def elapsed(self) -> float:
+        """Seconds since the attempt started (0 if it never did)."""
+        return time.monotonic() - self.started if self.started is not None else 0.0
+
+    async def texts(self) -> AsyncIterator[str]:
+        """All text deltas, starting with the one already received."""
+        if self.first_text is not None:
+            yield self.first_text
+        async for text in self._texts:
+            yield text
+
+    async def close(self):
+        if self.stream is not None:
+            self.stream = None
+            await self._manager.__aexit__(None, None, None)
+
+
+async def _discard(task: asyncio.Task, attempt: StreamAttempt):
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+    await attempt.close()
+
+
+async def open_first_token(
+    client: anthropic.AsyncAnthropic,
+    models: Sequence[str],
+    deadline: Optional[float],
+    strategy: str = "hedge",
+    reserve: Optional[Callable[[], Optional[Callable[[], None]]]] = None,
+    **kwargs,
+) -> StreamAttempt:
+    """Open a stream on the first model that produces a token.
+
+    ``models`` are tried in order when one fails with an APIError. If the
+    primary has not produced its first token within ``deadline`` seconds, the
+    next model is started: raced against it ("hedge", the slower one is
+    cancelled) or instead of it ("cancel"). A hedge needs capacity for a
+    second stream: ``reserve`` is called first and returns a release callback,
+    or None to switch instead. The caller must close() the returned attempt.
+    Raises the last APIError when every model fails.
+    """
+    pending: dict[asyncio.Task, StreamAttempt] = {}
+    remaining = list(models)
+
+    def start():
+        attempt = StreamAttempt(client, remaining.pop(0), kwargs)
+        pending[asyncio.create_task(attempt.open())] = attempt
+
+    start()
+    error: Optional[anthropic.APIError] = None
+    release_hedge = None
+    try:
+        while pending:
+            timeout = deadline if deadline and remaining and len(pending) == 1 else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                slow = next(iter(pending.values()))
+                hedge = strategy == "hedge"
+                if hedge and reserve is not None:
+                    release_hedge = reserve()
+                    hedge = release_hedge is not None
+                logger.info("%s: no first token after %.2fs, %s with %s",
+                            slow.model, deadline, "hedging" if hedge else "switching", remaining[0])
+                if not hedge:
+                    logger.info("%s cancelled after %.3fs without a first token", slow.model, slow.elapsed())
+                    await _discard(*pending.popitem())
+                start()
+                deadline = None
+                continue
+            for task in done:
+                attempt = pending.pop(task)
+                exc = task.exception()
+                if exc is None:
+                    logger.info("%s won with TTFT %.3fs", attempt.model, attempt.ttft)
+                    return attempt
+                if not isinstance(exc, anthropic.APIError):
+                    raise exc
+                logger.info("%s failed after %.3fs before its first token: %s", attempt.model, attempt.elapsed(), exc)
+                error = exc
+                await attempt.close()
+            if not pending and remaining:
+                start()
+        raise error
+    finally:
+        for task, attempt in pending.items():
+            logger.info("%s cancelled after %.3fs without a first token", attempt.model, attempt.elapsed())
+            await _discard(task, attempt)
+        if release_hedge is not None:
+            release_hedge()
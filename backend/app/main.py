@@ -5,29 +5,46 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 
-from app.database import engine, Base, SessionLocal
+from app.database import engine, async_engine, Base, SessionLocal
 from app.models import Phrase  # noqa: F401 - ensure model is registered
 from app.seed_data import seed_phrases
+from app.search import ensure_search_index
+from app.corpus import ensure_category_stats, random_index
 from app.routers import phrases, chat
 from app.config import AGENT_ENABLED
+from app.llm import create_llm_client, llm_usage
+from app.chat_cache import chat_cache
+from app.images import image_savings
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: create tables and seed data
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        # create_all skips indexes added to tables that already exist
+        for index in Phrase.__table__.indexes:
+            index.create(conn, checkfirst=True)
+        ensure_search_index(conn)
+        ensure_category_stats(conn)
     db = SessionLocal()
     try:
         seed_phrases(db)
+        random_index.load(db)
     finally:
         db.close()
+    # One pooled upstream client for chat and agents, closed on shutdown
+    app.state.llm_client = create_llm_client()
     if AGENT_ENABLED:
         from app.scheduler import start_scheduler, shutdown_scheduler
-        start_scheduler()
+        start_scheduler(app.state.llm_client)
     yield
     if AGENT_ENABLED:
         from app.scheduler import shutdown_scheduler
         shutdown_scheduler()
+    await chat.replays.close()
+    await app.state.llm_client.close()
+    await async_engine.dispose()
 
 
 app = FastAPI(
@@ -43,6 +60,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[phrases.NEXT_CURSOR_HEADER],
 )
 
 # Include routers
@@ -55,6 +73,18 @@ async def health_check():
     return {"status": "ok"}
 
 
+@app.get("/api/stats")
+async def stats():
+    return {
+        "phrase_cache": phrases.response_cache.stats(),
+        "chat_cache": chat_cache.stats(),
+        "llm_usage": llm_usage.stats(),
+        "images": image_savings.stats(),
+        "chat_admission": {**chat.admission.stats(), "rate_limited": chat.rate_limiter.rejected},
+        "chat_replay": chat.replays.stats(),
+    }
+
+
 # Mount static files for production (serves frontend build)
 static_dir = os.path.join(os.path.dirname(__file__), "..", "static")
 
@@ -1,6 +1,7 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, Text, String, Boolean, DateTime, Index
+from sqlalchemy import Column, Integer, Text, String, Boolean, DateTime, Index, DDL, event, insert, inspect, select, update
 from app.database import Base
+from app import search
 
 
 class Phrase(Base):
@@ -12,3 +13,77 @@ class Phrase(Base):
     tags = Column(String(200), nullable=True)
     is_pickup_line = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Keyset pagination, newest first, with and without a category filter
+        Index("ix_phrases_category_created_at_id", "category", "created_at", "id"),
+        Index("ix_phrases_created_at_id", "created_at", "id"),
+    )
+
+
+class CategoryStat(Base):
+    """Phrase count per category, maintained alongside every phrase write."""
+    __tablename__ = "category_stats"
+
+    category = Column(String(50), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class CachedReply(Base):
+    """A finished chat reply, persisted by the chat response cache."""
+    __tablename__ = "chat_replies"
+
+    key = Column(String(64), primary_key=True)
+    reply = Column(Text, nullable=False)
+    input_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+def _bump_category(connection, category: str, delta: int):
+    result = connection.execute(
+        update(CategoryStat)
+        .where(CategoryStat.category == category)
+        .values(count=CategoryStat.count + delta)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(CategoryStat).values(category=category, count=delta))
+
+
+# Keep the FTS5 search index (SQLite only) in step with the phrases table
+event.listen(Phrase.__table__, "after_create", DDL(search.CREATE_FTS_SQL).execute_if(dialect="sqlite"))
+event.listen(Phrase.__table__, "before_drop", DDL(search.DROP_FTS_SQL).execute_if(dialect="sqlite"))
+
+
+# Row-level upkeep of the search index and category_stats, run inside the
+# transaction of the phrase write itself
+@event.listens_for(Phrase, "after_insert")
+def _index_phrase(mapper, connection, target):
+    if connection.dialect.name == "sqlite":
+        search.index_phrase(connection, target.id, target.content, target.tags)
+    _bump_category(connection, target.category, 1)
+
+
+@event.listens_for(Phrase, "after_update")
+def _reindex_phrase(mapper, connection, target):
+    if connection.dialect.name == "sqlite":
+        search.unindex_phrase(connection, target.id)
+        search.index_phrase(connection, target.id, target.content, target.tags)
+
+
+@event.listens_for(Phrase, "before_update")
+def _move_category(mapper, connection, target):
+    if not inspect(target).attrs.category.history.has_changes():
+        return
+    # The old value may have been expired rather than kept in history
+    old = connection.execute(select(Phrase.category).where(Phrase.id == target.id)).scalar()
+    if old != target.category:
+        _bump_category(connection, old, -1)
+        _bump_category(connection, target.category, 1)
+
+
+@event.listens_for(Phrase, "after_delete")
+def _unindex_phrase(mapper, connection, target):
+    if connection.dialect.name == "sqlite":
+        search.unindex_phrase(connection, target.id)
+    _bump_category(connection, target.category, -1)
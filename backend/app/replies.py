@@ -0,0 +1,73 @@
+"""Incremental parsing of numbered chat replies.
+
+The system prompt asks for exactly three replies numbered with keycap emoji
+(1️⃣ 2️⃣ 3️⃣). ReplyParser finds those markers in the text deltas as they
+stream in (a marker may be split across deltas) and turns the text into
+reply_start / reply_delta / reply_end events, so clients can show and copy
+each reply as soon as it is complete instead of re-parsing the whole text.
+"""
+
+import re
+from typing import Optional
+
+# A keycap digit: digit, optional variation selector, combining enclosing keycap
+_MARKER = re.compile(r"([1-9])️?⃣")
+# The end of a delta that may be the first part of a marker
+_PARTIAL_MARKER = re.compile(r"[1-9]️?$")
+
+
+class ReplyParser:
+    """Feed text deltas in order; get back reply events as dicts with an ``event`` key.
+
+    Text before the first marker (normally none) is reported as reply 0.
+    """
+
+    def __init__(self):
+        self.index: Optional[int] = None
+        self._parts: list[str] = []
+        self._held = ""
+
+    def feed(self, text: str) -> list[dict]:
+        text = self._held + text
+        partial = _PARTIAL_MARKER.search(text)
+        cut = partial.start() if partial else len(text)
+        self._held = text[cut:]
+        return self._consume(text[:cut])
+
+    def close(self) -> list[dict]:
+        """Events for the held-back tail, and the end of the last reply."""
+        events = self._consume(self._held)
+        self._held = ""
+        if self.index is not None:
+            events.append(self._end())
+        return events
+
+    def _consume(self, text: str) -> list[dict]:
+        events = []
+        position = 0
+        for marker in _MARKER.finditer(text):
+            events += self._delta(text[position:marker.start()])
+            if self.index is not None:
+                events.append(self._end())
+            self.index = int(marker.group(1))
+            events.append({"event": "reply_start", "index": self.index})
+            position = marker.end()
+        events += self._delta(text[position:])
+        return events
+
+    def _delta(self, text: str) -> list[dict]:
+        events = []
+        if self.index is None:
+            if not text.strip():
+                return events
+            self.index = 0
+            events.append({"event": "reply_start", "index": 0})
+        if text:
+            self._parts.append(text)
+            events.append({"event": "reply_delta", "index": self.index, "text": text})
+        return events
+
+    def _end(self) -> dict:
+        event = {"event": "reply_end", "index": self.index, "text": "".join(self._parts).strip()}
+        self._parts = []
+        return event
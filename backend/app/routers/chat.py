@@ -1,13 +1,64 @@
+import asyncio
 import json
-from fastapi import APIRouter, HTTPException
+import logging
+import math
+from typing import AsyncIterator, Callable, Optional, Sequence, Union
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.datastructures import FormData, UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
 import anthropic
 
-from app.config import CLAUDE_API_KEY
-from app.schemas import ChatRequest
+from app.chat_cache import CachedChatReply, chat_cache, chat_cache_key
+from app.admission import AdmissionQueue, RateLimiter, Ticket
+from app.database import HandlerSession, get_async_db
+from app.config import (
+    CLAUDE_API_KEY,
+    CHAT_COALESCE_CHARS,
+    CHAT_COALESCE_MS,
+    CHAT_DISCONNECT_GRACE,
+    CHAT_MAX_CONCURRENT,
+    CHAT_MAX_QUEUE,
+    CHAT_QUEUE_RETRY_AFTER,
+    CHAT_RATE_PER_MINUTE,
+    CHAT_RATE_BURST,
+    CHAT_REPLAY_MAX_BYTES,
+    CHAT_REPLAY_TTL,
+    CHAT_SUGGESTIONS,
+    CHAT_TTFT_DEADLINE,
+    CHAT_TTFT_STRATEGY,
+    CHAT_UPLOAD_MAX_BYTES,
+    CHAT_UPLOAD_MAX_FILES,
+    TRUST_FORWARDED_FOR,
+)
+from app.images import ImageSource, ImageTooLarge, LoadedImage, image_savings, load_images, prepare_images
+from app.llm import get_llm_client, llm_usage, open_first_token
+from app.replies import ReplyParser
+from app.schemas import ChatRequest, ImageContent
+from app.streaming import ReplayBuffer, ReplayStore, coalesce
+from app.suggestions import suggest_phrases
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api", tags=["chat"])
 
+# Upstream streams running at once (plus a bounded line waiting for a slot),
+# and a per-client token bucket
+admission = AdmissionQueue(CHAT_MAX_CONCURRENT, CHAT_MAX_QUEUE)
+rate_limiter = RateLimiter(CHAT_RATE_PER_MINUTE / 60, CHAT_RATE_BURST)
+
+# Frames of running and recent generations, for clients resuming a dropped stream
+replays = ReplayStore(CHAT_REPLAY_TTL, CHAT_REPLAY_MAX_BYTES, CHAT_DISCONNECT_GRACE)
+
+MAX_TOKENS = 1024
+
+# Primary model first; the next one takes over on errors or a missed TTFT deadline
+CHAT_MODELS = ["claude-opus-4-6", "claude-sonnet-4-6"]
+
 STYLE_MAP = {
     "humorous": "幽默型",
     "gentle": "温柔型",
@@ -26,81 +77,515 @@ SYSTEM_PROMPT = """你是一个专业的恋爱聊天回复助手，擅长高情
 2. 回复长度适中，像正常聊天一样
 3. 要有层次感，3条回复从不同角度切入
 4. 用编号格式输出：1️⃣ 2️⃣ 3️⃣
-5. 直接给出回复内容，不要加解释
+5. 直接给出回复内容，不要加解释"""
 
-风格说明：
+STYLE_GUIDE = """风格说明：
 - 幽默型：用幽默感和机智化解，让对方忍不住笑
 - 温柔型：温暖体贴，让对方感受到关心和在乎
 - 直球型：直接表达心意，真诚不做作
 - 文艺型：有文艺感和诗意，用优美的表达打动人心"""
 
+# Both blocks are identical on every call, so each ends in a prompt-cache
+# breakpoint; only the user turn below them varies per request
+SYSTEM_BLOCKS = [
+    {"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}},
+    {"type": "text", "text": STYLE_GUIDE, "cache_control": {"type": "ephemeral"}},
+]
 
-async def stream_chat(request: ChatRequest):
-    if not CLAUDE_API_KEY:
-        yield f"data: {json.dumps({'error': 'API key not configured'})}\n\n"
-        return
 
-    if not request.their_message.strip() and not request.images:
-        yield f"data: {json.dumps({'error': '请输入文字或上传截图'})}\n\n"
-        return
+def _frame(payload: dict) -> str:
+    """A ``data:`` frame; an ``event`` key in ``payload`` becomes the SSE event name."""
+    if "event" in payload:
+        payload = dict(payload)
+        event = payload.pop("event")
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _requested_styles(request: ChatRequest) -> dict[str, str]:
+    """Style key -> label for each generation the request asks for."""
+    keys = request.styles if request.styles else [request.style]
+    return {key: STYLE_MAP.get(key, "幽默型") for key in dict.fromkeys(keys)}
 
-    style_label = STYLE_MAP.get(request.style, "幽默型")
 
-    # Build content blocks: images first, then text
+def _user_content(request: ChatRequest, style_label: str, images: Sequence[ImageContent]) -> list[dict]:
+    # Images first, then text
     content_blocks = []
-    if request.images:
-        for img in request.images:
-            content_blocks.append({
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": img.media_type,
-                    "data": img.data,
-                },
-            })
+    for img in images:
+        content_blocks.append({
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": img.media_type,
+                "data": img.data,
+            },
+        })
 
     text_parts = []
     if request.their_message.strip():
         text_parts.append(f"对方发来的消息：「{request.their_message}」")
-    if request.images:
+    if images:
         text_parts.append("（请结合上面的聊天截图理解对方的意思）")
     text_parts.append(f"\n请用【{style_label}】风格生成3条回复。")
     if request.context:
         text_parts.append(f"\n聊天背景：{request.context}")
 
     content_blocks.append({"type": "text", "text": "\n".join(text_parts)})
+    return content_blocks
+
+
+def _spare_slot() -> Optional[Callable[[], None]]:
+    """An admission slot for a hedged second stream, if one is free."""
+    ticket = admission.try_acquire()
+    return ticket.release if ticket is not None else None
+
+
+async def _generate(
+    client: anthropic.AsyncAnthropic, content_blocks: list[dict], cache_key: str
+) -> AsyncIterator[dict]:
+    """Payloads for one generation: ``content`` deltas, or an ``error`` that ends it.
+
+    A successful reply is recorded in the usage totals and the reply cache;
+    a cancelled one (the client left) in the tokens it saved.
+    """
+    # Fall back on errors before the first token, and hedge when the primary
+    # is slow to start; async throughout, so other requests keep being served
+    parts = []
+    try:
+        attempt = await open_first_token(
+            client, CHAT_MODELS, CHAT_TTFT_DEADLINE, CHAT_TTFT_STRATEGY, reserve=_spare_slot,
+            max_tokens=MAX_TOKENS,
+            system=SYSTEM_BLOCKS,
+            messages=[{"role": "user", "content": content_blocks}],
+        )
+    except anthropic.APIError as e:
+        yield {"error": str(e)}
+        return
+    except asyncio.CancelledError:
+        llm_usage.record_cancelled(0, MAX_TOKENS)
+        raise
+
+    try:
+        # Bursts of tiny deltas become one frame: fewer encodes and writes
+        async for text in coalesce(attempt.texts(), CHAT_COALESCE_CHARS, CHAT_COALESCE_MS / 1000):
+            parts.append(text)
+            yield {"content": text}
+        usage = (await attempt.stream.get_final_message()).usage
+    except anthropic.APIError as e:
+        # Part of the reply is already on screen: report instead of restarting
+        yield {"error": str(e)}
+        return
+    except asyncio.CancelledError:
+        # Closing the stream below stops upstream generation; CJK replies run
+        # at roughly one token per character
+        llm_usage.record_cancelled(sum(map(len, parts)), MAX_TOKENS)
+        raise
+    finally:
+        await attempt.close()
+
+    llm_usage.record(usage)
+    if parts:
+        prompt_tokens = (
+            usage.input_tokens
+            + (usage.cache_creation_input_tokens or 0)
+            + (usage.cache_read_input_tokens or 0)
+        )
+        await chat_cache.put(cache_key, CachedChatReply(
+            "".join(parts), prompt_tokens, usage.output_tokens,
+        ))
+
+
+async def _reply_events(payloads: AsyncIterator[dict]) -> AsyncIterator[dict]:
+    """``content`` deltas regrouped into reply_start/reply_delta/reply_end events."""
+    parser = ReplyParser()
+    failed = False
+    async for payload in payloads:
+        if "content" in payload:
+            for event in parser.feed(payload["content"]):
+                yield event
+        else:
+            failed = failed or "error" in payload
+            yield payload
+    # A reply cut short by an error is not reported as ended
+    if not failed:
+        for event in parser.close():
+            yield event
 
-    client = anthropic.Anthropic(api_key=CLAUDE_API_KEY)
-    models = ["claude-opus-4-6", "claude-sonnet-4-6"]
 
-    for i, model in enumerate(models):
+def _cached_payloads(request: ChatRequest, text: str) -> list[dict]:
+    if request.events == "replies":
+        parser = ReplyParser()
+        return parser.feed(text) + parser.close()
+    return [{"content": text}]
+
+
+async def _merge(
+    streams: dict[str, AsyncIterator[dict]], limit: Optional[int] = None,
+) -> AsyncIterator[tuple[str, Optional[dict]]]:
+    """Interleave several payload streams as they produce; ``(key, None)`` marks one finishing.
+
+    At most ``limit`` streams run at once; the next starts when one finishes.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    queued = iter(streams.items())
+    tasks = []
+
+    async def pump(key: str, stream: AsyncIterator[dict]):
+        try:
+            async for payload in stream:
+                await queue.put((key, payload))
+        finally:
+            await queue.put((key, None))
+
+    def launch():
+        item = next(queued, None)
+        if item is not None:
+            tasks.append(asyncio.create_task(pump(*item)))
+
+    for _ in range(limit or len(streams)):
+        launch()
+    running = len(streams)
+    try:
+        while running:
+            key, payload = await queue.get()
+            if payload is None:
+                running -= 1
+                launch()
+            yield key, payload
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def stream_chat(
+    request: ChatRequest,
+    client: anthropic.AsyncAnthropic,
+    ticket: Optional[Ticket] = None,
+    images: Optional[Sequence[Union[ImageSource, LoadedImage]]] = None,
+    suggestions: Optional[dict[str, list[dict]]] = None,
+):
+    """SSE frames for one chat request; ``images`` (e.g. uploads) replace ``request.images``.
+
+    ``suggestions`` (style -> library phrases) go out first as ``suggestions`` events.
+
+    With ``request.styles`` the styles are generated concurrently (as many at
+    once as ``ticket`` has slots) and each frame carries its ``style``; a ``{"style", "done"}`` frame ends each one.
+    With ``request.events == "replies"`` the text comes as reply events
+    instead of ``content`` deltas.
+    """
+    if not CLAUDE_API_KEY:
+        yield f"data: {json.dumps({'error': 'API key not configured'})}\n\n"
+        return
+
+    images = list(request.images or []) if images is None else list(images)
+    if not request.their_message.strip() and not images:
+        yield f"data: {json.dumps({'error': '请输入文字或上传截图'})}\n\n"
+        return
+    if not all(isinstance(image, LoadedImage) for image in images):
+        images = await asyncio.to_thread(load_images, images)
+
+    styles = _requested_styles(request)
+    fan_out = bool(request.styles)
+
+    def tagged(style: str, payload: dict) -> str:
+        return _frame({"style": style, **payload} if fan_out else payload)
+
+    # Library phrases give the user something to read while the model starts
+    for style, phrases in (suggestions or {}).items():
+        yield tagged(style, {"event": "suggestions", "suggestions": phrases})
+
+    # Identical requests replay the stored reply in the same frame format
+    cache_keys = {style: chat_cache_key(request, label, images) for style, label in styles.items()}
+    pending = {}
+    for style, cache_key in cache_keys.items():
+        cached = await chat_cache.get(cache_key)
+        if cached is None:
+            pending[style] = cache_key
+            continue
+        for payload in _cached_payloads(request, cached.text):
+            yield tagged(style, payload)
+        if fan_out:
+            yield tagged(style, {"done": True})
+    if not pending:
+        yield "data: [DONE]\n\n"
+        return
+
+    # Shrink screenshots before they are queued, off the event loop
+    if images:
         try:
-            with client.messages.stream(
-                model=model,
-                max_tokens=1024,
-                system=SYSTEM_PROMPT,
-                messages=[{"role": "user", "content": content_blocks}],
-            ) as stream:
-                for text in stream.text_stream:
-                    yield f"data: {json.dumps({'content': text}, ensure_ascii=False)}\n\n"
-            yield "data: [DONE]\n\n"
+            prepared = await asyncio.to_thread(prepare_images, images)
+        except ImageTooLarge as e:
+            logger.warning("Rejected screenshot: %s", e)
+            yield _frame({"error": "截图尺寸过大，请裁剪后重试"})
             return
-        except anthropic.APIError as e:
-            if i < len(models) - 1:
-                continue
-            yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+        image_savings.record(prepared)
+        logger.info(
+            "Images: %d in, %d sent, %d bytes and ~%d tokens saved",
+            len(images), len(prepared.images), prepared.bytes_saved, prepared.tokens_saved,
+        )
+        images = prepared.images
 
+    # Wait for an upstream slot, telling the client where it stands in line
+    if ticket is not None:
+        async for position in ticket.wait_turn():
+            yield f"event: queue\ndata: {json.dumps({'queue_position': position})}\n\n"
 
-@router.post("/chat")
-async def chat(request: ChatRequest):
+    generations = {
+        style: _generate(client, _user_content(request, styles[style], images), cache_key)
+        for style, cache_key in pending.items()
+    }
+    if request.events == "replies":
+        generations = {style: _reply_events(generation) for style, generation in generations.items()}
+    if not fan_out:
+        [generation] = generations.values()
+        async for payload in generation:
+            yield _frame(payload)
+            if "error" in payload:
+                return
+        yield "data: [DONE]\n\n"
+        return
+
+    # One upstream stream per admission slot: styles beyond the ticket's weight wait their turn
+    async for style, payload in _merge(generations, ticket.weight if ticket is not None else None):
+        yield tagged(style, {"done": True} if payload is None else payload)
+    yield "data: [DONE]\n\n"
+
+
+def _client_address(request: Request) -> str:
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def _check_rate(http_request: Request):
+    """Raise HTTPException unless the API is configured and the client is under its rate limit."""
     if not CLAUDE_API_KEY:
         raise HTTPException(status_code=500, detail="Claude API key not configured")
+    retry_after = rate_limiter.hit(_client_address(http_request))
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429, detail="请求太频繁，请稍后再试",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+async def _suggestions(db: HandlerSession, request: ChatRequest) -> dict[str, list[dict]]:
+    """CHAT_SUGGESTIONS library phrases per requested style; none if the lookup fails."""
+    if CHAT_SUGGESTIONS <= 0:
+        return {}
+    try:
+        return {
+            style: await suggest_phrases(db, request.their_message, style, CHAT_SUGGESTIONS)
+            for style in _requested_styles(request)
+        }
+    except SQLAlchemyError as e:
+        logger.warning("Phrase suggestions unavailable: %s", e)
+        return {}
+
+
+def _admit(request: ChatRequest) -> Ticket:
+    """A ticket with one slot per upstream stream, or HTTPException when the queue is full."""
+    ticket = admission.admit(weight=len(_requested_styles(request)))
+    if ticket is None:
+        raise HTTPException(
+            status_code=429, detail="当前请求太多，请稍后再试",
+            headers={"Retry-After": str(CHAT_QUEUE_RETRY_AFTER)},
+        )
+    return ticket
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+async def _numbered(buffer: ReplayBuffer, seq: int = 0) -> AsyncIterator[str]:
+    """The buffer's frames from ``seq`` on, each with an ``id: <stream>:<seq>`` line."""
+    async for seq, frame in buffer.follow(seq):
+        yield f"id: {buffer.id}:{seq}\n{frame}"
+
+
+def _follow_response(buffer: ReplayBuffer, seq: int = 0) -> StreamingResponse:
+    """Stream ``buffer`` to one client.
+
+    When the client disconnects, Starlette stops iterating; closing the
+    iterator right away lets the buffer count this follower as gone (and
+    cancel the generation if it was the last) without waiting for GC.
+    """
+    frames = _numbered(buffer, seq)
     return StreamingResponse(
-        stream_chat(request),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        },
+        frames, media_type="text/event-stream", headers=SSE_HEADERS, background=BackgroundTask(frames.aclose),
+    )
+
+
+def _fingerprint(request: ChatRequest, images: Sequence[LoadedImage]) -> str:
+    """Identifies what a request asks for, across all its styles and its event format."""
+    labels = ",".join(_requested_styles(request).values())
+    return chat_cache_key(request, f"{labels}|{request.events}", images)
+
+
+def _event_stream(ticket: Ticket, frames: AsyncIterator[str], key: str, cleanup=()) -> StreamingResponse:
+    # The generation runs on its own, so it survives the client's connection
+    # dropping for CHAT_DISCONNECT_GRACE seconds; the ticket goes back when it
+    # ends, however it ends (cancelled included)
+    buffer = replays.start(frames, cleanup=[ticket.release, *cleanup], key=key)
+    return _follow_response(buffer)
+
+
+def _resume(http_request: Request, key: Optional[str] = None) -> Optional[StreamingResponse]:
+    """Continue a stream after the client's ``Last-Event-ID`` (None without one).
+
+    A stream that is no longer buffered raises 410, and one started by a
+    different request (``key``) 409: the client must then drop the text it
+    has and start over, rather than have a new stream appended to it.
+    """
+    last_event_id = http_request.headers.get("last-event-id")
+    if not last_event_id:
+        return None
+    stream_id, _, seq = last_event_id.partition(":")
+    buffer = replays.get(stream_id) if seq.isdigit() else None
+    if buffer is None or not buffer.has(int(seq) + 1):
+        raise HTTPException(status_code=410, detail="回复已过期，请重新生成")
+    if key is not None and buffer.key != key:
+        raise HTTPException(status_code=409, detail="Last-Event-ID 与请求不符")
+    replays.resumed += 1
+    return _follow_response(buffer, int(seq) + 1)
+
+
+def _join(key: str) -> Optional[StreamingResponse]:
+    """Follow an identical generation that is still running, from its first frame,
+    instead of starting another upstream stream."""
+    buffer = replays.running(key)
+    if buffer is None:
+        return None
+    replays.joined += 1
+    return _follow_response(buffer)
+
+
+@router.post("/chat")
+async def chat(
+    request: ChatRequest,
+    http_request: Request,
+    client: anthropic.AsyncAnthropic = Depends(get_llm_client),
+    db: HandlerSession = Depends(get_async_db),
+):
+    # Read and hash the images once: the digests key the reply cache and dedupe them
+    images = await asyncio.to_thread(load_images, request.images or [])
+    key = _fingerprint(request, images)
+    resumed = _resume(http_request, key)
+    if resumed is not None:
+        return resumed
+    suggestions = await _suggestions(db, request)
+    # Checked after the last await, so no identical generation can start in between
+    shared = _join(key)
+    if shared is not None:
+        return shared
+    # Only new generations count against the rate limit, not resumes or joins
+    _check_rate(http_request)
+    ticket = _admit(request)
+    return _event_stream(ticket, stream_chat(request, client, ticket, images, suggestions), key)
+
+
+class _UploadTooLarge(MultiPartException):
+    pass
+
+
+async def _limited(chunks: AsyncIterator[bytes], limit: int) -> AsyncIterator[bytes]:
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        if received > limit:
+            raise _UploadTooLarge(f"Upload exceeds {limit} bytes")
+        yield chunk
+
+
+async def _read_upload(http_request: Request) -> FormData:
+    """Parse a multipart body, spooling file parts to temporary files.
+
+    Oversized bodies are rejected from Content-Length before any of the body
+    is read, or as soon as the running total passes the limit; the parser
+    stops at the first image over CHAT_UPLOAD_MAX_FILES.
+    """
+    if not http_request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise HTTPException(status_code=415, detail="请使用 multipart/form-data 上传")
+    length = http_request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > CHAT_UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="上传内容过大")
+    parser = MultiPartParser(
+        http_request.headers,
+        _limited(http_request.stream(), CHAT_UPLOAD_MAX_BYTES),
+        max_files=CHAT_UPLOAD_MAX_FILES,
+        max_fields=10,
     )
+    try:
+        return await parser.parse()
+    except _UploadTooLarge:
+        raise HTTPException(status_code=413, detail="上传内容过大")
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+
+
+def _upload_request(form: FormData) -> tuple[ChatRequest, list[UploadFile]]:
+    fields = {
+        name: form[name] for name in ("their_message", "style", "events", "context")
+        if form.get(name) not in (None, "")
+    }
+    if form.getlist("styles"):
+        fields["styles"] = form.getlist("styles")
+    try:
+        request = ChatRequest(**fields)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    images = form.getlist("images")
+    for image in images:
+        if not isinstance(image, UploadFile) or not (image.content_type or "").startswith("image/"):
+            raise HTTPException(status_code=400, detail="images 只能是图片文件")
+    return request, images
+
+
+@router.post("/chat/upload")
+async def chat_upload(
+    http_request: Request,
+    client: anthropic.AsyncAnthropic = Depends(get_llm_client),
+    db: HandlerSession = Depends(get_async_db),
+):
+    """/chat with the fields and images as multipart/form-data (binary images, no base64)."""
+    form = await _read_upload(http_request)
+    try:
+        request, uploads = _upload_request(form)
+        images = await asyncio.to_thread(load_images, uploads)
+        key = _fingerprint(request, images)
+        resumed = _resume(http_request, key)
+        if resumed is not None:
+            await form.close()
+            return resumed
+        suggestions = await _suggestions(db, request)
+        shared = _join(key)
+        if shared is not None:
+            await form.close()
+            return shared
+        _check_rate(http_request)
+        ticket = _admit(request)
+    except BaseException:
+        await form.close()
+        raise
+    frames = stream_chat(request, client, ticket, images, suggestions)
+    return _event_stream(ticket, frames, key, cleanup=[form.close])
+
+
+@router.get("/chat/resume")
+async def chat_resume(http_request: Request):
+    """Continue a /chat or /chat/upload stream after its ``Last-Event-ID``.
+
+    The stream id is only known to the client that received it, so resuming
+    needs no request body: nothing (images included) is uploaded again.
+    """
+    resumed = _resume(http_request)
+    if resumed is None:
+        raise HTTPException(status_code=400, detail="缺少 Last-Event-ID")
+    return resumed
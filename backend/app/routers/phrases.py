@@ -1,52 +1,333 @@
-from typing import Optional, List
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+import base64
+import hashlib
+import json
+from datetime import datetime
+from typing import Awaitable, Callable, Optional, List, Union
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+import orjson
+from sqlalchemy import Select, func, literal, select, tuple_, union_all
 
-from app.database import get_db
-from app.models import Phrase
-from app.schemas import PhraseOut, CategoryOut
+from app.cache import LRUCache
+from app.config import PHRASE_CACHE_SIZE, HTTP_CACHE_MAX_AGE, HTTP_CACHE_STALE_WHILE_REVALIDATE
+from app.database import HandlerSession, get_async_db
+from app.corpus import corpus_version, database_key, random_index
+from app.models import CategoryStat, Phrase
+from app.search import build_match_query, fts_match, phrases_fts
+from app.schemas import PhraseOut, CategoryOut, PageRequest, PhraseBatchOut, PhraseBatchRequest
 
 router = APIRouter(prefix="/api/phrases", tags=["phrases"])
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Serialized response bodies, keyed by database, corpus version and the
+# normalized request, so hits skip both the ORM and pydantic. List and
+# category entries are (body, headers) with an ETag hashed from the content,
+# which every worker and restart derives alike
+response_cache = LRUCache(PHRASE_CACHE_SIZE)
+
+_CACHE_CONTROL = (
+    f"public, max-age={HTTP_CACHE_MAX_AGE}, stale-while-revalidate={HTTP_CACHE_STALE_WHILE_REVALIDATE}"
+)
+
+# Handlers select these columns as plain tuples and encode them straight to
+# JSON with orjson; response_model only documents the shape in OpenAPI
+_PHRASE_COLUMNS = (
+    Phrase.id, Phrase.content, Phrase.category, Phrase.tags, Phrase.is_pickup_line, Phrase.created_at,
+)
+_PHRASE_FIELDS = tuple(col.key for col in _PHRASE_COLUMNS)
+
+
+def _phrase_dict(row) -> dict:
+    return dict(zip(_PHRASE_FIELDS, row))
+
+
+def _cache_key(db: HandlerSession, *parts) -> tuple:
+    # Read the version before querying so a concurrent commit can only make
+    # the stored body newer than its key, never older
+    return (database_key(db.get_bind()), corpus_version(), *parts)
+
+
+def _list_key(db: HandlerSession, category: Optional[str], search: Optional[str],
+              limit: int, offset: int, cursor: Optional[str]) -> tuple:
+    """Cache key of one list page, shared by the GET endpoint and batch pages.
+
+    A cursor carries its own position, so the offset only counts without one.
+    """
+    return _cache_key(db, "list", category or None, search or None, limit, None if cursor else offset, cursor)
+
+
+def _json_response(body: bytes, headers: Optional[dict] = None) -> Response:
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _json_list(bodies) -> bytes:
+    """Join already serialized JSON values into a JSON array."""
+    return b"[" + b",".join(bodies) + b"]"
+
+
+def _entry(body: bytes, headers: Optional[dict] = None) -> tuple[bytes, dict]:
+    """A response cache entry: ``body`` and its ``headers`` plus an ETag of both."""
+    headers = headers or {}
+    digest = hashlib.blake2s(body + orjson.dumps(headers), digest_size=12).hexdigest()
+    return body, {**headers, "ETag": f'"{digest}"'}
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+async def _conditional_response(
+    request: Request, key: tuple, build: Callable[[], Awaitable[tuple[bytes, dict]]]
+) -> Response:
+    """Serve ``key`` with validators: 304 if the client's copy is current,
+    otherwise the cached body, building it on a miss."""
+    cached = response_cache.get(key)
+    if cached is None:
+        cached = await build()
+        response_cache.put(key, cached)
+    body, headers = cached
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers={"ETag": headers["ETag"], "Cache-Control": _CACHE_CONTROL})
+    return _json_response(body, {**headers, "Cache-Control": _CACHE_CONTROL})
+
+
+def _encode_cursor(payload: dict) -> str:
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if "o" in payload:
+            return {"o": int(payload["o"])}
+        return {"t": datetime.fromisoformat(payload["t"]), "i": int(payload["i"])}
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 
 @router.get("/", response_model=List[PhraseOut])
-def list_phrases(
+async def list_phrases(
+    request: Request,
     category: Optional[str] = Query(None, description="Filter by category"),
     search: Optional[str] = Query(None, description="Search in content"),
     limit: int = Query(20, ge=1, le=100, description="Number of results"),
-    offset: int = Query(0, ge=0, description="Offset for pagination"),
-    db: Session = Depends(get_db),
+    offset: int = Query(0, ge=0, description="Offset for pagination (prefer cursor)"),
+    cursor: Optional[str] = Query(None, description=f"Opaque cursor from the {NEXT_CURSOR_HEADER} header"),
+    db: HandlerSession = Depends(get_async_db),
 ):
-    query = db.query(Phrase)
+    async def build():
+        phrases, next_cursor = await _query_phrases(db, category, search, limit, offset, cursor)
+        headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+        return _entry(orjson.dumps([_phrase_dict(row) for row in phrases]), headers)
+
+    key = _list_key(db, category, search, limit, offset, cursor)
+    return await _conditional_response(request, key, build)
+
+
+def _page_statement(
+    db: HandlerSession,
+    category: Optional[str],
+    search: Optional[str],
+    offset: int,
+    cursor: Optional[str],
+) -> tuple[Select, list, int, bool]:
+    """Build the filtered list query for one page.
+
+    Returns the unordered statement, its ordering, the offset to apply and
+    whether rows are ranked by search relevance.
+    """
+    stmt = select(*_PHRASE_COLUMNS)
+    order_by = [Phrase.created_at.desc(), Phrase.id.desc()]
+    ranked = False
     if category:
-        query = query.filter(Phrase.category == category)
+        stmt = stmt.where(Phrase.category == category)
     if search:
-        query = query.filter(Phrase.content.like(f"%{search}%"))
-    return query.order_by(Phrase.created_at.desc()).offset(offset).limit(limit).all()
+        match = build_match_query(search)
+        if match and db.get_bind().dialect.name == "sqlite":
+            # Indexed search, best matches first
+            stmt = stmt.join(phrases_fts, phrases_fts.c.rowid == Phrase.id).where(fts_match(match))
+            order_by.insert(0, phrases_fts.c.rank)
+            ranked = True
+        else:
+            stmt = stmt.where(Phrase.content.like(f"%{search}%"))
+
+    if cursor:
+        position = _decode_cursor(cursor)
+        if "o" in position:
+            offset = position["o"]
+        elif not ranked:
+            # Keyset seek on (created_at, id): constant cost however deep the page
+            stmt = stmt.where(tuple_(Phrase.created_at, Phrase.id) < (position["t"], position["i"]))
+            offset = 0
+    return stmt, order_by, offset, ranked
+
+
+def _next_cursor(phrases: list, limit: int, offset: int, ranked: bool) -> Optional[str]:
+    if len(phrases) < limit:
+        return None
+    last = phrases[-1]
+    if ranked or last.created_at is None:
+        return _encode_cursor({"o": offset + limit})
+    return _encode_cursor({"t": last.created_at.isoformat(), "i": last.id})
+
+
+async def _query_phrases(
+    db: HandlerSession,
+    category: Optional[str],
+    search: Optional[str],
+    limit: int,
+    offset: int,
+    cursor: Optional[str],
+) -> tuple[list, Optional[str]]:
+    """Run the list query, returning the page's rows and the cursor for the next one."""
+    stmt, order_by, offset, ranked = _page_statement(db, category, search, offset, cursor)
+    phrases = (await db.execute(stmt.order_by(*order_by).offset(offset).limit(limit))).all()
+    return phrases, _next_cursor(phrases, limit, offset, ranked)
 
 
-@router.get("/random", response_model=PhraseOut)
-def random_phrase(
+async def _phrase_bodies(db: HandlerSession, ids) -> dict[int, bytes]:
+    """Serialized bodies of the given phrases, fetching cache misses in one query."""
+    bodies = {}
+    missing = {}
+    for phrase_id in ids:
+        key = _cache_key(db, "phrase", phrase_id)
+        body = response_cache.get(key)
+        if body is None:
+            missing[phrase_id] = key
+        else:
+            bodies[phrase_id] = body
+    if missing:
+        for row in await db.execute(select(*_PHRASE_COLUMNS).where(Phrase.id.in_(missing))):
+            body = orjson.dumps(_phrase_dict(row))
+            response_cache.put(missing[row.id], body)
+            bodies[row.id] = body
+    return bodies
+
+
+async def _random_bodies(db: HandlerSession, category: Optional[str], n: int) -> list[bytes]:
+    """Serialized bodies of up to ``n`` distinct random phrases."""
+    bind = db.get_bind()
+    if not random_index.loaded(bind):
+        await db.run_sync(random_index.load)
+    for attempt in range(2):
+        ids = random_index.sample(bind, category or None, n)
+        bodies = await _phrase_bodies(db, ids)
+        if len(bodies) == len(ids) or attempt:
+            return [bodies[i] for i in ids if i in bodies]
+        # Rows removed behind the index's back: reload once and pick again
+        await db.run_sync(random_index.load)
+    return []
+
+
+@router.get("/random", response_model=Union[PhraseOut, List[PhraseOut]])
+async def random_phrase(
     category: Optional[str] = Query(None, description="Filter by category"),
-    db: Session = Depends(get_db),
+    n: Optional[int] = Query(None, ge=1, le=20, description="Return a list of up to n distinct phrases"),
+    db: HandlerSession = Depends(get_async_db),
 ):
-    query = db.query(Phrase)
-    if category:
-        query = query.filter(Phrase.category == category)
-    phrase = query.order_by(func.random()).first()
-    if not phrase:
-        from fastapi import HTTPException
+    bodies = await _random_bodies(db, category, n or 1)
+    if not bodies:
         raise HTTPException(status_code=404, detail="No phrases found")
-    return phrase
+    if n is None:
+        return _json_response(bodies[0])
+    return _json_response(_json_list(bodies))
+
+
+async def _categories_body(db: HandlerSession) -> tuple[bytes, dict]:
+    results = await db.execute(
+        select(CategoryStat.category, CategoryStat.count)
+        .where(CategoryStat.count > 0)
+        .order_by(CategoryStat.count.desc(), CategoryStat.category)
+    )
+    return _entry(orjson.dumps([{"name": name, "count": count} for name, count in results]))
 
 
 @router.get("/categories", response_model=List[CategoryOut])
-def list_categories(db: Session = Depends(get_db)):
-    results = (
-        db.query(Phrase.category, func.count(Phrase.id).label("count"))
-        .group_by(Phrase.category)
-        .order_by(func.count(Phrase.id).desc())
-        .all()
+async def list_categories(request: Request, db: HandlerSession = Depends(get_async_db)):
+    return await _conditional_response(request, _cache_key(db, "categories"), lambda: _categories_body(db))
+
+
+async def _page_bodies(db: HandlerSession, pages: List[PageRequest]) -> list[tuple[bytes, dict]]:
+    """Serialized pages, as list_phrases would cache them, with all misses in one query.
+
+    Each missing page becomes a numbered subquery of a single UNION ALL, so
+    several category tabs cost one round trip.
+    """
+    results: list[Optional[tuple[bytes, dict]]] = []
+    missing = {}
+    for index, page in enumerate(pages):
+        key = _list_key(db, page.category, page.search, page.limit, 0, page.cursor)
+        cached = response_cache.get(key)
+        results.append(cached)
+        if cached is None:
+            missing[index] = key
+
+    if missing:
+        parts = {}
+        selects = []
+        for index in missing:
+            page = pages[index]
+            stmt, order_by, offset, ranked = _page_statement(db, page.category, page.search, 0, page.cursor)
+            parts[index] = (offset, ranked)
+            subquery = (
+                stmt.add_columns(
+                    literal(index).label("page"), func.row_number().over(order_by=order_by).label("position")
+                )
+                .order_by(*order_by).offset(offset).limit(page.limit).subquery()
+            )
+            selects.append(select(subquery))
+        combined = union_all(*selects).subquery()
+        rows: dict[int, list] = {index: [] for index in missing}
+        for row in await db.execute(select(combined).order_by(combined.c.page, combined.c.position)):
+            rows[row.page].append(row)
+
+        for index, key in missing.items():
+            offset, ranked = parts[index]
+            next_cursor = _next_cursor(rows[index], pages[index].limit, offset, ranked)
+            headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+            results[index] = _entry(orjson.dumps([_phrase_dict(row) for row in rows[index]]), headers)
+            response_cache.put(key, results[index])
+    return results
+
+
+@router.post("/batch", response_model=PhraseBatchOut)
+async def batch_phrases(batch: PhraseBatchRequest, db: HandlerSession = Depends(get_async_db)):
+    """Answer several phrase lookups in one round trip.
+
+    Explicit ids and random picks share one primary-key query, all pages
+    share one UNION ALL query, and categories come from category_stats.
+    Every part goes through the same response cache as the GET endpoints.
+    """
+    bind = db.get_bind()
+    picks = []
+    if batch.random:
+        if not random_index.loaded(bind):
+            await db.run_sync(random_index.load)
+        picks = [random_index.sample(bind, pick.category or None, pick.n) for pick in batch.random]
+    bodies = await _phrase_bodies(db, [*batch.ids, *(i for ids in picks for i in ids)])
+
+    pages = [
+        b'{"items":' + body + b',"next_cursor":' + orjson.dumps(headers.get(NEXT_CURSOR_HEADER)) + b"}"
+        for body, headers in await _page_bodies(db, batch.pages)
+    ]
+
+    categories = b"null"
+    if batch.categories:
+        key = _cache_key(db, "categories")
+        cached = response_cache.get(key)
+        if cached is None:
+            cached = await _categories_body(db)
+            response_cache.put(key, cached)
+        categories = cached[0]
+
+    return _json_response(
+        b'{"ids":' + _json_list(bodies[i] for i in batch.ids if i in bodies)
+        + b',"pages":' + _json_list(pages)
+        + b',"random":' + _json_list(_json_list(bodies[i] for i in ids if i in bodies) for ids in picks)
+        + b',"categories":' + categories + b"}"
     )
-    return [CategoryOut(name=row[0], count=row[1]) for row in results]
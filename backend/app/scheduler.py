@@ -8,13 +8,14 @@ logger = logging.getLogger(__name__)
 scheduler = AsyncIOScheduler(timezone="Asia/Shanghai")
 
 
-def start_scheduler():
+def start_scheduler(llm_client=None):
+    """Register and start the jobs; ``llm_client`` is the app's shared upstream client."""
     from app.agents.generator import generate_phrases_job
     from app.agents.scraper import scrape_phrases_job
 
     scheduler.add_job(
         generate_phrases_job, "cron", hour=8, minute=0,
-        id="generator", replace_existing=True,
+        id="generator", replace_existing=True, kwargs={"client": llm_client},
     )
     scheduler.add_job(
         scrape_phrases_job, "cron", hour=8, minute=5,
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Literal, Optional
 from pydantic import BaseModel, Field
 
 
@@ -22,6 +22,10 @@ class ImageContent(BaseModel):
 class ChatRequest(BaseModel):
     their_message: str = ""
     style: str = Field(default="humorous")
+    # Several styles generated at once, multiplexed into one stream (overrides style)
+    styles: Optional[List[str]] = Field(default=None, min_length=1, max_length=4)
+    # "content": raw text deltas; "replies": reply_start/reply_delta/reply_end per numbered reply
+    events: Literal["content", "replies"] = "content"
     context: Optional[str] = None
     images: Optional[List[ImageContent]] = None
 
@@ -29,3 +33,34 @@ class ChatRequest(BaseModel):
 class CategoryOut(BaseModel):
     name: str
     count: int
+
+
+class PageRequest(BaseModel):
+    category: Optional[str] = None
+    search: Optional[str] = None
+    limit: int = Field(default=20, ge=1, le=100)
+    cursor: Optional[str] = None
+
+
+class RandomRequest(BaseModel):
+    category: Optional[str] = None
+    n: int = Field(default=1, ge=1, le=20)
+
+
+class PhraseBatchRequest(BaseModel):
+    ids: List[int] = Field(default_factory=list, max_length=100)
+    pages: List[PageRequest] = Field(default_factory=list, max_length=10)
+    random: List[RandomRequest] = Field(default_factory=list, max_length=5)
+    categories: bool = False
+
+
+class PhrasePageOut(BaseModel):
+    items: List[PhraseOut]
+    next_cursor: Optional[str] = None
+
+
+class PhraseBatchOut(BaseModel):
+    ids: List[PhraseOut]
+    pages: List[PhrasePageOut]
+    random: List[List[PhraseOut]]
+    categories: Optional[List[CategoryOut]] = None
@@ -0,0 +1,111 @@
+"""Full-text search over phrases using an SQLite FTS5 index.
+
+FTS5's bundled tokenizers do not segment Chinese, so phrases are indexed as
+overlapping character bigrams: "你好呀" is stored as "你好 好呀 呀". A search
+term becomes a phrase query over the same bigrams, which matches exactly the
+rows a ``LIKE '%term%'`` scan would, but through the FTS index.
+"""
+
+import re
+from typing import Optional
+
+from sqlalchemy import column, literal_column, table, text
+from sqlalchemy.engine import Connection
+
+FTS_TABLE = "phrases_fts"
+
+CREATE_FTS_SQL = f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(content, tags)"
+DROP_FTS_SQL = f"DROP TABLE IF EXISTS {FTS_TABLE}"
+
+# Lightweight handle for joining against the virtual table from ORM queries
+phrases_fts = table(FTS_TABLE, column("rowid"), column("rank"))
+
+_WORD_RUN = re.compile(r"[^\W_]+")
+
+
+def _bigrams(run: str) -> list[str]:
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def ngram_tokens(value: Optional[str]) -> str:
+    """Tokenize text into space separated bigrams, one group per word run.
+
+    Each run also ends with its last character on its own, so every character
+    starts some token and single-character searches can use a prefix query.
+    """
+    tokens = []
+    for run in _WORD_RUN.findall((value or "").lower()):
+        tokens.extend(_bigrams(run))
+        tokens.append(run[-1])
+    return " ".join(tokens)
+
+
+def build_match_query(search: str) -> Optional[str]:
+    """Translate a user search string into an FTS5 MATCH expression.
+
+    Returns None when the string has nothing indexable (e.g. only punctuation).
+    """
+    clauses = []
+    for run in _WORD_RUN.findall(search.lower()):
+        if len(run) == 1:
+            clauses.append(f'"{run}" *')
+        else:
+            clauses.append('"' + " ".join(_bigrams(run)) + '"')
+    return " AND ".join(clauses) or None
+
+
+def build_any_match_query(value: str, max_terms: int = 32) -> Optional[str]:
+    """An FTS5 MATCH expression for rows sharing any bigram with ``value``.
+
+    Unlike build_match_query this does not require the whole string, so it
+    suits ranking phrases by their overlap with a free-form message.
+    """
+    terms = []
+    for run in _WORD_RUN.findall(value.lower()):
+        terms.extend(_bigrams(run) if len(run) > 1 else [run])
+    return " OR ".join(f'"{term}"' for term in list(dict.fromkeys(terms))[:max_terms]) or None
+
+
+def fts_match(match: str):
+    """WHERE clause matching ``match`` against the FTS table."""
+    return literal_column(FTS_TABLE).match(match)
+
+
+def index_phrase(connection: Connection, phrase_id: int, content: str, tags: Optional[str]):
+    connection.execute(
+        text(f"INSERT INTO {FTS_TABLE}(rowid, content, tags) VALUES (:id, :content, :tags)"),
+        {"id": phrase_id, "content": ngram_tokens(content), "tags": ngram_tokens(tags)},
+    )
+
+
+def unindex_phrase(connection: Connection, phrase_id: int):
+    connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {"id": phrase_id})
+
+
+def rebuild_index(connection: Connection) -> int:
+    """Re-tokenize every phrase into the FTS table. Returns number of rows indexed."""
+    connection.execute(text(DROP_FTS_SQL))
+    connection.execute(text(CREATE_FTS_SQL))
+    rows = connection.execute(text("SELECT id, content, tags FROM phrases")).all()
+    if rows:
+        connection.execute(
+            text(f"INSERT INTO {FTS_TABLE}(rowid, content, tags) VALUES (:id, :content, :tags)"),
+            [{"id": r[0], "content": ngram_tokens(r[1]), "tags": ngram_tokens(r[2])} for r in rows],
+        )
+    return len(rows)
+
+
+def ensure_search_index(connection: Connection) -> bool:
+    """Create the FTS table if missing and rebuild it when it drifts from phrases.
+
+    Returns True if a rebuild was needed.
+    """
+    if connection.dialect.name != "sqlite":
+        return False
+    connection.execute(text(CREATE_FTS_SQL))
+    indexed = connection.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+    total = connection.execute(text("SELECT count(*) FROM phrases")).scalar()
+    if indexed == total:
+        return False
+    rebuild_index(connection)
+    return True
@@ -0,0 +1,279 @@
+"""Helpers for the text streams behind the chat SSE responses.
+
+coalesce() batches small text deltas. ReplayBuffer holds the frames of one
+generation so that a client whose connection dropped can pick up where it
+left off (SSE ``Last-Event-ID``); ReplayStore keeps the buffers of running
+and recently finished generations within a TTL and a memory cap. Running
+buffers are also found by request key, so identical concurrent requests can
+share one generation (single flight). A generation nobody follows any more
+is cancelled after a grace period that leaves room for a resume.
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+async def coalesce(texts: AsyncIterator[str], max_chars: int, interval: float) -> AsyncIterator[str]:
+    """Merge runs of small text deltas into fewer, larger ones.
+
+    Text goes out at once when nothing was sent in the last ``interval``
+    seconds, so the first token and tokens after a pause are not delayed.
+    Deltas that arrive sooner are held until ``interval`` has passed since the
+    last flush, or until ``max_chars`` characters are buffered. Whatever is
+    left is flushed when ``texts`` ends. An ``interval`` of 0 passes every
+    delta through unchanged.
+    """
+    if interval <= 0:
+        async for text in texts:
+            yield text
+        return
+
+    loop = asyncio.get_running_loop()
+    iterator = texts.__aiter__()
+    buffer: list[str] = []
+    size = 0
+    last_flush = float("-inf")
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(0.0, last_flush + interval - loop.time()) if buffer else None
+            # asyncio.wait leaves the read running when the timer fires first
+            done, _ = await asyncio.wait((pending,), timeout=timeout)
+            if done:
+                try:
+                    text = pending.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    pending = None
+                buffer.append(text)
+                size += len(text)
+                if size < max_chars and loop.time() < last_flush + interval:
+                    continue
+            yield "".join(buffer)
+            buffer.clear()
+            size = 0
+            last_flush = loop.time()
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+class ReplayBuffer:
+    """Numbered frames of one generation.
+
+    A producer task appends frames; any number of followers read them from a
+    given sequence number on, waiting for new ones until the buffer finishes.
+    A running buffer keeps every frame (max_tokens bounds a generation), so a
+    follower never misses any; the store drops whole finished buffers.
+    Followers are counted so the store can tell when the last one has left.
+    """
+
+    def __init__(self, stream_id: str, key: Optional[str] = None, store: Optional["ReplayStore"] = None):
+        self.id = stream_id
+        self.key = key
+        self.size = 0
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.followers = 0
+        self._orphaned: Optional[asyncio.TimerHandle] = None
+        self._frames: list[str] = []
+        self._store = store
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def next_seq(self) -> int:
+        return len(self._frames)
+
+    def has(self, seq: int) -> bool:
+        """Whether ``seq`` is a frame already sent, or the next one to come."""
+        return 0 <= seq <= self.next_seq
+
+    def append(self, frame: str):
+        self._frames.append(frame)
+        self.size += len(frame)
+        if self._store is not None:
+            self._store._grew(len(frame))
+        self._wake()
+
+    def finish(self):
+        if not self.finished:
+            self.finished_at = self._store._clock() if self._store else time.monotonic()
+            self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, seq: int = 0) -> AsyncIterator[tuple[int, str]]:
+        """Yield ``(seq, frame)`` from ``seq`` on, live until the buffer finishes."""
+        self.followers += 1
+        if self._orphaned is not None:
+            self._orphaned.cancel()
+            self._orphaned = None
+        try:
+            while True:
+                changed = self._changed
+                while seq < self.next_seq:
+                    yield seq, self._frames[seq]
+                    seq += 1
+                if self.finished:
+                    return
+                await changed.wait()
+        finally:
+            self.followers -= 1
+            if not self.followers and not self.finished and self._store is not None:
+                self._store._abandoned(self)
+
+
+class ReplayStore:
+    """ReplayBuffers by id. Finished buffers expire after ``ttl`` seconds, oldest
+    first once all buffers together hold more than ``max_bytes`` of frames.
+    A running generation whose last follower left is cancelled unless someone
+    follows it again within ``grace`` seconds (0 cancels at once)."""
+
+    def __init__(self, ttl: float, max_bytes: int, grace: float = 0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self.size = 0
+        self.resumed = 0
+        self.joined = 0
+        self.abandoned = 0
+        self._buffers: OrderedDict[str, ReplayBuffer] = OrderedDict()
+        self._running: dict[str, ReplayBuffer] = {}
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def start(
+        self,
+        frames: AsyncIterator[str],
+        cleanup: Sequence[Callable[[], object]] = (),
+        key: Optional[str] = None,
+    ) -> ReplayBuffer:
+        """Run ``frames`` to completion in a task of its own, recording them in a new buffer.
+
+        The generation no longer depends on any one client's connection.
+        ``cleanup`` callables (sync or async) run once it ends; ``key``
+        identifies the request, so a resume can be checked against it and
+        identical requests can find it with running().
+        """
+        self._prune()
+        # Unguessable: the id alone is enough to resume the stream
+        buffer = ReplayBuffer(secrets.token_hex(16), key, self)
+        with self._lock:
+            self._buffers[buffer.id] = buffer
+            if key is not None:
+                self._running[key] = buffer
+        buffer.task = asyncio.create_task(self._produce(buffer, frames, cleanup))
+        return buffer
+
+    async def _produce(self, buffer: ReplayBuffer, frames: AsyncIterator[str],
+                       cleanup: Sequence[Callable[[], object]]):
+        try:
+            async for frame in frames:
+                buffer.append(frame)
+        except asyncio.CancelledError:
+            # Anyone resuming later learns the reply is incomplete
+            buffer.append(f"data: {json.dumps({'error': '生成已取消，请重试'}, ensure_ascii=False)}\n\n")
+            raise
+        except Exception:
+            logger.exception("Stream %s failed", buffer.id)
+            # Tell followers the reply is incomplete rather than just stopping
+            buffer.append(f"data: {json.dumps({'error': '生成中断，请重试'}, ensure_ascii=False)}\n\n")
+        finally:
+            with self._lock:
+                if self._running.get(buffer.key) is buffer:
+                    del self._running[buffer.key]
+            for callback in cleanup:
+                result = callback()
+                if inspect.isawaitable(result):
+                    await result
+            buffer.finish()
+
+    def get(self, stream_id: str) -> Optional[ReplayBuffer]:
+        self._prune()
+        with self._lock:
+            return self._buffers.get(stream_id)
+
+    def running(self, key: str) -> Optional[ReplayBuffer]:
+        """The buffer of a generation for ``key`` that is still producing frames."""
+        with self._lock:
+            return self._running.get(key)
+
+    def _abandoned(self, buffer: ReplayBuffer):
+        if self.grace > 0:
+            buffer._orphaned = asyncio.get_running_loop().call_later(self.grace, self._cancel, buffer)
+        else:
+            self._cancel(buffer)
+
+    def _cancel(self, buffer: ReplayBuffer):
+        buffer._orphaned = None
+        if buffer.followers or buffer.finished or buffer.task is None:
+            return
+        logger.info("Stream %s lost its last listener, cancelling the generation", buffer.id)
+        self.abandoned += 1
+        buffer.task.cancel()
+
+    def _grew(self, grown: int):
+        with self._lock:
+            self.size += grown
+        if self.size > self.max_bytes:
+            self._prune()
+
+    def _prune(self):
+        now = self._clock()
+        with self._lock:
+            for stream_id, buffer in list(self._buffers.items()):
+                if not buffer.finished:
+                    continue
+                if now - buffer.finished_at > self.ttl or self.size > self.max_bytes:
+                    del self._buffers[stream_id]
+                    self.size -= buffer.size
+
+    async def close(self):
+        """Cancel the generations still running (on shutdown)."""
+        tasks = [buffer.task for buffer in self._buffers.values() if buffer.task and not buffer.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+            self._running.clear()
+            self.size = 0
+            self.resumed = 0
+            self.joined = 0
+            self.abandoned = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            running = sum(1 for buffer in self._buffers.values() if not buffer.finished)
+            return {
+                "streams": len(self._buffers),
+                "running": running,
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "resumed": self.resumed,
+                "joined": self.joined,
+                "abandoned": self.abandoned,
+            }
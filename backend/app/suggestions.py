@@ -0,0 +1,62 @@
+"""Instant reply suggestions from the phrase library.
+
+The model takes seconds to produce its first token, so a chat stream opens
+with a few stored phrases instead. Phrases are ranked by the FTS5 index on
+how many character bigrams they share with the incoming message (bm25), with
+the categories that fit the requested style boosted; when too few match, the
+style's newest phrases fill the list. Results are cached per corpus version,
+so repeated openers cost a dictionary lookup.
+"""
+
+from sqlalchemy import case, select
+
+from app.cache import LRUCache
+from app.corpus import corpus_version, database_key
+from app.database import HandlerSession
+from app.models import Phrase
+from app.search import build_any_match_query, fts_match, phrases_fts
+
+STYLE_CATEGORIES = {
+    "humorous": ("幽默回复", "神回复", "反差萌", "土味情话"),
+    "gentle": ("高甜语录", "早安晚安", "深夜emo"),
+    "direct": ("表白句子", "约会邀请", "暧昧升温"),
+    "literary": ("高甜语录", "表白句子", "深夜emo"),
+}
+
+# bm25 ranks are negative (lower is better), so scaling one up ranks it higher
+STYLE_BOOST = 2.0
+
+_COLUMNS = (Phrase.id, Phrase.content, Phrase.category)
+
+suggestion_cache = LRUCache(1024)
+
+
+async def suggest_phrases(db: HandlerSession, message: str, style: str, limit: int) -> list[dict]:
+    """Up to ``limit`` phrases (id, content, category) suiting ``message`` in ``style``."""
+    key = (database_key(db.get_bind()), corpus_version(), message.strip(), style, limit)
+    cached = suggestion_cache.get(key)
+    if cached is not None:
+        return cached
+
+    in_style = Phrase.category.in_(STYLE_CATEGORIES.get(style, STYLE_CATEGORIES["humorous"]))
+    rows = []
+    match = build_any_match_query(message)
+    if match and db.get_bind().dialect.name == "sqlite":
+        boost = case((in_style, STYLE_BOOST), else_=1.0)
+        stmt = (
+            select(*_COLUMNS)
+            .join(phrases_fts, phrases_fts.c.rowid == Phrase.id)
+            .where(fts_match(match))
+            .order_by(phrases_fts.c.rank * boost)
+            .limit(limit)
+        )
+        rows = (await db.execute(stmt)).all()
+    if len(rows) < limit:
+        stmt = select(*_COLUMNS).where(in_style).order_by(Phrase.created_at.desc(), Phrase.id.desc())
+        if rows:
+            stmt = stmt.where(Phrase.id.not_in([row.id for row in rows]))
+        rows += (await db.execute(stmt.limit(limit - len(rows)))).all()
+
+    suggestions = [dict(zip(("id", "content", "category"), row)) for row in rows]
+    suggestion_cache.put(key, suggestions)
+    return suggestions
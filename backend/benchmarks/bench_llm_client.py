@@ -0,0 +1,75 @@
+"""Benchmark: time-to-first-token with a client per request vs. the shared client.
+
+"per-request" mirrors the old chat handler: construct an AsyncAnthropic for
+each request (new connection pool, so a new TCP connection and TLS handshake)
+and close it afterwards. "shared" reuses one create_llm_client() instance, as
+the app now does from its lifespan. Both stream from a local HTTPS fake of the
+Messages API, so the numbers isolate client-side setup costs; against the
+real API every avoided handshake also saves network round trips.
+
+    cd backend && python -m benchmarks.bench_llm_client --requests 200
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import anthropic
+
+from app.llm import create_llm_client
+from benchmarks.fake_upstream import FakeUpstream
+
+
+async def stream_once(client: anthropic.AsyncAnthropic) -> float:
+    start = time.perf_counter()
+    ttft = None
+    async with client.messages.stream(
+        model="fake", max_tokens=64, messages=[{"role": "user", "content": "hi"}],
+    ) as stream:
+        async for _ in stream.text_stream:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+    return ttft * 1000
+
+
+async def per_request(base_url: str, n: int) -> list[float]:
+    samples = []
+    for _ in range(n):
+        client = anthropic.AsyncAnthropic(api_key="bench", base_url=base_url)
+        try:
+            samples.append(await stream_once(client))
+        finally:
+            await client.close()
+    return samples
+
+
+async def shared(base_url: str, n: int) -> list[float]:
+    client = create_llm_client(api_key="bench", base_url=base_url)
+    try:
+        await stream_once(client)  # warm the pool, as the first request after startup would
+        return [await stream_once(client) for _ in range(n)]
+    finally:
+        await client.close()
+
+
+def report(name: str, samples: list[float]):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<12}{statistics.mean(samples):>10.2f}{statistics.median(samples):>10.2f}{p95:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    with FakeUpstream(chunks=5, chunk_delay=0) as upstream:
+        print(f"TTFT over {args.requests} sequential requests (ms)")
+        print(f"{'client':<12}{'mean':>10}{'p50':>10}{'p95':>10}")
+        report("per-request", asyncio.run(per_request(upstream.base_url, args.requests)))
+        report("shared", asyncio.run(shared(upstream.base_url, args.requests)))
+
+
+if __name__ == "__main__":
+    main()
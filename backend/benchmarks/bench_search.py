@@ -0,0 +1,97 @@
+"""Benchmark: FTS5 bigram search vs. the LIKE '%term%' scan it replaces.
+
+Builds a throwaway SQLite database with N synthetic phrases (seed data
+shuffled and spliced together) and times both query paths for a handful of
+search terms, mirroring the list_phrases query (filter, order, limit 20).
+
+    cd backend && python -m benchmarks.bench_search --rows 100000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import Phrase
+from app.search import build_match_query, fts_match, phrases_fts, rebuild_index
+from app.seed_data import seed_phrases
+
+TERMS = ["宇宙", "晚安", "喜欢你", "你笑起来真好看", "爱", "不存在的词"]
+
+
+def build_db(path: str, rows: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    db = Session()
+    seed_phrases(db)
+    seeds = [(p.content, p.category, p.tags) for p in db.query(Phrase).all()]
+    db.close()
+
+    rng = random.Random(42)
+    batch = []
+    with engine.begin() as conn:
+        for i in range(rows - len(seeds)):
+            a, b = rng.sample(seeds, 2)
+            batch.append({"content": f"{a[0][:20]}{b[0][-20:]}{i}", "category": a[1], "tags": b[2]})
+            if len(batch) == 5000:
+                conn.execute(insert(Phrase), batch)
+                batch.clear()
+        if batch:
+            conn.execute(insert(Phrase), batch)
+        rebuild_index(conn)
+    return engine, Session
+
+
+def time_query(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, Session = build_db(os.path.join(tmp, "bench.db"), args.rows)
+        db = Session()
+
+        def like(term):
+            return (
+                db.query(Phrase).filter(Phrase.content.like(f"%{term}%"))
+                .order_by(Phrase.created_at.desc()).limit(20).all()
+            )
+
+        def fts(term):
+            return (
+                db.query(Phrase).join(phrases_fts, phrases_fts.c.rowid == Phrase.id)
+                .filter(fts_match(build_match_query(term)))
+                .order_by(phrases_fts.c.rank, Phrase.created_at.desc()).limit(20).all()
+            )
+
+        print(f"{db.query(Phrase).count()} rows, median of {args.repeat} runs")
+        print(f"{'term':<16}{'LIKE ms':>10}{'FTS5 ms':>10}{'speedup':>10}")
+        for term in TERMS:
+            like_ms = time_query(lambda: like(term), args.repeat)
+            fts_ms = time_query(lambda: fts(term), args.repeat)
+            print(f"{term:<16}{like_ms:>10.2f}{fts_ms:>10.2f}{like_ms / fts_ms:>9.1f}x")
+
+        db.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark: tuple + orjson phrase serialization vs. the response_model path.
+
+The old path loaded full ORM objects, validated each into PhraseOut and let
+FastAPI encode them; the new one selects the columns as tuples and encodes
+them straight to bytes with orjson. Both read the same page of phrases.
+
+    cd backend && python -m benchmarks.bench_serialization --limit 100
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models import Phrase
+from app.routers.phrases import _PHRASE_COLUMNS, _phrase_dict
+from app.schemas import PhraseOut
+from app.seed_data import seed_phrases
+
+
+def time_it(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    seed_phrases(db)
+
+    def response_model_path():
+        db.expunge_all()
+        rows = db.query(Phrase).order_by(Phrase.id).limit(args.limit).all()
+        models = [PhraseOut.model_validate(p) for p in rows]
+        return json.dumps(jsonable_encoder(models), ensure_ascii=False).encode()
+
+    def fast_path():
+        rows = db.query(*_PHRASE_COLUMNS).order_by(Phrase.id).limit(args.limit).all()
+        return orjson.dumps([_phrase_dict(row) for row in rows])
+
+    assert json.loads(response_model_path()) == json.loads(fast_path())
+
+    old = time_it(response_model_path, args.repeat)
+    new = time_it(fast_path, args.repeat)
+    print(f"limit={args.limit}, median of {args.repeat} runs")
+    print(f"ORM + PhraseOut + jsonable_encoder: {old:8.0f} us")
+    print(f"tuples + orjson:                    {new:8.0f} us  ({old / new:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
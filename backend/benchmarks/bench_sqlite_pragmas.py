@@ -0,0 +1,101 @@
+"""Benchmark: SQLite defaults vs. the PRAGMA profile in app.config.
+
+For each profile, builds a throwaway database and measures
+  * write throughput: single-row ORM inserts, one commit each (the shape of
+    save_new_phrases when agents trickle in phrases), and
+  * read latency: list_phrases-style queries while a writer thread commits
+    in a loop (rollback journal readers wait on the writer's lock; WAL readers
+    do not).
+
+    cd backend && python -m benchmarks.bench_sqlite_pragmas --writes 2000
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from app.config import SQLITE_PRAGMAS
+from app.database import Base, apply_sqlite_pragmas
+from app.models import Phrase
+from app.seed_data import seed_phrases
+
+PROFILES = {
+    "default": None,
+    "tuned": SQLITE_PRAGMAS,
+}
+
+
+def make_engine(path: str, pragmas):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    if pragmas:
+        apply_sqlite_pragmas(engine, pragmas)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def bench_writes(Session, writes: int) -> float:
+    start = time.perf_counter()
+    for i in range(writes):
+        with Session() as db:
+            db.add(Phrase(content=f"bench write {i}", category="开场白"))
+            db.commit()
+    return writes / (time.perf_counter() - start)
+
+
+def bench_reads_under_write(Session, reads: int) -> tuple[float, float]:
+    stop = threading.Event()
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            with Session() as db:
+                db.add(Phrase(content=f"bench background {i}", category="开场白"))
+                db.commit()
+            i += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    samples = []
+    try:
+        for _ in range(reads):
+            start = time.perf_counter()
+            with Session() as db:
+                db.execute(
+                    select(Phrase.id, Phrase.content)
+                    .order_by(Phrase.created_at.desc(), Phrase.id.desc()).limit(20)
+                ).all()
+            samples.append((time.perf_counter() - start) * 1000)
+    finally:
+        stop.set()
+        thread.join()
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writes", type=int, default=2000)
+    parser.add_argument("--reads", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'profile':<10}{'commits/s':>12}{'read p50 ms':>14}{'read p99 ms':>14}")
+    for name, pragmas in PROFILES.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = make_engine(os.path.join(tmp, "bench.db"), pragmas)
+            Session = sessionmaker(bind=engine)
+            with Session() as db:
+                seed_phrases(db)
+            commits = bench_writes(Session, args.writes)
+            p50, p99 = bench_reads_under_write(Session, args.reads)
+            print(f"{name:<10}{commits:>12.0f}{p50:>14.2f}{p99:>14.2f}")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark: one SSE frame per text delta vs. coalesced frames.
+
+Runs concurrent /api/chat requests through the ASGI app against a local
+fake of the Messages API that streams many small deltas, once with
+coalescing off (CHAT_COALESCE_MS=0) and once with the configured interval.
+An ASGI wrapper counts the body writes of each response and the gaps between
+them; CPU time is that of the thread running the app (the fake upstream
+runs in its own thread).
+
+    cd backend && python -m benchmarks.bench_sse_coalescing --requests 20 --chunks 300
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from app.admission import AdmissionQueue, RateLimiter
+from app.chat_cache import chat_cache
+from app.config import CHAT_COALESCE_MS
+from app.llm import create_llm_client, get_llm_client
+from app.main import app
+from app.routers import chat
+from benchmarks.fake_upstream import FakeUpstream
+
+
+class WriteCounter:
+    """ASGI wrapper recording when each response body chunk is sent."""
+
+    def __init__(self, app):
+        self.app = app
+        self.writes: list[list[float]] = []
+
+    async def __call__(self, scope, receive, send):
+        stamps = []
+        self.writes.append(stamps)
+
+        async def counting_send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                stamps.append(time.perf_counter())
+            await send(message)
+
+        await self.app(scope, receive, counting_send)
+
+
+async def run(base_url: str, requests: int) -> tuple[WriteCounter, float]:
+    llm = create_llm_client(api_key="bench", base_url=base_url)
+    app.dependency_overrides[get_llm_client] = lambda: llm
+    counter = WriteCounter(app)
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=counter), base_url="http://bench") as http:
+            start = time.thread_time()
+            await asyncio.gather(*(
+                http.post("/api/chat", json={"their_message": f"bench {i}"}, timeout=60)
+                for i in range(requests)
+            ))
+            return counter, time.thread_time() - start
+    finally:
+        app.dependency_overrides.pop(get_llm_client, None)
+        await llm.close()
+
+
+def report(name: str, counter: WriteCounter, cpu: float):
+    frames = [len(stamps) for stamps in counter.writes]
+    gaps = sorted(
+        (b - a) * 1000 for stamps in counter.writes for a, b in zip(stamps, stamps[1:])
+    )
+    p95 = gaps[int(len(gaps) * 0.95) - 1] if gaps else 0.0
+    print(f"{name:<14}{statistics.mean(frames):>12.1f}{cpu * 1000 / len(frames):>14.2f}{p95:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=300)
+    parser.add_argument("--chunk-delay", type=float, default=0.002)
+    args = parser.parse_args()
+
+    chat.CLAUDE_API_KEY = "bench"
+    chat.rate_limiter = RateLimiter(0, 0)
+    chat.admission = AdmissionQueue(args.requests, 0)
+
+    with FakeUpstream(chunks=args.chunks, chunk_delay=args.chunk_delay, tls=False) as upstream:
+        print(f"{args.requests} concurrent responses, {args.chunks} deltas each, {args.chunk_delay * 1000:g} ms apart")
+        print(f"{'mode':<14}{'frames/resp':>12}{'CPU ms/resp':>14}{'gap p95 ms':>14}")
+        for name, interval in (("per-delta", 0), (f"{CHAT_COALESCE_MS:g} ms", CHAT_COALESCE_MS)):
+            chat.CHAT_COALESCE_MS = interval
+            chat_cache.clear()
+            report(name, *asyncio.run(run(upstream.base_url, args.requests)))
+
+
+if __name__ == "__main__":
+    main()
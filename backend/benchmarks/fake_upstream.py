@@ -0,0 +1,118 @@
+"""A local stand-in for the Anthropic Messages API, for benchmarks.
+
+Serves ``POST /v1/messages`` as a streaming response in the real SSE event
+format, by default over HTTPS with a throwaway self-signed certificate (so
+connection setup includes a TLS handshake like the real API). Point a client
+at it with ``base_url=upstream.base_url``; the certificate is trusted through
+SSL_CERT_FILE, which httpx honours by default. Request bodies are kept in
+``upstream.bodies`` for tests that check what was sent.
+
+    with FakeUpstream(chunks=20, chunk_delay=0.01) as upstream:
+        client = anthropic.AsyncAnthropic(api_key="x", base_url=upstream.base_url)
+"""
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Optional
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+
+
+def _event(name: str, data: dict) -> str:
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class FakeUpstream:
+    def __init__(self, chunks: int = 20, chunk_delay: float = 0.01, first_token_delay: float = 0.0,
+                 text: str = "字", usage: Optional[dict] = None, tls: bool = True):
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.first_token_delay = first_token_delay
+        self.text = text
+        self.usage = {"input_tokens": 100, "output_tokens": 1, **(usage or {})}
+        self.tls = tls
+        self.bodies: list[dict] = []
+        self._tmp = tempfile.TemporaryDirectory()
+        self._server = None
+        self._thread = None
+        self.port = None
+
+    @property
+    def base_url(self) -> str:
+        scheme = "https" if self.tls else "http"
+        return f"{scheme}://127.0.0.1:{self.port}"
+
+    @property
+    def requests(self) -> int:
+        return len(self.bodies)
+
+    async def _messages(self, request):
+        body = await request.json()
+        self.bodies.append(body)
+
+        async def events():
+            yield _event("message_start", {"type": "message_start", "message": {
+                "id": "msg_fake", "type": "message", "role": "assistant", "content": [],
+                "model": body.get("model", "fake"), "stop_reason": None, "stop_sequence": None,
+                "usage": self.usage,
+            }})
+            yield _event("content_block_start", {
+                "type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""},
+            })
+            await asyncio.sleep(self.first_token_delay)
+            for i in range(self.chunks):
+                if i:
+                    await asyncio.sleep(self.chunk_delay)
+                yield _event("content_block_delta", {
+                    "type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": self.text},
+                })
+            yield _event("content_block_stop", {"type": "content_block_stop", "index": 0})
+            yield _event("message_delta", {
+                "type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                "usage": {"output_tokens": self.chunks},
+            })
+            yield _event("message_stop", {"type": "message_stop"})
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    def __enter__(self):
+        ssl = {}
+        if self.tls:
+            cert = os.path.join(self._tmp.name, "cert.pem")
+            key = os.path.join(self._tmp.name, "key.pem")
+            subprocess.run(
+                ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                 "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                 "-keyout", key, "-out", cert],
+                check=True, capture_output=True,
+            )
+            os.environ["SSL_CERT_FILE"] = cert
+            ssl = {"ssl_certfile": cert, "ssl_keyfile": key}
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        app = Starlette(routes=[Route("/v1/messages", self._messages, methods=["POST"])])
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", ws="none", **ssl)
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join()
+        if self.tls:
+            os.environ.pop("SSL_CERT_FILE", None)
+        self._tmp.cleanup()
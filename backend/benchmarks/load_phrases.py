@@ -0,0 +1,129 @@
+"""Load test: the phrase routes on the two DATABASE_URL handler paths.
+
+Both variants run the real list_phrases handler (response cache disabled, so
+every request queries) on the same SQLite file; they differ only in the
+session get_async_db hands them. "threadpool" is what a sync driver
+(sqlite://) selects: a ThreadedSession whose queries run on Starlette's worker
+threads. "async" is what an async driver (sqlite+aiosqlite://) selects: an
+AsyncSession awaited on the event loop.
+Requests are fired in waves of increasing concurrency through an in-process
+ASGI transport; latency percentiles show where each variant starts queueing.
+
+    cd backend && python -m benchmarks.load_phrases --rows 20000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.cache import LRUCache
+from app.database import Base, ThreadedSession, get_async_db
+from app.models import Phrase
+from app.routers import phrases
+from app.search import rebuild_index
+
+CATEGORIES = ["开场白", "幽默回复", "土味情话", "高甜语录", "早安问候", "晚安问候"]
+
+
+def build_db(path: str, rows: int):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Phrase), [
+            {"content": f"第{i}条测试话术，内容随便写一点", "category": CATEGORIES[i % len(CATEGORIES)]}
+            for i in range(rows)
+        ])
+        rebuild_index(conn)
+    return engine
+
+
+def _app(get_db) -> FastAPI:
+    app = FastAPI()
+    app.include_router(phrases.router)
+    app.dependency_overrides[get_async_db] = get_db
+    return app
+
+
+def threadpool_app(engine) -> FastAPI:
+    SessionLocal = sessionmaker(bind=engine)
+
+    async def get_db():
+        db = ThreadedSession(SessionLocal())
+        try:
+            yield db
+        finally:
+            await db.close()
+
+    return _app(get_db)
+
+
+def async_app(path: str) -> FastAPI:
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    SessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    async def get_db():
+        async with SessionLocal() as db:
+            yield db
+
+    return _app(get_db)
+
+
+async def wave(client: httpx.AsyncClient, concurrency: int, requests: int) -> list[float]:
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with sem:
+            start = time.perf_counter()
+            resp = await client.get(f"/api/phrases/?category={CATEGORIES[i % len(CATEGORIES)]}")
+            resp.raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies
+
+
+async def run(app: FastAPI, levels: list[int], requests: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await wave(client, 10, 50)  # warm up
+        for concurrency in levels:
+            start = time.perf_counter()
+            lat = sorted(await wave(client, concurrency, requests))
+            elapsed = time.perf_counter() - start
+            p50 = statistics.median(lat)
+            p99 = lat[int(len(lat) * 0.99) - 1]
+            print(f"  c={concurrency:<4} p50={p50:7.1f} ms  p99={p99:7.1f} ms  {requests / elapsed:7.0f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--levels", default="10,50,100,200")
+    args = parser.parse_args()
+    levels = [int(x) for x in args.levels.split(",")]
+
+    # Measure the queries, not the response cache
+    phrases.response_cache = LRUCache(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = build_db(path, args.rows)
+        print(f"threadpool (sqlite://, ThreadedSession), {args.rows} rows")
+        asyncio.run(run(threadpool_app(engine), levels, args.requests))
+        print(f"async (sqlite+aiosqlite://, AsyncSession), {args.rows} rows")
+        asyncio.run(run(async_app(path), levels, args.requests))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
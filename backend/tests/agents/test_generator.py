@@ -1,6 +1,6 @@
 import json
 from datetime import datetime
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 
 import pytest
 
@@ -35,7 +35,7 @@ def test_build_prompt_contains_categories():
     assert "3" in prompt
 
 
-def test_save_new_phrases_dedup(db):
+async def test_save_new_phrases_dedup(db, async_db):
     # Add a phrase
     db.add(Phrase(content="你好世界，这是一条测试话术", category="测试", tags="test"))
     db.commit()
@@ -44,19 +44,19 @@ def test_save_new_phrases_dedup(db):
         {"content": "你好世界，这是一条测试话术", "category": "测试", "tags": "test"},
         {"content": "这是一条全新的话术内容哦", "category": "测试", "tags": "new"},
     ]
-    added = save_new_phrases(db, phrases)
+    added = await save_new_phrases(async_db, phrases)
     assert added == 1
 
     total = db.query(Phrase).filter(Phrase.category == "测试").count()
     assert total == 2
 
 
-def test_save_new_phrases_skips_empty(db):
+async def test_save_new_phrases_skips_empty(async_db):
     phrases = [
         {"content": "", "category": "测试"},
         {"content": "   ", "category": "测试"},
     ]
-    added = save_new_phrases(db, phrases)
+    added = await save_new_phrases(async_db, phrases)
     assert added == 0
 
 
@@ -68,7 +68,7 @@ async def test_generate_phrases_job_no_api_key():
 
 
 @pytest.mark.asyncio
-async def test_generate_phrases_job_success(db):
+async def test_generate_phrases_job_success(db, async_db):
     """Mock Claude API and verify phrases are saved."""
     mock_phrases = [
         {"content": "这是AI生成的第一条新鲜话术哦", "category": "开场白", "tags": "AI生成"},
@@ -78,13 +78,30 @@ async def test_generate_phrases_job_success(db):
     mock_response.content = [MagicMock(text=json.dumps(mock_phrases, ensure_ascii=False))]
 
     mock_client = MagicMock()
-    mock_client.messages.create.return_value = mock_response
+    mock_client.messages.create = AsyncMock(return_value=mock_response)
 
     with patch("app.agents.generator.CLAUDE_API_KEY", "test-key"), \
-         patch("app.agents.generator.anthropic.Anthropic", return_value=mock_client), \
          patch("app.agents.generator._fetch_trending_topics", return_value="- 测试热点"), \
-         patch("app.agents.generator.SessionLocal", return_value=db):
-        await generate_phrases_job()
+         patch("app.agents.generator.AsyncSessionLocal", return_value=async_db):
+        await generate_phrases_job(mock_client)
 
     count = db.query(Phrase).filter(Phrase.tags.like("%AI生成%")).count()
     assert count == 2
+
+
+@pytest.mark.asyncio
+async def test_generate_phrases_job_standalone_closes_own_client():
+    """Without the app's shared client, the job creates one and closes it."""
+    mock_response = MagicMock()
+    mock_response.content = [MagicMock(text="not json")]
+    mock_client = MagicMock()
+    mock_client.messages.create = AsyncMock(return_value=mock_response)
+    mock_client.close = AsyncMock()
+
+    with patch("app.agents.generator.CLAUDE_API_KEY", "test-key"), \
+         patch("app.agents.generator.create_llm_client", return_value=mock_client), \
+         patch("app.agents.generator._fetch_trending_topics", return_value="- 测试热点"):
+        await generate_phrases_job()
+
+    mock_client.messages.create.assert_awaited_once()
+    mock_client.close.assert_awaited_once()
@@ -24,7 +24,7 @@ def test_is_valid():
 
 
 @pytest.mark.asyncio
-async def test_scrape_phrases_job_success(db):
+async def test_scrape_phrases_job_success(db, async_db):
     """Mock HTTP response and verify phrases are saved."""
     html = """
     <html><body>
@@ -48,7 +48,7 @@ async def test_scrape_phrases_job_success(db):
     mock_client.get = AsyncMock(return_value=mock_resp)
 
     with patch("app.agents.scraper.httpx.AsyncClient", return_value=mock_client), \
-         patch("app.agents.scraper.SessionLocal", return_value=db):
+         patch("app.agents.scraper.AsyncSessionLocal", return_value=async_db):
         await scrape_phrases_job()
 
     count = db.query(Phrase).filter(Phrase.tags == "爬取").count()
@@ -56,7 +56,7 @@ async def test_scrape_phrases_job_success(db):
 
 
 @pytest.mark.asyncio
-async def test_scrape_phrases_job_http_error(db):
+async def test_scrape_phrases_job_http_error(db, async_db):
     """Should handle HTTP errors gracefully."""
     mock_resp = MagicMock()
     mock_resp.status_code = 500
@@ -67,7 +67,7 @@ async def test_scrape_phrases_job_http_error(db):
     mock_client.get = AsyncMock(return_value=mock_resp)
 
     with patch("app.agents.scraper.httpx.AsyncClient", return_value=mock_client), \
-         patch("app.agents.scraper.SessionLocal", return_value=db):
+         patch("app.agents.scraper.AsyncSessionLocal", return_value=async_db):
         await scrape_phrases_job()  # Should not raise
 
     count = db.query(Phrase).count()
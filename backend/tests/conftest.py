@@ -1,22 +1,27 @@
+import os
+import tempfile
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool
 
-from app.database import Base, get_db
+from app.database import Base, ThreadedSession, get_db, get_async_db
 from app.main import app
 
-SQLALCHEMY_DATABASE_URL = "sqlite://"
+# A file DB shared by the sync engine (fixtures) and the async engine (routers)
+_db_path = os.path.join(tempfile.mkdtemp(), "test.db")
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{_db_path}"
 
-# StaticPool ensures all connections share the same in-memory DB
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
-)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# NullPool: every TestClient runs its own event loop, so connections can't be reused
+async_engine = create_async_engine(f"sqlite+aiosqlite:///{_db_path}", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 
 @pytest.fixture(autouse=True)
 def setup_db():
@@ -35,14 +40,38 @@ def db():
 
 
 @pytest.fixture
-def client(db):
+async def async_db():
+    async with TestingAsyncSessionLocal() as session:
+        yield session
+
+
+async def _async_session():
+    async with TestingAsyncSessionLocal() as session:
+        yield session
+
+
+async def _threaded_session():
+    session = ThreadedSession(TestingSessionLocal())
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
+# Handlers get an AsyncSession with an async DATABASE_URL driver and a
+# ThreadedSession with a sync one (the default), so routes are tested on both
+@pytest.fixture(params=[_async_session, _threaded_session], ids=["async", "threaded"])
+def client(request, db):
     def override_get_db():
         try:
             yield db
         finally:
             pass
 
+    override_get_async_db = request.param
+
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
     with TestClient(app, raise_server_exceptions=False) as c:
         yield c
     app.dependency_overrides.clear()
@@ -1,22 +1,77 @@
+import asyncio
 import json
-from unittest.mock import MagicMock, patch, PropertyMock
+import time
+from contextlib import contextmanager
+from typing import Optional
+from unittest.mock import AsyncMock, MagicMock, PropertyMock
 
+import pytest
 
-def make_mock_stream(text_chunks: list):
+
+async def _aiter(items, delay: float = 0):
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+
+def make_mock_stream(text_chunks: list, delay: float = 0):
     """
-    Create a mock that works as a context manager and exposes text_stream.
+    Create a mock that works as an async context manager and exposes text_stream.
     chat.py uses:
-        with client.messages.stream(...) as stream:
-            for text in stream.text_stream:
+        async with client.messages.stream(...) as stream:
+            async for text in stream.text_stream:
                 yield ...
     """
     mock_stream = MagicMock()
-    mock_stream.text_stream = iter(text_chunks)
-    mock_stream.__enter__ = MagicMock(return_value=mock_stream)
-    mock_stream.__exit__ = MagicMock(return_value=False)
+    mock_stream.text_stream = _aiter(text_chunks, delay)
+    final_message = MagicMock()
+    final_message.usage.input_tokens = 100
+    final_message.usage.output_tokens = len(text_chunks)
+    final_message.usage.cache_creation_input_tokens = 0
+    final_message.usage.cache_read_input_tokens = 0
+    mock_stream.get_final_message = AsyncMock(return_value=final_message)
+    mock_stream.__aenter__ = AsyncMock(return_value=mock_stream)
+    mock_stream.__aexit__ = AsyncMock(return_value=False)
     return mock_stream
 
 
+@pytest.fixture(autouse=True)
+def fresh_admission(monkeypatch):
+    """Per-test admission and replay state; rate limiting and phrase suggestions
+    off unless a test turns them on."""
+    from app.admission import AdmissionQueue, RateLimiter
+    from app.config import CHAT_MAX_CONCURRENT, CHAT_MAX_QUEUE
+    from app.streaming import ReplayStore
+
+    monkeypatch.setattr("app.routers.chat.admission", AdmissionQueue(CHAT_MAX_CONCURRENT, CHAT_MAX_QUEUE))
+    monkeypatch.setattr("app.routers.chat.rate_limiter", RateLimiter(0, 0))
+    monkeypatch.setattr("app.routers.chat.replays", ReplayStore(60, 1 << 20))
+    monkeypatch.setattr("app.routers.chat.CHAT_SUGGESTIONS", 0)
+
+
+@pytest.fixture(autouse=True)
+def empty_chat_cache():
+    from app.chat_cache import chat_cache
+    chat_cache.clear()
+    yield
+    chat_cache.clear()
+
+
+@contextmanager
+def mock_llm():
+    """Replace the app's shared upstream client with a MagicMock."""
+    from app.llm import get_llm_client
+    from app.main import app
+
+    mock_client = MagicMock()
+    app.dependency_overrides[get_llm_client] = lambda: mock_client
+    try:
+        yield mock_client
+    finally:
+        app.dependency_overrides.pop(get_llm_client, None)
+
+
 def parse_sse_events(text: str) -> list:
     """Parse SSE response body into a list of parsed data payloads."""
     events = []
@@ -79,9 +134,7 @@ def test_chat_empty_message_no_images_error_message(client, monkeypatch):
 
 def test_chat_sse_content_type(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream(["你好"])
 
         resp = client.post("/api/chat", json={"their_message": "hi"})
@@ -91,9 +144,7 @@ def test_chat_sse_content_type(client, monkeypatch):
 
 def test_chat_sse_done_token_present(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream(["test chunk"])
 
         resp = client.post("/api/chat", json={"their_message": "hello"})
@@ -102,9 +153,7 @@ def test_chat_sse_done_token_present(client, monkeypatch):
 
 def test_chat_sse_content_events(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream(["Hello", " world"])
 
         resp = client.post("/api/chat", json={"their_message": "hi"})
@@ -117,9 +166,7 @@ def test_chat_sse_content_events(client, monkeypatch):
 
 def test_chat_sse_done_event_last(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream(["chunk"])
 
         resp = client.post("/api/chat", json={"their_message": "hi"})
@@ -129,9 +176,7 @@ def test_chat_sse_done_event_last(client, monkeypatch):
 
 def test_chat_sse_empty_text_stream(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream([])
 
         resp = client.post("/api/chat", json={"their_message": "hi"})
@@ -145,9 +190,7 @@ def test_chat_sse_empty_text_stream(client, monkeypatch):
 
 def _assert_stream_called_with_style(client, monkeypatch, style):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream([])
 
         resp = client.post("/api/chat", json={"their_message": "hi", "style": style})
@@ -196,9 +239,7 @@ def test_chat_unknown_style_defaults_to_humorous(client, monkeypatch):
 
 def test_chat_context_included_in_prompt(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream([])
 
         resp = client.post("/api/chat", json={
@@ -214,9 +255,7 @@ def test_chat_context_included_in_prompt(client, monkeypatch):
 
 def test_chat_no_context_not_in_prompt(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream([])
 
         resp = client.post("/api/chat", json={"their_message": "你好"})
@@ -233,9 +272,7 @@ def test_chat_no_context_not_in_prompt(client, monkeypatch):
 
 def test_chat_with_images_calls_stream(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream(["resp"])
 
         resp = client.post("/api/chat", json={
@@ -248,9 +285,7 @@ def test_chat_with_images_calls_stream(client, monkeypatch):
 
 def test_chat_with_images_includes_image_block(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream([])
 
         resp = client.post("/api/chat", json={
@@ -266,11 +301,51 @@ def test_chat_with_images_includes_image_block(client, monkeypatch):
         assert image_blocks[0]["source"]["media_type"] == "image/jpeg"
 
 
+def test_chat_preprocesses_and_dedupes_screenshots(client, monkeypatch):
+    import base64
+    import io
+    from PIL import Image
+    from app.config import IMAGE_MAX_EDGE
+    from app.images import image_savings
+
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    image_savings.clear()
+    buffer = io.BytesIO()
+    Image.new("RGB", (1170, 2532), "white").save(buffer, format="PNG")
+    screenshot = {"data": base64.b64encode(buffer.getvalue()).decode(), "media_type": "image/png"}
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream([])
+
+        client.post("/api/chat", json={"their_message": "", "images": [screenshot, screenshot]})
+        content = mock_client.messages.stream.call_args[1]["messages"][0]["content"]
+        [image_block] = [b for b in content if b["type"] == "image"]
+        assert image_block["source"]["media_type"] == "image/jpeg"
+        sent = Image.open(io.BytesIO(base64.b64decode(image_block["source"]["data"])))
+        assert max(sent.size) <= IMAGE_MAX_EDGE
+
+    stats = client.get("/api/stats").json()["images"]
+    assert stats["duplicates"] == 1
+    assert stats["bytes_saved"] > 0
+    assert stats["tokens_saved"] > 0
+
+
+def test_chat_rejects_decompression_bomb_with_error_event(client, monkeypatch):
+    from app.routers import chat
+    from tests.test_images import _png_bomb
+
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        files = [("images", ("bomb.png", _png_bomb(), "image/png"))]
+        resp = client.post("/api/chat/upload", data={"their_message": "hi"}, files=files)
+        assert resp.status_code == 200
+        assert parse_sse_events(resp.text) == [{"error": "截图尺寸过大，请裁剪后重试"}]
+        mock_client.messages.stream.assert_not_called()
+    assert chat.admission.active == 0
+
+
 def test_chat_images_placed_before_text(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream([])
 
         resp = client.post("/api/chat", json={
@@ -286,9 +361,7 @@ def test_chat_images_placed_before_text(client, monkeypatch):
 
 def test_chat_with_message_and_image(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream(["ok"])
 
         resp = client.post("/api/chat", json={
@@ -310,9 +383,7 @@ def test_chat_with_message_and_image(client, monkeypatch):
 
 def test_chat_uses_sonnet_as_primary_model(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream([])
 
         client.post("/api/chat", json={"their_message": "hi"})
@@ -323,9 +394,7 @@ def test_chat_uses_sonnet_as_primary_model(client, monkeypatch):
 def test_chat_fallback_to_haiku_on_api_error(client, monkeypatch):
     import anthropic as anthropic_module
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
 
         call_count = 0
 
@@ -353,9 +422,7 @@ def test_chat_fallback_to_haiku_on_api_error(client, monkeypatch):
 def test_chat_fallback_response_has_done(client, monkeypatch):
     import anthropic as anthropic_module
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
 
         call_count = 0
 
@@ -377,9 +444,7 @@ def test_chat_fallback_response_has_done(client, monkeypatch):
 def test_chat_both_models_fail_yields_error(client, monkeypatch):
     import anthropic as anthropic_module
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.side_effect = anthropic_module.APIError(
             message="all models failed", request=MagicMock(), body=None
         )
@@ -394,9 +459,7 @@ def test_chat_both_models_fail_yields_error(client, monkeypatch):
 def test_chat_both_models_fail_no_done_token(client, monkeypatch):
     import anthropic as anthropic_module
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.side_effect = anthropic_module.APIError(
             message="fail", request=MagicMock(), body=None
         )
@@ -406,15 +469,67 @@ def test_chat_both_models_fail_no_done_token(client, monkeypatch):
         assert "[DONE]" not in resp.text
 
 
+def test_chat_hedges_slow_primary_with_fallback_model(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr("app.routers.chat.CHAT_TTFT_DEADLINE", 0.05)
+    with mock_llm() as mock_client:
+        streams = {
+            "claude-opus-4-6": make_mock_stream(["slow"], delay=1),
+            "claude-sonnet-4-6": make_mock_stream(["fast"]),
+        }
+        mock_client.messages.stream.side_effect = lambda **kwargs: streams[kwargs["model"]]
+
+        resp = client.post("/api/chat", json={"their_message": "hello"})
+        contents = [e["content"] for e in parse_sse_events(resp.text) if "content" in e]
+        assert contents == ["fast"]
+        assert "[DONE]" in resp.text
+        streams["claude-opus-4-6"].__aexit__.assert_awaited_once()
+        streams["claude-sonnet-4-6"].__aexit__.assert_awaited_once()
+
+
+def test_chat_error_after_first_token_is_not_retried(client, monkeypatch):
+    import anthropic as anthropic_module
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        async def broken():
+            yield "半句"
+            raise anthropic_module.APIError(message="dropped", request=MagicMock(), body=None)
+
+        stream = make_mock_stream([])
+        stream.text_stream = broken()
+        mock_client.messages.stream.return_value = stream
+
+        resp = client.post("/api/chat", json={"their_message": "hello"})
+        events = parse_sse_events(resp.text)
+        assert events == [{"content": "半句"}, {"error": "dropped"}]
+        assert mock_client.messages.stream.call_count == 1
+        stream.__aexit__.assert_awaited_once()
+
+
+def test_chat_coalesces_bursts_of_deltas_into_fewer_frames(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    chunks = [f"{i}," for i in range(100)]
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(chunks)
+        resp = client.post("/api/chat", json={"their_message": "hi"})
+        contents = [e["content"] for e in parse_sse_events(resp.text) if "content" in e]
+        assert "".join(contents) == "".join(chunks)
+        assert contents[0] == "0,"
+        assert len(contents) < 10
+
+        monkeypatch.setattr("app.routers.chat.CHAT_COALESCE_MS", 0)
+        mock_client.messages.stream.return_value = make_mock_stream(chunks)
+        resp = client.post("/api/chat", json={"their_message": "hi again"})
+        assert len([e for e in parse_sse_events(resp.text) if "content" in e]) == 100
+
+
 # ---------------------------------------------------------------------------
 # Request body construction
 # ---------------------------------------------------------------------------
 
 def test_chat_message_included_in_prompt(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream([])
 
         resp = client.post("/api/chat", json={"their_message": "你最近怎么样"})
@@ -426,9 +541,7 @@ def test_chat_message_included_in_prompt(client, monkeypatch):
 
 def test_chat_system_prompt_set(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream([])
 
         client.post("/api/chat", json={"their_message": "hi"})
@@ -439,11 +552,883 @@ def test_chat_system_prompt_set(client, monkeypatch):
 
 def test_chat_max_tokens_set(client, monkeypatch):
     monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
-    with patch("app.routers.chat.anthropic.Anthropic") as mock_cls:
-        mock_client = MagicMock()
-        mock_cls.return_value = mock_client
+    with mock_llm() as mock_client:
         mock_client.messages.stream.return_value = make_mock_stream([])
 
         client.post("/api/chat", json={"their_message": "hi"})
         call_kwargs = mock_client.messages.stream.call_args[1]
         assert call_kwargs["max_tokens"] == 1024
+
+
+# ---------------------------------------------------------------------------
+# Concurrency: streaming replies must not block other requests
+# ---------------------------------------------------------------------------
+
+async def test_phrase_endpoints_stay_fast_during_chat_streams(client, sample_phrases, monkeypatch):
+    import httpx
+    from app.main import app
+
+    from app.admission import AdmissionQueue
+
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    streams, chunks, delay = 20, 10, 0.05  # each reply takes ~0.5s upstream
+    monkeypatch.setattr("app.routers.chat.admission", AdmissionQueue(streams, 0))
+
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = (
+            lambda **kwargs: make_mock_stream(["字"] * chunks, delay)
+        )
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            async def chat():
+                return await http.post("/api/chat", json={"their_message": "hi"})
+
+            async def timed_get(url):
+                start = time.perf_counter()
+                resp = await http.get(url)
+                assert resp.status_code == 200
+                return time.perf_counter() - start
+
+            start = time.perf_counter()
+            chat_tasks = [asyncio.create_task(chat()) for _ in range(streams)]
+            await asyncio.sleep(delay)  # let the streams get going
+            latencies = []
+            for url in ["/api/phrases/", "/api/phrases/categories", "/api/phrases/random", "/api/health"] * 3:
+                latencies.append(await timed_get(url))
+            assert not all(task.done() for task in chat_tasks)
+            replies = await asyncio.gather(*chat_tasks)
+            elapsed = time.perf_counter() - start
+
+    assert all(r.text.count("字") == chunks and "[DONE]" in r.text for r in replies)
+    # Streams overlap instead of running back to back (20 x 0.5s)
+    assert elapsed < streams * chunks * delay / 4
+    # Phrase lookups are served between stream chunks, not after the streams
+    assert max(latencies) < chunks * delay / 2
+
+
+# ---------------------------------------------------------------------------
+# Reply cache
+# ---------------------------------------------------------------------------
+
+def test_chat_repeated_message_replayed_from_cache(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = lambda **kwargs: make_mock_stream(["1️⃣ 在的", "～"])
+
+        first = client.post("/api/chat", json={"their_message": "在吗", "style": "gentle"})
+        second = client.post("/api/chat", json={"their_message": " 在吗 ", "style": "gentle"})
+
+    assert mock_client.messages.stream.call_count == 1
+    replayed = parse_sse_events(second.text)
+    assert replayed == [{"content": "1️⃣ 在的～"}, {"type": "done"}]
+    assert "".join(e["content"] for e in parse_sse_events(first.text) if "content" in e) == "1️⃣ 在的～"
+
+
+def test_chat_cache_keyed_by_style(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = lambda **kwargs: make_mock_stream(["回复"])
+        client.post("/api/chat", json={"their_message": "晚安", "style": "gentle"})
+        client.post("/api/chat", json={"their_message": "晚安", "style": "direct"})
+    assert mock_client.messages.stream.call_count == 2
+
+
+def test_chat_errors_not_cached(client, monkeypatch):
+    import anthropic as anthropic_module
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = anthropic_module.APIError(
+            message="down", request=MagicMock(), body=None
+        )
+        client.post("/api/chat", json={"their_message": "哈哈哈"})
+        mock_client.messages.stream.side_effect = lambda **kwargs: make_mock_stream(["好"])
+        resp = client.post("/api/chat", json={"their_message": "哈哈哈"})
+    assert "[DONE]" in resp.text
+    assert mock_client.messages.stream.call_count == 3
+
+
+def test_chat_cache_stats_report_tokens_saved(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = lambda **kwargs: make_mock_stream(["a", "b", "c"])
+        for _ in range(3):
+            client.post("/api/chat", json={"their_message": "在吗"})
+
+    stats = client.get("/api/stats").json()["chat_cache"]
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == round(2 / 3, 4)
+    assert stats["input_tokens_saved"] == 200
+    assert stats["output_tokens_saved"] == 6
+
+
+# ---------------------------------------------------------------------------
+# Prompt caching, against a local stub of the Messages API
+# ---------------------------------------------------------------------------
+
+async def test_chat_request_marks_static_prompt_for_caching(client, monkeypatch):
+    import httpx
+    from app.llm import create_llm_client, get_llm_client, llm_usage
+    from app.main import app
+    from app.routers.chat import STYLE_GUIDE, SYSTEM_PROMPT
+    from benchmarks.fake_upstream import FakeUpstream
+
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    llm_usage.clear()
+    usage = {"input_tokens": 40, "cache_read_input_tokens": 900, "cache_creation_input_tokens": 0}
+    with FakeUpstream(chunks=3, chunk_delay=0, usage=usage, tls=False) as upstream:
+        llm = create_llm_client(api_key="test-key", base_url=upstream.base_url)
+        app.dependency_overrides[get_llm_client] = lambda: llm
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                resp = await http.post("/api/chat", json={"their_message": "在吗", "style": "gentle"})
+        finally:
+            app.dependency_overrides.pop(get_llm_client, None)
+            await llm.close()
+
+    assert "[DONE]" in resp.text
+    body = upstream.bodies[0]
+    assert body["system"] == [
+        {"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": STYLE_GUIDE, "cache_control": {"type": "ephemeral"}},
+    ]
+    # The per-request turn comes after the breakpoints and is never cached
+    user_blocks = body["messages"][0]["content"]
+    assert all("cache_control" not in block for block in user_blocks)
+    assert "温柔型" in user_blocks[-1]["text"]
+
+    stats = llm_usage.stats()
+    assert stats["requests"] == 1
+    assert stats["cache_read_input_tokens"] == 900
+    assert stats["cache_read_ratio"] == round(900 / 940, 4)
+
+
+# ---------------------------------------------------------------------------
+# Admission control
+# ---------------------------------------------------------------------------
+
+def test_chat_rate_limited_per_client(client, monkeypatch):
+    from app.admission import RateLimiter
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr("app.routers.chat.rate_limiter", RateLimiter(rate=1 / 60, burst=2))
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = lambda **kwargs: make_mock_stream(["好"])
+        statuses = [client.post("/api/chat", json={"their_message": f"消息{i}"}).status_code for i in range(3)]
+        resp = client.post("/api/chat", json={"their_message": "再来"})
+    assert statuses == [200, 200, 429]
+    assert resp.status_code == 429
+    assert 1 <= int(resp.headers["Retry-After"]) <= 60
+
+
+def test_chat_queue_full_returns_429(client, monkeypatch):
+    from app.admission import AdmissionQueue
+    from app.config import CHAT_QUEUE_RETRY_AFTER
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    queue = AdmissionQueue(limit=1, max_waiting=0)
+    monkeypatch.setattr("app.routers.chat.admission", queue)
+    busy = queue.admit()
+
+    resp = client.post("/api/chat", json={"their_message": "在吗"})
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"] == str(CHAT_QUEUE_RETRY_AFTER)
+    busy.release()
+
+
+def test_chat_releases_slot_after_stream(client, monkeypatch):
+    from app.admission import AdmissionQueue
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    queue = AdmissionQueue(limit=1, max_waiting=0)
+    monkeypatch.setattr("app.routers.chat.admission", queue)
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = lambda **kwargs: make_mock_stream(["好"])
+        for i in range(3):
+            assert client.post("/api/chat", json={"their_message": f"消息{i}"}).status_code == 200
+        client.post("/api/chat", json={"their_message": ""})  # validation error path
+    assert queue.active == 0
+
+
+async def test_chat_waiting_request_gets_queue_events(client, monkeypatch):
+    import httpx
+    from app.admission import AdmissionQueue
+    from app.main import app
+
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    queue = AdmissionQueue(limit=1, max_waiting=5)
+    monkeypatch.setattr("app.routers.chat.admission", queue)
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = lambda **kwargs: make_mock_stream(["好"] * 5, 0.02)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            first = asyncio.create_task(http.post("/api/chat", json={"their_message": "第一条"}))
+            await asyncio.sleep(0.01)
+            second = asyncio.create_task(http.post("/api/chat", json={"their_message": "第二条"}))
+            first, second = await asyncio.gather(first, second)
+
+    assert "event: queue" not in first.text
+    assert 'event: queue\ndata: {"queue_position": 1}' in second.text
+    events = parse_sse_events(second.text)
+    assert events[0] == {"queue_position": 1}
+    assert events[-1] == {"type": "done"}
+    assert queue.active == 0
+
+
+# ---------------------------------------------------------------------------
+# Multi-style fan-out
+# ---------------------------------------------------------------------------
+
+def _stream_per_style(delay: float = 0, fail: tuple = ()):
+    """stream() side effect answering with the style label found in the prompt."""
+    import anthropic as anthropic_module
+    from app.routers.chat import STYLE_MAP
+
+    def stream(**kwargs):
+        prompt = kwargs["messages"][0]["content"][-1]["text"]
+        label = next(label for label in STYLE_MAP.values() if label in prompt)
+        if label in fail:
+            raise anthropic_module.APIError(message=f"{label} failed", request=MagicMock(), body=None)
+        return make_mock_stream([label, "!"], delay=delay)
+
+    return stream
+
+
+def test_chat_styles_multiplexes_tagged_events(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = _stream_per_style()
+
+        resp = client.post("/api/chat", json={"their_message": "hi", "styles": ["gentle", "direct"]})
+        events = parse_sse_events(resp.text)
+        assert events[-1] == {"type": "done"}
+        for style, label in (("gentle", "温柔型"), ("direct", "直球型")):
+            mine = [e for e in events if e.get("style") == style]
+            assert mine == [
+                {"style": style, "content": label},
+                {"style": style, "content": "!"},
+                {"style": style, "done": True},
+            ]
+        assert mock_client.messages.stream.call_count == 2
+
+
+def test_chat_styles_generate_concurrently(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = _stream_per_style(delay=0.2)
+
+        start = time.monotonic()
+        resp = client.post("/api/chat", json={
+            "their_message": "hi", "styles": ["humorous", "gentle", "direct", "literary"],
+        })
+        elapsed = time.monotonic() - start
+        assert len([e for e in parse_sse_events(resp.text) if e.get("done")]) == 4
+        # Four generations of two 0.2 s chunks each, in about the time of one
+        assert elapsed < 0.8
+
+
+def test_chat_styles_replays_cached_styles_and_isolates_errors(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = _stream_per_style()
+        client.post("/api/chat", json={"their_message": "hi", "style": "gentle"})
+
+        mock_client.messages.stream.side_effect = _stream_per_style(fail=("直球型",))
+        resp = client.post("/api/chat", json={"their_message": "hi", "styles": ["gentle", "direct", "literary"]})
+        events = parse_sse_events(resp.text)
+        # The cached style comes first, in one piece
+        assert events[:2] == [{"style": "gentle", "content": "温柔型!"}, {"style": "gentle", "done": True}]
+        assert {"style": "direct", "error": "直球型 failed"} in events
+        assert {"style": "literary", "content": "文艺型"} in events
+        assert events[-1] == {"type": "done"}
+
+
+def test_chat_styles_open_no_more_streams_than_admission_slots(client, monkeypatch):
+    from app.admission import AdmissionQueue
+
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr("app.routers.chat.admission", AdmissionQueue(limit=2, max_waiting=5))
+    open_streams, peak = [0], [0]
+    per_style = _stream_per_style(delay=0.05)
+
+    def stream(**kwargs):
+        mock_stream = per_style(**kwargs)
+        texts = mock_stream.text_stream
+
+        async def counted():
+            open_streams[0] += 1
+            peak[0] = max(peak[0], open_streams[0])
+            try:
+                async for text in texts:
+                    yield text
+            finally:
+                open_streams[0] -= 1
+
+        mock_stream.text_stream = counted()
+        return mock_stream
+
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = stream
+        resp = client.post("/api/chat", json={
+            "their_message": "hi", "styles": ["humorous", "gentle", "direct", "literary"],
+        })
+    assert len([e for e in parse_sse_events(resp.text) if e.get("done")]) == 4
+    assert peak[0] == 2
+
+
+def test_chat_styles_are_validated(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    assert client.post("/api/chat", json={"their_message": "hi", "styles": []}).status_code == 422
+    assert client.post("/api/chat", json={"their_message": "hi", "styles": ["gentle"] * 5}).status_code == 422
+
+
+def test_chat_styles_take_one_admission_slot_each(client, monkeypatch):
+    from app.admission import AdmissionQueue
+    from app.routers import chat as chat_router
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr("app.routers.chat.admission", AdmissionQueue(3, 0))
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = _stream_per_style()
+        chat_router.admission.admit()  # one slot taken elsewhere
+        resp = client.post("/api/chat", json={"their_message": "hi", "styles": ["gentle", "direct", "literary"]})
+        assert resp.status_code == 429
+
+
+# ---------------------------------------------------------------------------
+# Multipart uploads
+# ---------------------------------------------------------------------------
+
+def _png_bytes(width: int = 64, height: int = 64) -> bytes:
+    import io
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_chat_upload_streams_reply_with_binary_images(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(["你好"])
+
+        resp = client.post(
+            "/api/chat/upload",
+            data={"their_message": "看图", "style": "gentle"},
+            files=[("images", ("shot.png", _png_bytes(), "image/png"))],
+        )
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        assert {"content": "你好"} in parse_sse_events(resp.text)
+
+        content = mock_client.messages.stream.call_args[1]["messages"][0]["content"]
+        assert [b["type"] for b in content] == ["image", "text"]
+        assert content[0]["source"]["media_type"] == "image/jpeg"
+        assert "看图" in content[1]["text"]
+        assert "温柔型" in content[1]["text"]
+
+
+def test_chat_upload_shares_cache_entries_with_json_requests(client, monkeypatch):
+    import base64
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    png = _png_bytes()
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = lambda **kwargs: make_mock_stream(["once"])
+
+        client.post("/api/chat/upload", data={"their_message": "hi"},
+                    files=[("images", ("a.png", png, "image/png"))])
+        resp = client.post("/api/chat", json={
+            "their_message": "hi",
+            "images": [{"data": base64.b64encode(png).decode(), "media_type": "image/png"}],
+        })
+        assert mock_client.messages.stream.call_count == 1
+        assert {"content": "once"} in parse_sse_events(resp.text)
+
+
+def test_chat_upload_rejects_oversized_body_from_content_length(client, monkeypatch):
+    from app.routers import chat as chat_router
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr("app.routers.chat.CHAT_UPLOAD_MAX_BYTES", 1000)
+    with mock_llm() as mock_client:
+        resp = client.post("/api/chat/upload", data={"their_message": "hi"},
+                           files=[("images", ("big.png", b"\0" * 5000, "image/png"))])
+        assert resp.status_code == 413
+        mock_client.messages.stream.assert_not_called()
+    assert chat_router.admission.active == 0
+
+
+def test_chat_upload_stops_reading_chunked_body_at_limit(client, monkeypatch):
+    from app.routers import chat as chat_router
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr("app.routers.chat.CHAT_UPLOAD_MAX_BYTES", 1000)
+
+    def body():
+        # No Content-Length: the limit has to be enforced while reading
+        yield b"--b\r\nContent-Disposition: form-data; name=\"images\"; filename=\"a.png\"\r\n"
+        yield b"Content-Type: image/png\r\n\r\n"
+        for _ in range(100):
+            yield b"\0" * 500
+
+    with mock_llm():
+        resp = client.post("/api/chat/upload", content=body(),
+                           headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert resp.status_code == 413
+    assert chat_router.admission.active == 0
+
+
+def test_chat_upload_limits_image_count(client, monkeypatch):
+    from app.config import CHAT_UPLOAD_MAX_FILES
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    files = [("images", (f"{i}.png", _png_bytes(), "image/png")) for i in range(CHAT_UPLOAD_MAX_FILES + 1)]
+    with mock_llm() as mock_client:
+        resp = client.post("/api/chat/upload", data={"their_message": "hi"}, files=files)
+        assert resp.status_code == 400
+        mock_client.messages.stream.assert_not_called()
+
+
+def test_chat_upload_rejects_non_images_and_non_multipart(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm():
+        resp = client.post("/api/chat/upload", data={"their_message": "hi"},
+                           files=[("images", ("notes.txt", b"hello", "text/plain"))])
+        assert resp.status_code == 400
+
+        resp = client.post("/api/chat/upload", json={"their_message": "hi"})
+        assert resp.status_code == 415
+
+
+def test_chat_upload_accepts_repeated_styles_fields(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = _stream_per_style()
+        resp = client.post("/api/chat/upload", data={"their_message": "hi", "styles": ["gentle", "literary"]},
+                           files=[("images", ("a.png", _png_bytes(), "image/png"))])
+        done = [e["style"] for e in parse_sse_events(resp.text) if e.get("done")]
+        assert sorted(done) == ["gentle", "literary"]
+
+
+def test_chat_upload_empty_message_and_no_images_yields_error_event(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm():
+        resp = client.post("/api/chat/upload", data={"their_message": "  "},
+                           files=[("unused", ("x.txt", b"x", "text/plain"))])
+        assert resp.status_code == 200
+        assert "error" in parse_sse_events(resp.text)[0]
+
+
+# ---------------------------------------------------------------------------
+# Resumable streams
+# ---------------------------------------------------------------------------
+
+def _frame_ids(text: str) -> list[str]:
+    return [line[4:] for line in text.splitlines() if line.startswith("id: ")]
+
+
+def test_chat_frames_carry_sequential_ids(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr("app.routers.chat.CHAT_COALESCE_MS", 0)
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(["a", "b"])
+        resp = client.post("/api/chat", json={"their_message": "hi"})
+    ids = _frame_ids(resp.text)
+    stream_ids = {i.split(":")[0] for i in ids}
+    assert len(stream_ids) == 1
+    assert [int(i.split(":")[1]) for i in ids] == [0, 1, 2]
+    # Every frame is one event: id line directly followed by its data
+    assert resp.text.count("\n\n") == len(ids)
+
+
+def test_chat_resumes_from_last_event_id_without_calling_upstream(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr("app.routers.chat.CHAT_COALESCE_MS", 0)
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(["a", "b", "c"])
+        first = client.post("/api/chat", json={"their_message": "hi"})
+        ids = _frame_ids(first.text)
+
+        resp = client.post("/api/chat", json={"their_message": "hi"}, headers={"Last-Event-ID": ids[0]})
+        assert _frame_ids(resp.text) == ids[1:]
+        assert parse_sse_events(resp.text) == [{"content": "b"}, {"content": "c"}, {"type": "done"}]
+        assert mock_client.messages.stream.call_count == 1
+
+        # Resuming after the last frame sends nothing more
+        resp = client.post("/api/chat", json={"their_message": "hi"}, headers={"Last-Event-ID": ids[-1]})
+        assert resp.text == ""
+
+    stats = client.get("/api/stats").json()["chat_replay"]
+    assert stats["resumed"] == 2
+    assert stats["running"] == 0
+
+
+def test_chat_unresumable_last_event_id_is_gone(client, monkeypatch):
+    from app.routers.chat import replays
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(["a", "b"])
+        ids = _frame_ids(client.post("/api/chat", json={"their_message": "hi"}).text)
+        # The buffer expired: the client must start over, not get frame 0 again
+        replays.clear()
+        for last_id in (ids[0], "0123456789abcdef:3", "garbage"):
+            resp = client.post("/api/chat", json={"their_message": "hi"}, headers={"Last-Event-ID": last_id})
+            assert resp.status_code == 410
+            assert client.get("/api/chat/resume", headers={"Last-Event-ID": last_id}).status_code == 410
+        assert mock_client.messages.stream.call_count == 1
+
+
+def test_chat_resume_must_match_the_original_request(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(["mine"])
+        ids = _frame_ids(client.post("/api/chat", json={"their_message": "hi"}).text)
+
+        resp = client.post("/api/chat", json={"their_message": "something else"},
+                           headers={"Last-Event-ID": ids[0]})
+        assert resp.status_code == 409
+        assert mock_client.messages.stream.call_count == 1
+
+
+def test_chat_resume_is_not_rate_limited(client, monkeypatch):
+    from app.admission import RateLimiter
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(["a", "b"])
+        ids = _frame_ids(client.post("/api/chat", json={"their_message": "hi"}).text)
+        monkeypatch.setattr("app.routers.chat.rate_limiter", RateLimiter(1 / 60, 1))
+        assert client.post("/api/chat", json={"their_message": "other"}).status_code == 200
+        # The bucket is empty: new generations are refused, resumes are not
+        assert client.post("/api/chat", json={"their_message": "third"}).status_code == 429
+        headers = {"Last-Event-ID": ids[0]}
+        for _ in range(3):
+            resp = client.post("/api/chat", json={"their_message": "hi"}, headers=headers)
+            assert resp.status_code == 200
+            assert _frame_ids(resp.text) == ids[1:]
+        assert client.get("/api/chat/resume", headers=headers).status_code == 200
+
+
+def test_chat_long_stream_reaches_late_reader_in_full(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr("app.routers.chat.CHAT_COALESCE_MS", 0)
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream([f"{i}," for i in range(500)])
+        resp = client.post("/api/chat", json={"their_message": "hi"})
+        events = parse_sse_events(resp.text)
+        assert len(events) == 501 and events[-1] == {"type": "done"}
+
+
+def test_chat_upload_resumes_too(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(["a"])
+        files = [("images", ("a.png", _png_bytes(), "image/png"))]
+        first = client.post("/api/chat/upload", data={"their_message": "hi"}, files=files)
+        ids = _frame_ids(first.text)
+        resp = client.post("/api/chat/upload", data={"their_message": "hi"}, files=files,
+                           headers={"Last-Event-ID": ids[0]})
+        assert _frame_ids(resp.text) == ids[1:]
+        assert mock_client.messages.stream.call_count == 1
+
+
+def test_chat_resume_endpoint_needs_only_the_last_event_id(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr("app.routers.chat.CHAT_COALESCE_MS", 0)
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(["a", "b"])
+        files = [("images", ("a.png", _png_bytes(), "image/png"))]
+        ids = _frame_ids(client.post("/api/chat/upload", data={"their_message": "hi"}, files=files).text)
+        resp = client.get("/api/chat/resume", headers={"Last-Event-ID": ids[0]})
+        assert _frame_ids(resp.text) == ids[1:]
+        assert parse_sse_events(resp.text) == [{"content": "b"}, {"type": "done"}]
+        assert mock_client.messages.stream.call_count == 1
+    assert client.get("/api/chat/resume").status_code == 400
+
+
+# ---------------------------------------------------------------------------
+# Reply events: numbered replies parsed while they stream
+# ---------------------------------------------------------------------------
+
+def _named_events(text: str) -> list[tuple[Optional[str], dict]]:
+    """(event name or None, data) for every JSON frame."""
+    events = []
+    for block in text.split("\n\n"):
+        name = None
+        for line in block.splitlines():
+            if line.startswith("event: "):
+                name = line[7:]
+            elif line.startswith("data: ") and line[6:] != "[DONE]":
+                events.append((name, json.loads(line[6:])))
+    return events
+
+
+NUMBERED = ["1", "️⃣ 在", "呢\n\n2️", "⃣ 想你了\n\n3️⃣ 晚安"]
+
+
+def test_chat_reply_events_follow_the_numbered_replies(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(NUMBERED)
+
+        resp = client.post("/api/chat", json={"their_message": "在吗", "events": "replies"})
+        events = _named_events(resp.text)
+        assert not any("content" in data for _, data in events)
+        assert [data for name, data in events if name == "reply_end"] == [
+            {"index": 1, "text": "在呢"}, {"index": 2, "text": "想你了"}, {"index": 3, "text": "晚安"},
+        ]
+        # Reply 1 ends as soon as the 2️⃣ marker has arrived
+        names = [(name, data["index"]) for name, data in events]
+        assert names.index(("reply_end", 1)) < names.index(("reply_start", 2))
+        deltas = "".join(data["text"] for name, data in events if name == "reply_delta" and data["index"] == 2)
+        assert deltas.strip() == "想你了"
+        assert resp.text.rstrip().endswith("data: [DONE]")
+
+
+def test_chat_reply_events_from_cache_and_with_styles(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(NUMBERED)
+        client.post("/api/chat", json={"their_message": "在吗"})
+
+        resp = client.post("/api/chat", json={"their_message": "在吗", "events": "replies"})
+        ends = [data["text"] for name, data in _named_events(resp.text) if name == "reply_end"]
+        assert ends == ["在呢", "想你了", "晚安"]
+
+        mock_client.messages.stream.side_effect = _stream_per_style()
+        resp = client.post("/api/chat", json={
+            "their_message": "hi", "styles": ["gentle", "direct"], "events": "replies",
+        })
+        events = _named_events(resp.text)
+        assert ("reply_end", {"style": "gentle", "index": 0, "text": "温柔型!"}) in events
+        assert (None, {"style": "direct", "done": True}) in events
+
+
+def test_chat_reply_events_stop_without_end_on_error(client, monkeypatch):
+    import anthropic
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        stream = make_mock_stream(["1️⃣ 在"])
+        stream.get_final_message.side_effect = anthropic.APIError(message="boom", request=MagicMock(), body=None)
+        mock_client.messages.stream.return_value = stream
+
+        resp = client.post("/api/chat", json={"their_message": "在吗", "events": "replies"})
+        events = _named_events(resp.text)
+        assert ("reply_start", {"index": 1}) in events
+        assert not any(name == "reply_end" for name, _ in events)
+        assert events[-1] == (None, {"error": "boom"})
+
+
+def test_chat_upload_accepts_events_field(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(NUMBERED)
+        files = [("images", ("a.png", _png_bytes(), "image/png"))]
+        resp = client.post("/api/chat/upload", data={"their_message": "hi", "events": "replies"}, files=files)
+        assert sum(name == "reply_end" for name, _ in _named_events(resp.text)) == 3
+
+
+# ---------------------------------------------------------------------------
+# Phrase-library suggestions ahead of the generation
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def with_suggestions(monkeypatch):
+    from app.suggestions import suggestion_cache
+    monkeypatch.setattr("app.routers.chat.CHAT_SUGGESTIONS", 2)
+    suggestion_cache.clear()
+    yield
+    suggestion_cache.clear()
+
+
+def test_chat_opens_with_library_suggestions(client, monkeypatch, sample_phrases, with_suggestions):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(["嗯"])
+
+        resp = client.post("/api/chat", json={"their_message": "晚安呀", "style": "gentle"})
+        events = _named_events(resp.text)
+        name, data = events[0]
+        assert name == "suggestions"
+        assert [s["content"] for s in data["suggestions"]] == ["晚安，梦里都是你"]
+        assert (None, {"content": "嗯"}) in events
+
+
+def test_chat_suggestions_are_tagged_per_style(client, monkeypatch, sample_phrases, with_suggestions):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = _stream_per_style()
+        resp = client.post("/api/chat", json={"their_message": "你好", "styles": ["gentle", "direct"]})
+        opening = _named_events(resp.text)[:2]
+        assert [(name, data["style"]) for name, data in opening] == [
+            ("suggestions", "gentle"), ("suggestions", "direct"),
+        ]
+
+
+def test_chat_streams_without_suggestions_when_lookup_fails(client, monkeypatch, with_suggestions):
+    from sqlalchemy.exc import OperationalError
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr(
+        "app.routers.chat.suggest_phrases", AsyncMock(side_effect=OperationalError("SELECT", {}, Exception())),
+    )
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(["嗯"])
+        resp = client.post("/api/chat", json={"their_message": "晚安"})
+        assert _named_events(resp.text) == [(None, {"content": "嗯"})]
+
+
+def test_chat_upload_opens_with_suggestions(client, monkeypatch, sample_phrases, with_suggestions):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.return_value = make_mock_stream(["嗯"])
+        files = [("images", ("a.png", _png_bytes(), "image/png"))]
+        resp = client.post("/api/chat/upload", data={"their_message": "你笑起来"}, files=files)
+        name, data = _named_events(resp.text)[0]
+        assert name == "suggestions"
+        assert data["suggestions"][0]["content"] == "你笑起来真好看"
+
+
+# ---------------------------------------------------------------------------
+# Single flight: identical concurrent requests share one generation
+# ---------------------------------------------------------------------------
+
+async def _concurrent_posts(*bodies, stagger: float = 0.05):
+    import httpx
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        tasks = []
+        for body in bodies:
+            tasks.append(asyncio.create_task(http.post("/api/chat", json=body)))
+            await asyncio.sleep(stagger)
+        return await asyncio.gather(*tasks)
+
+
+async def test_chat_identical_concurrent_requests_share_one_generation(client, monkeypatch):
+    from app.routers import chat
+
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr("app.routers.chat.CHAT_COALESCE_MS", 0)
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = lambda **kwargs: make_mock_stream(["在", "呢", "！"], 0.05)
+        # The second and third arrive mid-generation, with the message spelled slightly differently
+        first, second, third = await _concurrent_posts(
+            {"their_message": "在吗"}, {"their_message": " 在吗 "}, {"their_message": "在吗"},
+        )
+
+    assert mock_client.messages.stream.call_count == 1
+    # Late joiners get every frame, under the same ids, so they can resume too
+    assert first.text == second.text == third.text
+    assert "".join(e.get("content", "") for e in parse_sse_events(third.text)) == "在呢！"
+    assert chat.replays.stats()["joined"] == 2
+    assert chat.admission.active == 0
+
+
+async def test_chat_different_requests_do_not_share(client, monkeypatch):
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = lambda **kwargs: make_mock_stream(["好"], 0.3)
+        await _concurrent_posts(
+            {"their_message": "在吗"},
+            {"their_message": "在吗", "style": "gentle"},
+            {"their_message": "在吗", "context": "刚认识"},
+            {"their_message": "在吗", "events": "replies"},
+        )
+    assert mock_client.messages.stream.call_count == 4
+
+
+def test_chat_finished_generation_is_not_joined(client, monkeypatch):
+    from app.routers import chat
+
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = lambda **kwargs: make_mock_stream(["好"])
+        first = client.post("/api/chat", json={"their_message": "在吗"})
+        second = client.post("/api/chat", json={"their_message": "在吗"})
+    # Answered from the reply cache by a generation of its own
+    assert _frame_ids(first.text)[0].split(":")[0] != _frame_ids(second.text)[0].split(":")[0]
+    assert chat.replays.stats()["joined"] == 0
+
+
+# ---------------------------------------------------------------------------
+# Client disconnects cancel the upstream generation
+# ---------------------------------------------------------------------------
+
+async def _post_then_disconnect(body: dict, frames_before_leaving: int) -> list[str]:
+    """POST /api/chat over raw ASGI and disconnect after ``frames_before_leaving`` body chunks."""
+    from app.main import app
+
+    gone = asyncio.Event()
+    request = [{"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}]
+    received = []
+
+    async def receive():
+        if request:
+            return request.pop()
+        await gone.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            received.append(message["body"].decode())
+            if len(received) >= frames_before_leaving:
+                gone.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/api/chat", "raw_path": b"/api/chat", "root_path": "",
+        "query_string": b"", "headers": [(b"content-type", b"application/json"), (b"host", b"test")],
+        "client": ("127.0.0.1", 1234), "server": ("test", 80),
+    }
+    await app(scope, receive, send)
+    return received
+
+
+async def test_chat_disconnect_cancels_upstream_and_releases_slot(client, monkeypatch):
+    from app.llm import llm_usage
+    from app.routers import chat
+
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    monkeypatch.setattr("app.routers.chat.CHAT_COALESCE_MS", 0)
+    llm_usage.clear()
+    pulled = []
+
+    async def tokens():
+        for i in range(100):
+            await asyncio.sleep(0.01)
+            pulled.append(i)
+            yield "字"
+
+    with mock_llm() as mock_client:
+        stream = make_mock_stream([])
+        stream.text_stream = tokens()
+        mock_client.messages.stream.return_value = stream
+
+        received = await _post_then_disconnect({"their_message": "在吗"}, frames_before_leaving=2)
+        await asyncio.sleep(0.05)
+
+    assert len(received) >= 2
+    # Upstream was closed long before the reply's 100 tokens
+    assert len(pulled) < 20
+    stream.__aexit__.assert_awaited()
+    assert chat.admission.active == 0
+    assert chat.replays.stats()["abandoned"] == 1
+    stats = llm_usage.stats()
+    assert stats["cancelled"] == 1 and stats["requests"] == 0
+    # No finished reply to average yet: measured against max_tokens, less what was generated
+    assert chat.MAX_TOKENS - len(pulled) <= stats["output_tokens_saved"] < chat.MAX_TOKENS
+    llm_usage.clear()
+
+
+async def test_chat_generation_shared_with_a_joiner_survives_one_disconnect(client, monkeypatch):
+    import httpx
+    from app.main import app
+
+    monkeypatch.setattr("app.routers.chat.CLAUDE_API_KEY", "test-key")
+    with mock_llm() as mock_client:
+        mock_client.messages.stream.side_effect = lambda **kwargs: make_mock_stream(["在", "呢"], 0.1)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            leaver = asyncio.create_task(_post_then_disconnect({"their_message": "在吗"}, 1))
+            await asyncio.sleep(0.02)
+            stayer = await http.post("/api/chat", json={"their_message": "在吗"})
+            await leaver
+
+    assert mock_client.messages.stream.call_count == 1
+    assert "".join(e.get("content", "") for e in parse_sse_events(stayer.text)) == "在呢"
+    assert parse_sse_events(stayer.text)[-1] == {"type": "done"}
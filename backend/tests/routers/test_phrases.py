@@ -158,6 +158,12 @@ def test_random_phrase_with_category(client, sample_phrases):
     assert data["category"] == "土味情话"
 
 
+def test_random_phrase_empty_category_means_any(client, sample_phrases):
+    resp = client.get("/api/phrases/random?category=")
+    assert resp.status_code == 200
+    assert resp.json()["id"] in {p.id for p in sample_phrases}
+
+
 def test_random_phrase_404_empty_db(client):
     resp = client.get("/api/phrases/random")
     assert resp.status_code == 404
@@ -222,3 +228,405 @@ def test_categories_correct_names(client, sample_phrases):
     assert "开场白" in names
     assert "土味情话" in names
     assert "早安晚安" in names
+
+
+def test_list_phrases_search_matches_tags(client, sample_phrases):
+    resp = client.get("/api/phrases/?search=浪漫")
+    data = resp.json()
+    assert [p["content"] for p in data] == ["你是我的宇宙"]
+
+
+def test_list_phrases_search_single_char(client, sample_phrases):
+    resp = client.get("/api/phrases/?search=宙")
+    data = resp.json()
+    assert len(data) == 1
+    assert "宇宙" in data[0]["content"]
+
+
+def test_list_phrases_search_punctuation_only(client, sample_phrases):
+    # Nothing indexable in the term, falls back to a substring scan
+    resp = client.get("/api/phrases/?search=，")
+    assert resp.status_code == 200
+    assert len(resp.json()) == 2
+
+
+def test_list_phrases_search_ranks_by_relevance(client, db):
+    from app.models import Phrase
+    db.add(Phrase(content="今天的晚霞很美，像你一样", category="高甜语录"))
+    db.add(Phrase(content="晚霞晚霞晚霞，都不如你", category="高甜语录"))
+    db.commit()
+
+    resp = client.get("/api/phrases/?search=晚霞")
+    data = resp.json()
+    assert data[0]["content"] == "晚霞晚霞晚霞，都不如你"
+
+
+async def test_list_phrases_search_finds_saved_phrases(client, async_db):
+    from app.agents.utils import save_new_phrases
+    await save_new_phrases(async_db, [{"content": "这是一条通过智能体保存的新鲜话术", "category": "开场白"}])
+
+    resp = client.get("/api/phrases/?search=新鲜话术")
+    assert len(resp.json()) == 1
+
+
+def _add_phrases(db, n, category="开场白"):
+    from app.models import Phrase
+    for i in range(n):
+        db.add(Phrase(content=f"话术{category}{i}", category=category))
+    db.commit()
+
+
+def test_list_phrases_next_cursor_header_on_full_page(client, db):
+    _add_phrases(db, 5)
+    resp = client.get("/api/phrases/?limit=2")
+    assert "x-next-cursor" in resp.headers
+
+
+def test_list_phrases_no_next_cursor_on_last_page(client, db):
+    _add_phrases(db, 3)
+    resp = client.get("/api/phrases/?limit=5")
+    assert "x-next-cursor" not in resp.headers
+
+
+def test_list_phrases_cursor_walks_all_pages(client, db):
+    _add_phrases(db, 7)
+    expected = [p["id"] for p in client.get("/api/phrases/?limit=100").json()]
+
+    seen = []
+    url = "/api/phrases/?limit=3"
+    while url:
+        resp = client.get(url)
+        seen.extend(p["id"] for p in resp.json())
+        cursor = resp.headers.get("x-next-cursor")
+        url = f"/api/phrases/?limit=3&cursor={cursor}" if cursor else None
+    assert seen == expected
+
+
+def test_list_phrases_cursor_with_category(client, db):
+    _add_phrases(db, 4, category="开场白")
+    _add_phrases(db, 4, category="土味情话")
+    first = client.get("/api/phrases/?category=土味情话&limit=2")
+    cursor = first.headers["x-next-cursor"]
+    second = client.get(f"/api/phrases/?category=土味情话&limit=2&cursor={cursor}")
+    data = first.json() + second.json()
+    assert len({p["id"] for p in data}) == 4
+    assert all(p["category"] == "土味情话" for p in data)
+
+
+def test_list_phrases_cursor_with_search(client, db):
+    _add_phrases(db, 5)
+    first = client.get("/api/phrases/?search=话术&limit=3")
+    cursor = first.headers["x-next-cursor"]
+    second = client.get(f"/api/phrases/?search=话术&limit=3&cursor={cursor}")
+    ids = [p["id"] for p in first.json() + second.json()]
+    assert len(ids) == len(set(ids)) == 5
+
+
+def test_list_phrases_cursor_overrides_offset(client, db):
+    _add_phrases(db, 6)
+    cursor = client.get("/api/phrases/?limit=2").headers["x-next-cursor"]
+    with_offset = client.get(f"/api/phrases/?limit=2&offset=4&cursor={cursor}")
+    without_offset = client.get(f"/api/phrases/?limit=2&cursor={cursor}")
+    assert with_offset.json() == without_offset.json()
+
+
+def test_list_phrases_invalid_cursor(client):
+    resp = client.get("/api/phrases/?cursor=not-a-cursor")
+    assert resp.status_code == 400
+
+
+def test_random_phrase_n_returns_distinct_list(client, sample_phrases):
+    resp = client.get("/api/phrases/random?n=3")
+    assert resp.status_code == 200
+    data = resp.json()
+    assert isinstance(data, list)
+    assert len(data) == 3
+    assert len({p["id"] for p in data}) == 3
+
+
+def test_random_phrase_n_capped_by_category_size(client, sample_phrases):
+    resp = client.get("/api/phrases/random?category=开场白&n=10")
+    data = resp.json()
+    assert len(data) == 2
+    assert all(p["category"] == "开场白" for p in data)
+
+
+def test_random_phrase_n_out_of_range(client):
+    assert client.get("/api/phrases/random?n=0").status_code == 422
+    assert client.get("/api/phrases/random?n=21").status_code == 422
+
+
+async def test_random_phrase_sees_saved_phrases(client, sample_phrases, async_db):
+    from app.agents.utils import save_new_phrases
+    client.get("/api/phrases/random")  # index now loaded
+    await save_new_phrases(async_db, [{"content": "这是新保存进来的一条话术内容", "category": "新分类"}])
+    resp = client.get("/api/phrases/random?category=新分类")
+    assert resp.status_code == 200
+    assert resp.json()["content"] == "这是新保存进来的一条话术内容"
+
+
+def test_random_phrase_survives_rows_deleted_outside_orm(client, sample_phrases, db):
+    from sqlalchemy import text
+    from app.corpus import bump_version
+    client.get("/api/phrases/random?n=5")
+    db.execute(text("DELETE FROM phrases WHERE category = '早安晚安'"))
+    db.commit()
+    bump_version()  # raw SQL writers must announce changes; the id index stays stale
+    resp = client.get("/api/phrases/random?category=早安晚安")
+    assert resp.status_code == 404
+
+
+async def test_categories_reflect_saved_phrases(client, sample_phrases, async_db):
+    from app.agents.utils import save_new_phrases
+    await save_new_phrases(async_db, [{"content": "这是新保存进来的一条话术内容", "category": "早安晚安"}])
+    data = client.get("/api/phrases/categories").json()
+    assert {item["name"]: item["count"] for item in data}["早安晚安"] == 2
+
+
+def test_categories_skip_emptied_category(client, sample_phrases, db):
+    db.delete(next(p for p in sample_phrases if p.category == "早安晚安"))
+    db.commit()
+    names = {item["name"] for item in client.get("/api/phrases/categories").json()}
+    assert "早安晚安" not in names
+
+
+def test_list_phrases_served_from_cache(client, sample_phrases):
+    from app.routers.phrases import response_cache
+    first = client.get("/api/phrases/?category=开场白")
+    hits = response_cache.hits
+    second = client.get("/api/phrases/?category=开场白")
+    assert response_cache.hits == hits + 1
+    assert second.content == first.content
+
+
+def test_list_phrases_cache_keeps_cursor_header(client, db):
+    _add_phrases(db, 5)
+    first = client.get("/api/phrases/?limit=2")
+    second = client.get("/api/phrases/?limit=2")
+    assert second.headers["x-next-cursor"] == first.headers["x-next-cursor"]
+
+
+def test_list_phrases_cache_invalidated_by_commit(client, sample_phrases, db):
+    from app.models import Phrase
+    before = client.get("/api/phrases/?category=开场白").json()
+    db.add(Phrase(content="提交后应该马上可见", category="开场白"))
+    db.commit()
+    after = client.get("/api/phrases/?category=开场白").json()
+    assert len(after) == len(before) + 1
+
+
+def test_list_phrases_cached_body_matches_schema(client, sample_phrases):
+    client.get("/api/phrases/")
+    data = client.get("/api/phrases/").json()
+    assert set(data[0]) == {"id", "content", "category", "tags", "is_pickup_line", "created_at"}
+
+
+def test_random_phrase_cached_bodies_stay_random(client, db):
+    _add_phrases(db, 30)
+    ids = {client.get("/api/phrases/random").json()["id"] for _ in range(20)}
+    assert len(ids) > 1
+
+
+def test_categories_served_from_cache(client, sample_phrases):
+    from app.routers.phrases import response_cache
+    client.get("/api/phrases/categories")
+    hits = response_cache.hits
+    client.get("/api/phrases/categories")
+    assert response_cache.hits == hits + 1
+
+
+def test_list_phrases_sends_validators(client, sample_phrases):
+    resp = client.get("/api/phrases/")
+    assert resp.headers["etag"].startswith('"')
+    assert "max-age=" in resp.headers["cache-control"]
+    assert "stale-while-revalidate=" in resp.headers["cache-control"]
+
+
+def test_list_phrases_304_on_matching_etag(client, sample_phrases):
+    etag = client.get("/api/phrases/?category=开场白").headers["etag"]
+    resp = client.get("/api/phrases/?category=开场白", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.content == b""
+    assert resp.headers["etag"] == etag
+
+
+def test_list_phrases_304_skips_database(client, sample_phrases):
+    from app.database import get_async_db
+    from app.main import app
+    etag = client.get("/api/phrases/").headers["etag"]
+
+    class NoQuerySession:
+        def get_bind(self):
+            from tests.conftest import async_engine
+            return async_engine.sync_engine
+
+    app.dependency_overrides[get_async_db] = lambda: NoQuerySession()
+    resp = client.get("/api/phrases/", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+
+def test_list_phrases_etag_differs_by_params(client, sample_phrases):
+    a = client.get("/api/phrases/?category=开场白").headers["etag"]
+    b = client.get("/api/phrases/?category=土味情话").headers["etag"]
+    assert a != b
+
+
+def test_list_phrases_etag_changes_after_commit(client, sample_phrases, db):
+    from app.models import Phrase
+    etag = client.get("/api/phrases/").headers["etag"]
+    db.add(Phrase(content="新的一条", category="开场白"))
+    db.commit()
+    resp = client.get("/api/phrases/", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["etag"] != etag
+
+
+def test_list_phrases_etag_survives_restart(client, sample_phrases):
+    # Another worker, or this one after a restart, starts with an empty cache
+    from app.routers.phrases import response_cache
+    etag = client.get("/api/phrases/?category=开场白").headers["etag"]
+    response_cache.clear()
+    resp = client.get("/api/phrases/?category=开场白", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.headers["etag"] == etag
+
+
+def test_list_phrases_if_none_match_list_and_weak(client, sample_phrases):
+    etag = client.get("/api/phrases/").headers["etag"]
+    resp = client.get("/api/phrases/", headers={"If-None-Match": f'"other", W/{etag}'})
+    assert resp.status_code == 304
+
+
+def test_categories_304_on_matching_etag(client, sample_phrases):
+    etag = client.get("/api/phrases/categories").headers["etag"]
+    resp = client.get("/api/phrases/categories", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+
+def test_list_phrases_fast_path_matches_pydantic(client, sample_phrases):
+    from app.schemas import PhraseOut
+    data = client.get("/api/phrases/?limit=100").json()
+    by_id = {p.id: p for p in sample_phrases}
+    for item in data:
+        assert item == PhraseOut.model_validate(by_id[item["id"]]).model_dump(mode="json")
+
+
+def test_random_fast_path_matches_pydantic(client, sample_phrases):
+    from app.schemas import PhraseOut
+    item = client.get("/api/phrases/random").json()
+    phrase = next(p for p in sample_phrases if p.id == item["id"])
+    assert item == PhraseOut.model_validate(phrase).model_dump(mode="json")
+
+
+def test_openapi_keeps_response_schemas(client):
+    paths = client.get("/openapi.json").json()["paths"]
+    list_schema = paths["/api/phrases/"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert list_schema["items"]["$ref"].endswith("/PhraseOut")
+    cat_schema = paths["/api/phrases/categories"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert cat_schema["items"]["$ref"].endswith("/CategoryOut")
+
+
+def test_batch_empty_request(client):
+    resp = client.post("/api/phrases/batch", json={})
+    assert resp.status_code == 200
+    assert resp.json() == {"ids": [], "pages": [], "random": [], "categories": None}
+
+
+def test_batch_ids_in_requested_order(client, sample_phrases):
+    ids = [sample_phrases[2].id, 99999, sample_phrases[0].id]
+    resp = client.post("/api/phrases/batch", json={"ids": ids})
+    data = resp.json()
+    assert [p["id"] for p in data["ids"]] == [sample_phrases[2].id, sample_phrases[0].id]
+    assert data["ids"][0]["content"] == "你是我的宇宙"
+
+
+def test_batch_pages_match_list_endpoint(client, sample_phrases):
+    pages = [{"category": "开场白"}, {"category": "土味情话", "limit": 1}, {"search": "宇宙"}, {}]
+    data = client.post("/api/phrases/batch", json={"pages": pages}).json()
+    for page, result in zip(pages, data["pages"]):
+        resp = client.get("/api/phrases/", params=page)
+        assert result["items"] == resp.json()
+        assert result["next_cursor"] == resp.headers.get("X-Next-Cursor")
+    assert data["pages"][1]["next_cursor"] is not None
+
+
+def test_batch_pages_share_cache_entries_with_list_endpoint(client, sample_phrases):
+    from app.routers.phrases import response_cache
+    client.get("/api/phrases/", params={"category": "开场白"})
+    hits = response_cache.hits
+    client.post("/api/phrases/batch", json={"pages": [{"category": "开场白"}]})
+    assert response_cache.hits == hits + 1
+
+    client.post("/api/phrases/batch", json={"pages": [{"category": "土味情话"}]})
+    hits = response_cache.hits
+    client.get("/api/phrases/", params={"category": "土味情话", "offset": 0})
+    assert response_cache.hits == hits + 1
+
+
+def test_batch_pages_one_query(client, sample_phrases):
+    from sqlalchemy import event
+    from app.main import app
+    from app.database import get_async_db
+
+    statements = []
+    pages = [{"category": "开场白", "limit": 7}, {"category": "土味情话", "limit": 7}, {"category": "早安晚安", "limit": 7}]
+    override = app.dependency_overrides[get_async_db]
+
+    async def counting_db():
+        async for session in override():
+            sync_engine = session.get_bind()
+            listener = lambda *args: statements.append(args[2])
+            event.listen(sync_engine, "before_cursor_execute", listener)
+            try:
+                yield session
+            finally:
+                event.remove(sync_engine, "before_cursor_execute", listener)
+
+    app.dependency_overrides[get_async_db] = counting_db
+    try:
+        data = client.post("/api/phrases/batch", json={"pages": pages}).json()
+    finally:
+        app.dependency_overrides[get_async_db] = override
+    assert [len(page["items"]) for page in data["pages"]] == [2, 2, 1]
+    assert len([s for s in statements if "phrases" in s]) == 1
+
+
+def test_batch_cursor_continues_page(client, db):
+    from app.models import Phrase
+    for i in range(5):
+        db.add(Phrase(content=f"话术{i}", category="开场白"))
+    db.commit()
+
+    first = client.post("/api/phrases/batch", json={"pages": [{"limit": 3}]}).json()["pages"][0]
+    second = client.post(
+        "/api/phrases/batch", json={"pages": [{"limit": 3, "cursor": first["next_cursor"]}]}
+    ).json()["pages"][0]
+    ids = [p["id"] for p in first["items"] + second["items"]]
+    assert len(ids) == len(set(ids)) == 5
+    assert second["next_cursor"] is None
+
+
+def test_batch_random_and_categories(client, sample_phrases):
+    data = client.post(
+        "/api/phrases/batch",
+        json={"random": [{"category": "土味情话", "n": 5}, {"category": "不存在分类"}], "categories": True},
+    ).json()
+    assert len(data["random"][0]) == 2
+    assert all(p["category"] == "土味情话" for p in data["random"][0])
+    assert data["random"][1] == []
+    assert data["categories"] == client.get("/api/phrases/categories").json()
+
+
+def test_batch_random_empty_category_means_any(client, sample_phrases):
+    resp = client.post("/api/phrases/batch", json={"random": [{"category": "", "n": 3}]})
+    assert len(resp.json()["random"][0]) == 3
+
+
+def test_batch_invalid_cursor(client):
+    resp = client.post("/api/phrases/batch", json={"pages": [{"cursor": "!!!"}]})
+    assert resp.status_code == 400
+
+
+def test_batch_too_many_pages(client):
+    resp = client.post("/api/phrases/batch", json={"pages": [{}] * 11})
+    assert resp.status_code == 422
@@ -0,0 +1,137 @@
+import asyncio
+
+from app.admission import AdmissionQueue, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limiter_allows_burst_then_rejects():
+    limiter = RateLimiter(rate=1, burst=3, clock=FakeClock())
+    assert [limiter.hit("a") for _ in range(3)] == [None, None, None]
+    assert limiter.hit("a") == 1.0
+    assert limiter.rejected == 1
+
+
+def test_rate_limiter_refills_over_time():
+    clock = FakeClock()
+    limiter = RateLimiter(rate=0.5, burst=1, clock=clock)
+    assert limiter.hit("a") is None
+    assert limiter.hit("a") == 2.0
+    clock.now = 1.0
+    assert limiter.hit("a") == 1.0
+    clock.now = 3.0
+    assert limiter.hit("a") is None
+
+
+def test_rate_limiter_is_per_client():
+    limiter = RateLimiter(rate=1, burst=1, clock=FakeClock())
+    assert limiter.hit("a") is None
+    assert limiter.hit("b") is None
+    assert limiter.hit("a") is not None
+
+
+def test_rate_limiter_zero_rate_disables():
+    limiter = RateLimiter(rate=0, burst=0)
+    assert all(limiter.hit("a") is None for _ in range(100))
+
+
+def test_rate_limiter_forgets_oldest_clients():
+    limiter = RateLimiter(rate=1, burst=1, max_clients=2, clock=FakeClock())
+    for key in ("a", "b", "c"):
+        limiter.hit(key)
+    assert limiter.hit("a") is None  # evicted, so its bucket starts full
+
+
+def test_admission_admits_up_to_limit_then_queues():
+    queue = AdmissionQueue(limit=2, max_waiting=1)
+    first, second, third = queue.admit(), queue.admit(), queue.admit()
+    assert first.admitted and second.admitted
+    assert not third.admitted
+    assert third.position == 1
+    assert queue.admit() is None
+    assert queue.stats() == {"active": 2, "limit": 2, "waiting": 1, "max_waiting": 1, "rejected": 1}
+
+
+def test_admission_release_hands_slot_to_next_in_line():
+    queue = AdmissionQueue(limit=1, max_waiting=2)
+    running, next_up, last = queue.admit(), queue.admit(), queue.admit()
+    assert (next_up.position, last.position) == (1, 2)
+    running.release()
+    assert next_up.admitted
+    assert last.position == 1
+    assert queue.active == 1
+    next_up.release()
+    last.release()
+    assert queue.active == 0
+
+
+def test_admission_release_is_idempotent():
+    queue = AdmissionQueue(limit=1, max_waiting=0)
+    ticket = queue.admit()
+    ticket.release()
+    ticket.release()
+    assert queue.active == 0
+
+
+def test_admission_waiting_ticket_can_leave_the_line():
+    queue = AdmissionQueue(limit=1, max_waiting=2)
+    running, leaving, staying = queue.admit(), queue.admit(), queue.admit()
+    leaving.release()
+    assert staying.position == 1
+    running.release()
+    assert staying.admitted
+
+
+def test_admission_weighted_tickets_take_several_slots():
+    queue = AdmissionQueue(limit=4, max_waiting=2)
+    fan_out = queue.admit(weight=3)
+    assert fan_out.admitted and queue.active == 3
+    big, small = queue.admit(weight=2), queue.admit()
+    # First come first served: the small ticket doesn't jump the line
+    assert not big.admitted and not small.admitted
+    fan_out.release()
+    assert big.admitted and small.admitted
+    assert queue.active == 3
+    big.release()
+    small.release()
+    assert queue.active == 0
+    # Weight is capped at the limit, so a large fan-out can still run (in turns)
+    assert queue.admit(weight=10).weight == 4
+
+
+def test_try_acquire_takes_only_free_slots():
+    queue = AdmissionQueue(limit=2, max_waiting=2)
+    first = queue.admit()
+    spare = queue.try_acquire()
+    assert spare.admitted and queue.active == 2
+    assert queue.try_acquire() is None
+    spare.release()
+    # Nobody jumps ahead of a waiting ticket
+    queue.admit(weight=2)
+    assert queue.try_acquire() is None
+    first.release()
+
+
+async def test_wait_turn_reports_positions_until_admitted():
+    queue = AdmissionQueue(limit=1, max_waiting=2)
+    first, second, third = queue.admit(), queue.admit(), queue.admit()
+    positions = []
+
+    async def wait():
+        async for position in third.wait_turn():
+            positions.append(position)
+
+    waiter = asyncio.create_task(wait())
+    await asyncio.sleep(0)
+    first.release()
+    await asyncio.sleep(0)
+    second.release()
+    await asyncio.wait_for(waiter, 1)
+    assert positions == [2, 1]
+    assert third.admitted
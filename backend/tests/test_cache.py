@@ -0,0 +1,52 @@
+from unittest.mock import patch
+
+from app.cache import LRUCache
+
+
+def test_get_missing_counts_miss():
+    cache = LRUCache(2)
+    assert cache.get("a") is None
+    assert cache.misses == 1
+
+
+def test_put_then_get_counts_hit():
+    cache = LRUCache(2)
+    cache.put("a", b"1")
+    assert cache.get("a") == b"1"
+    assert cache.hits == 1
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_ttl_expires_entries():
+    cache = LRUCache(2, ttl=10)
+    with patch("app.cache.time.monotonic", return_value=100.0):
+        cache.put("a", 1)
+    with patch("app.cache.time.monotonic", return_value=105.0):
+        assert cache.get("a") == 1
+    with patch("app.cache.time.monotonic", return_value=111.0):
+        assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_zero_size_disables_cache():
+    cache = LRUCache(0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+def test_stats():
+    cache = LRUCache(4)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats() == {"size": 1, "maxsize": 4, "hits": 1, "misses": 1, "hit_rate": 0.5}
@@ -0,0 +1,95 @@
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from app.chat_cache import CachedChatReply, ChatReplyCache, chat_cache_key
+from app.images import load_images
+from app.models import CachedReply
+from app.schemas import ChatRequest, ImageContent
+
+
+def test_key_normalizes_whitespace_case_and_width():
+    a = chat_cache_key(ChatRequest(their_message="  Hello   世界 "), "幽默型")
+    b = chat_cache_key(ChatRequest(their_message="ｈｅｌｌｏ 世界"), "幽默型")
+    assert a == b
+
+
+def test_key_depends_on_style_context_and_images():
+    base = ChatRequest(their_message="在吗")
+    keys = {
+        chat_cache_key(base, "幽默型"),
+        chat_cache_key(base, "温柔型"),
+        chat_cache_key(ChatRequest(their_message="在吗", context="刚认识"), "幽默型"),
+        chat_cache_key(ChatRequest(their_message="在吗", images=[ImageContent(data="aaa")]), "幽默型"),
+        chat_cache_key(ChatRequest(their_message="在吗", images=[ImageContent(data="bbb")]), "幽默型"),
+    }
+    assert len(keys) == 5
+
+
+def test_key_reuses_loaded_image_digests():
+    request = ChatRequest(their_message="在吗", images=[ImageContent(data="aaa")])
+    loaded = load_images(request.images)
+    with patch("app.images.read_image", side_effect=AssertionError("read twice")):
+        assert chat_cache_key(request, "幽默型", loaded) == chat_cache_key(request, "幽默型", loaded)
+    assert chat_cache_key(request, "幽默型", loaded) == chat_cache_key(request, "幽默型")
+
+
+async def test_get_put_and_stats():
+    cache = ChatReplyCache(maxsize=10, ttl=None)
+    assert await cache.get("k") is None
+    await cache.put("k", CachedChatReply("reply", input_tokens=50, output_tokens=20))
+    assert (await cache.get("k")).text == "reply"
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["input_tokens_saved"] == 50
+    assert stats["output_tokens_saved"] == 20
+
+
+async def test_lru_eviction():
+    cache = ChatReplyCache(maxsize=2, ttl=None)
+    for key in ("a", "b", "c"):
+        await cache.put(key, CachedChatReply(key))
+    assert await cache.get("a") is None
+    assert await cache.get("c") is not None
+
+
+async def test_ttl_expiry():
+    cache = ChatReplyCache(maxsize=10, ttl=0.01)
+    await cache.put("k", CachedChatReply("reply"))
+    time.sleep(0.02)
+    assert await cache.get("k") is None
+
+
+async def test_clear_resets_entries_and_counters():
+    cache = ChatReplyCache(maxsize=10, ttl=None)
+    await cache.put("k", CachedChatReply("reply"))
+    await cache.get("k")
+    cache.clear()
+    assert cache.stats()["size"] == 0
+    assert cache.stats()["hits"] == 0
+
+
+async def test_persisted_reply_survives_memory_clear(db):
+    from tests.conftest import TestingAsyncSessionLocal
+
+    cache = ChatReplyCache(maxsize=10, ttl=3600, persist=True)
+    with patch("app.chat_cache.AsyncSessionLocal", TestingAsyncSessionLocal):
+        await cache.put("k", CachedChatReply("reply", 10, 5))
+        assert db.get(CachedReply, "k").reply == "reply"
+        cache.clear()
+        reply = await cache.get("k")
+    assert reply == CachedChatReply("reply", 10, 5)
+
+
+async def test_persisted_reply_expires(db):
+    from tests.conftest import TestingAsyncSessionLocal
+
+    db.add(CachedReply(key="old", reply="stale", created_at=datetime.utcnow() - timedelta(hours=2)))
+    db.commit()
+    cache = ChatReplyCache(maxsize=10, ttl=3600, persist=True)
+    with patch("app.chat_cache.AsyncSessionLocal", TestingAsyncSessionLocal):
+        assert await cache.get("old") is None
+        await cache.put("new", CachedChatReply("fresh"))
+    db.expire_all()
+    assert db.get(CachedReply, "old") is None
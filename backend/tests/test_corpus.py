@@ -0,0 +1,112 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.corpus import RandomIndex, database_key, random_index
+from app.database import Base
+from app.models import Phrase
+
+
+def test_database_key_file(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/a.db")
+    assert database_key(engine) == str(tmp_path / "a.db")
+
+
+def test_database_key_memory_engines_differ():
+    assert database_key(create_engine("sqlite://")) != database_key(create_engine("sqlite://"))
+
+
+def test_sample_before_load_is_empty(db, sample_phrases):
+    index = RandomIndex()
+    assert not index.loaded(db.get_bind())
+    assert index.sample(db.get_bind(), "土味情话") == []
+
+
+def test_sample_by_category(db, sample_phrases):
+    index = RandomIndex()
+    index.load(db)
+    ids = index.sample(db.get_bind(), "土味情话", n=5)
+    assert sorted(ids) == sorted(p.id for p in sample_phrases if p.category == "土味情话")
+
+
+def test_sample_all_categories(db, sample_phrases):
+    index = RandomIndex()
+    index.load(db)
+    assert len(index.sample(db.get_bind(), None, n=10)) == len(sample_phrases)
+
+
+def test_sample_unknown_category_empty(db, sample_phrases):
+    index = RandomIndex()
+    index.load(db)
+    assert index.sample(db.get_bind(), "不存在分类") == []
+
+
+def test_committed_insert_is_indexed(db, sample_phrases):
+    random_index.load(db)
+    p = Phrase(content="新加入的话术", category="新分类")
+    db.add(p)
+    db.commit()
+    assert random_index.sample(db.get_bind(), "新分类") == [p.id]
+
+
+def test_rolled_back_insert_is_not_indexed(db, sample_phrases):
+    random_index.load(db)
+    db.add(Phrase(content="回滚的话术", category="新分类"))
+    db.flush()
+    db.rollback()
+    assert random_index.sample(db.get_bind(), "新分类") == []
+
+
+def test_delete_resets_index(db, sample_phrases):
+    random_index.load(db)
+    target = next(p for p in sample_phrases if p.category == "早安晚安")
+    db.delete(target)
+    db.commit()
+    assert not random_index.loaded(db.get_bind())
+
+
+def test_index_is_per_database(db, sample_phrases, tmp_path):
+    other = create_engine(f"sqlite:///{tmp_path}/other.db")
+    Base.metadata.create_all(other)
+    other_db = sessionmaker(bind=other)()
+    try:
+        random_index.load(db)
+        other_db.add(Phrase(content="另一个库的话术", category="开场白"))
+        other_db.commit()
+        ids = random_index.sample(db.get_bind(), "开场白", n=10)
+        assert sorted(ids) == sorted(p.id for p in sample_phrases if p.category == "开场白")
+    finally:
+        other_db.close()
+        other.dispose()
+
+
+def test_ensure_category_stats_consistent(db, sample_phrases):
+    from app.corpus import ensure_category_stats
+    assert ensure_category_stats(db.connection()) is False
+
+
+def test_ensure_category_stats_rebuilds_on_drift(db, sample_phrases):
+    from sqlalchemy import text
+    from app.corpus import ensure_category_stats
+    from app.models import CategoryStat
+    db.execute(text("INSERT INTO phrases (content, category) VALUES ('绕过ORM写入', '开场白')"))
+    db.execute(text("UPDATE category_stats SET count = 99 WHERE category = '土味情话'"))
+
+    assert ensure_category_stats(db.connection()) is True
+    db.commit()
+    counts = {s.category: s.count for s in db.query(CategoryStat).all()}
+    assert counts == {"开场白": 3, "土味情话": 2, "早安晚安": 1}
+
+
+def test_commit_bumps_version(db):
+    from app.corpus import corpus_version
+    before = corpus_version()
+    db.add(Phrase(content="版本号", category="开场白"))
+    db.commit()
+    assert corpus_version() > before
+
+
+def test_commit_without_phrases_keeps_version(db):
+    from app.corpus import corpus_version
+    before = corpus_version()
+    db.commit()
+    assert corpus_version() == before
@@ -0,0 +1,100 @@
+from app.database import async_url, sync_url
+
+
+def test_sync_url_keeps_sync_driver():
+    assert sync_url("sqlite:///./data/rizz.db").render_as_string() == "sqlite:///./data/rizz.db"
+
+
+def test_sync_url_strips_async_driver():
+    assert sync_url("sqlite+aiosqlite:///./data/rizz.db").render_as_string() == "sqlite:///./data/rizz.db"
+
+
+def test_async_url_adds_async_driver():
+    assert async_url("sqlite:///./data/rizz.db").render_as_string() == "sqlite+aiosqlite:///./data/rizz.db"
+
+
+def test_async_url_keeps_async_driver():
+    assert async_url("sqlite+aiosqlite:///x.db").render_as_string() == "sqlite+aiosqlite:///x.db"
+
+
+def test_async_url_postgres():
+    assert async_url("postgresql://u@h/db").drivername == "postgresql+asyncpg"
+
+
+async def _first_session():
+    from app.database import get_async_db
+
+    gen = get_async_db()
+    session = await gen.__anext__()
+    await gen.aclose()
+    return session
+
+
+def test_get_async_db_yields_async_session_for_async_driver(monkeypatch):
+    import asyncio
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    monkeypatch.setattr("app.database.ASYNC_HANDLERS", True)
+    assert isinstance(asyncio.run(_first_session()), AsyncSession)
+
+
+def test_get_async_db_yields_threaded_session_for_sync_driver(monkeypatch):
+    import asyncio
+    from app.database import ThreadedSession
+
+    monkeypatch.setattr("app.database.ASYNC_HANDLERS", False)
+    assert isinstance(asyncio.run(_first_session()), ThreadedSession)
+
+
+async def test_threaded_session_runs_queries_off_the_event_loop(db, sample_phrases):
+    import threading
+    from sqlalchemy import event, select
+    from app.database import ThreadedSession
+    from app.models import Phrase
+    from tests.conftest import TestingSessionLocal
+
+    threads = []
+    session = ThreadedSession(TestingSessionLocal())
+    listener = lambda *args: threads.append(threading.current_thread())
+    event.listen(session.get_bind(), "before_cursor_execute", listener)
+    try:
+        rows = (await session.execute(select(Phrase.content).where(Phrase.category == "开场白"))).all()
+        assert sorted(row.content for row in rows) == ["你好呀，初次见面", "你笑起来真好看"]
+        count = await session.run_sync(lambda db, category: db.query(Phrase).filter_by(category=category).count(),
+                                       "土味情话")
+        assert count == 2
+    finally:
+        event.remove(session.get_bind(), "before_cursor_execute", listener)
+        await session.close()
+    assert threads and threading.main_thread() not in threads
+
+
+def test_pool_options_in_memory_sqlite_uses_default_pool():
+    from sqlalchemy.pool import QueuePool
+    from app.database import pool_options
+
+    assert pool_options("sqlite://", QueuePool) == {}
+    assert pool_options("sqlite:///:memory:", QueuePool) == {}
+
+
+def test_pool_options_file_database_uses_queue_pool():
+    from sqlalchemy.pool import QueuePool
+    from app.config import DB_POOL_SIZE
+    from app.database import pool_options
+
+    options = pool_options("sqlite:///./data/rizz.db", QueuePool)
+    assert options["poolclass"] is QueuePool
+    assert options["pool_size"] == DB_POOL_SIZE
+
+
+def test_apply_sqlite_pragmas(tmp_path):
+    from sqlalchemy import create_engine, text
+    from app.database import apply_sqlite_pragmas
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'pragmas.db'}")
+    apply_sqlite_pragmas(engine, {"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": 1234})
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 1234
+    engine.dispose()
@@ -0,0 +1,120 @@
+import base64
+import io
+import struct
+import zlib
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+from app.images import ImageSavings, ImageTooLarge, estimate_image_tokens, load_images, prepare_images
+from app.schemas import ImageContent
+
+
+def _png(width: int, height: int, color=(200, 30, 30, 255), exif: bool = False) -> ImageContent:
+    image = Image.new("RGBA", (width, height), color)
+    out = io.BytesIO()
+    kwargs = {}
+    if exif:
+        metadata = Image.Exif()
+        metadata[0x010F] = "PhoneMaker"  # Make
+        kwargs["exif"] = metadata
+    image.save(out, format="PNG", **kwargs)
+    return ImageContent(data=base64.b64encode(out.getvalue()).decode(), media_type="image/png")
+
+
+def _png_bomb(width: int = 100_000, height: int = 100_000) -> bytes:
+    """A few dozen bytes of PNG header declaring a ``width`` x ``height`` image."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IEND", b"")
+
+
+def _decode(image: ImageContent) -> Image.Image:
+    return Image.open(io.BytesIO(base64.b64decode(image.data)))
+
+
+def test_estimate_image_tokens_follows_api_resizing():
+    assert estimate_image_tokens(750, 1) == 1
+    assert estimate_image_tokens(1000, 1000) == 1334
+    # Larger images are scaled down by the API first, and capped
+    assert estimate_image_tokens(1170, 2532) == estimate_image_tokens(725, 1568)
+    assert estimate_image_tokens(4000, 4000) == 1600
+
+
+def test_prepare_images_downscales_and_reencodes():
+    prepared = prepare_images([_png(1170, 2532)], max_edge=1024, fmt="JPEG", quality=80)
+    [image] = prepared.images
+    assert image.media_type == "image/jpeg"
+    decoded = _decode(image)
+    assert decoded.format == "JPEG"
+    assert decoded.size == (473, 1024)
+    assert prepared.bytes_after < prepared.bytes_before
+    assert prepared.tokens_before == estimate_image_tokens(1170, 2532)
+    assert prepared.tokens_after == estimate_image_tokens(473, 1024)
+    assert prepared.tokens_saved > 0
+
+
+def test_prepare_images_keeps_small_images_and_writes_webp():
+    prepared = prepare_images([_png(300, 200)], max_edge=1024, fmt="WEBP", quality=80)
+    [image] = prepared.images
+    assert image.media_type == "image/webp"
+    assert _decode(image).size == (300, 200)
+    assert prepared.tokens_saved == 0
+
+
+def test_prepare_images_strips_metadata():
+    source = _png(64, 64, exif=True)
+    assert _decode(source).getexif()
+    [image] = prepare_images([source], max_edge=1024, fmt="JPEG", quality=80).images
+    decoded = _decode(image)
+    assert not decoded.getexif()
+    assert "exif" not in decoded.info
+
+
+def test_prepare_images_dedupes_identical_images():
+    first, other = _png(800, 800), _png(800, 800, color=(0, 0, 255, 255))
+    prepared = prepare_images([first, other, first], max_edge=400, fmt="JPEG", quality=80)
+    assert len(prepared.images) == 2
+    assert prepared.duplicates == 1
+    # The dropped copy counts as fully saved
+    assert prepared.tokens_before == 3 * estimate_image_tokens(800, 800)
+    assert prepared.tokens_after == 2 * estimate_image_tokens(400, 400)
+
+
+def test_prepare_images_reuses_loaded_images():
+    first, other = _png(800, 800), _png(800, 800, color=(0, 0, 255, 255))
+    loaded = load_images([first, other, first])
+    assert loaded[0].digest == loaded[2].digest != loaded[1].digest
+    with patch("app.images.read_image", side_effect=AssertionError("read twice")):
+        prepared = prepare_images(loaded, max_edge=400, fmt="JPEG", quality=80)
+    assert len(prepared.images) == 2
+    assert prepared.duplicates == 1
+
+
+def test_prepare_images_passes_undecodable_data_through():
+    broken = ImageContent(data="not-an-image", media_type="image/jpeg")
+    prepared = prepare_images([broken])
+    assert prepared.images == [broken]
+    assert prepared.bytes_saved == 0
+
+
+def test_prepare_images_rejects_decompression_bombs():
+    bomb = ImageContent(data=base64.b64encode(_png_bomb()).decode(), media_type="image/png")
+    with pytest.raises(ImageTooLarge):
+        prepare_images([_png(10, 10), bomb])
+
+
+def test_image_savings_totals():
+    savings = ImageSavings()
+    savings.record(prepare_images([_png(2000, 2000), _png(2000, 2000)], max_edge=500, fmt="JPEG", quality=80))
+    stats = savings.stats()
+    assert stats["requests"] == 1
+    assert stats["images"] == 2
+    assert stats["duplicates"] == 1
+    assert stats["bytes_saved"] > 0
+    assert stats["tokens_saved"] == 2 * 1600 - estimate_image_tokens(500, 500)
+    savings.clear()
+    assert savings.stats()["images"] == 0
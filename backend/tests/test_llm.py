@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import re
+import time
+
+import anthropic
+import pytest
+
+from app.config import LLM_MAX_CONNECTIONS
+from app.llm import create_llm_client, open_first_token
+
+
+async def test_create_llm_client_uses_tuned_pool():
+    client = create_llm_client(api_key="test-key")
+    try:
+        assert isinstance(client, anthropic.AsyncAnthropic)
+        assert client.api_key == "test-key"
+        assert client._client._transport._pool._max_connections == LLM_MAX_CONNECTIONS
+    finally:
+        await client.close()
+    assert client._client.is_closed
+
+
+def test_lifespan_shares_one_client_and_closes_it():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app):
+        shared = app.state.llm_client
+        assert isinstance(shared, anthropic.AsyncAnthropic)
+        assert not shared._client.is_closed
+    assert shared._client.is_closed
+
+
+def test_token_usage_totals_and_cache_ratio():
+    from types import SimpleNamespace
+    from app.llm import TokenUsage
+
+    usage = TokenUsage()
+    usage.record(SimpleNamespace(input_tokens=100, output_tokens=50,
+                                 cache_creation_input_tokens=800, cache_read_input_tokens=None))
+    usage.record(SimpleNamespace(input_tokens=100, output_tokens=60,
+                                 cache_creation_input_tokens=0, cache_read_input_tokens=800))
+    stats = usage.stats()
+    assert stats["requests"] == 2
+    assert stats["input_tokens"] == 200
+    assert stats["output_tokens"] == 110
+    assert stats["cache_creation_input_tokens"] == 800
+    assert stats["cache_read_input_tokens"] == 800
+    assert stats["cache_read_ratio"] == round(800 / 1800, 4)
+
+
+def test_token_usage_estimates_tokens_saved_by_cancelling():
+    from types import SimpleNamespace
+    from app.llm import TokenUsage
+
+    usage = TokenUsage()
+    # No completed reply to go by yet: measured against max_tokens
+    usage.record_cancelled(24, max_tokens=1024)
+    assert usage.stats()["output_tokens_saved"] == 1000
+
+    usage.record(SimpleNamespace(input_tokens=100, output_tokens=150))
+    usage.record_cancelled(50, max_tokens=1024)
+    usage.record_cancelled(400, max_tokens=1024)
+    stats = usage.stats()
+    assert stats["cancelled"] == 3
+    assert stats["output_tokens_saved"] == 1000 + 100
+
+
+def test_token_usage_empty():
+    from app.llm import TokenUsage
+    assert TokenUsage().stats()["cache_read_ratio"] == 0.0
+
+
+def _stream_client(delays: dict, fail: tuple = ()):
+    """A client whose stream(model=...) yields "<model>" after delays[model] seconds."""
+    from types import SimpleNamespace
+    from unittest.mock import AsyncMock, MagicMock
+
+    managers = {}
+
+    def stream(model, **kwargs):
+        if model in fail:
+            raise anthropic.APIConnectionError(request=MagicMock())
+
+        async def texts():
+            await asyncio.sleep(delays[model])
+            yield model
+            yield "!"
+
+        manager = MagicMock()
+        manager.text_stream = texts()
+        manager.__aenter__ = AsyncMock(return_value=manager)
+        manager.__aexit__ = AsyncMock(return_value=False)
+        managers[model] = manager
+        return manager
+
+    return SimpleNamespace(messages=SimpleNamespace(stream=stream)), managers
+
+
+async def _collect(attempt):
+    try:
+        return [text async for text in attempt.texts()]
+    finally:
+        await attempt.close()
+
+
+async def test_open_first_token_fast_primary_is_not_hedged():
+    client, managers = _stream_client({"a": 0, "b": 0})
+    attempt = await open_first_token(client, ["a", "b"], deadline=0.5)
+    assert attempt.model == "a"
+    assert await _collect(attempt) == ["a", "!"]
+    assert list(managers) == ["a"]
+    managers["a"].__aexit__.assert_awaited_once()
+
+
+async def test_open_first_token_hedges_slow_primary(caplog):
+    caplog.set_level(logging.INFO, logger="app.llm")
+    client, managers = _stream_client({"a": 1, "b": 0})
+    start = time.monotonic()
+    attempt = await open_first_token(client, ["a", "b"], deadline=0.05)
+    assert time.monotonic() - start < 0.5
+    assert attempt.model == "b"
+    assert attempt.ttft < 0.5
+    assert await _collect(attempt) == ["b", "!"]
+    # The slow primary is dropped and its connection closed
+    managers["a"].__aexit__.assert_awaited_once()
+    assert "hedging with b" in caplog.text
+    assert "b won with TTFT" in caplog.text
+    # The loser's time is logged too
+    assert re.search(r"a cancelled after \d+\.\d{3}s", caplog.text)
+
+
+async def test_open_first_token_hedges_only_with_a_reserved_slot(caplog):
+    caplog.set_level(logging.INFO, logger="app.llm")
+    released = []
+
+    def reserve():
+        return lambda: released.append(True)
+
+    client, managers = _stream_client({"a": 1, "b": 0})
+    attempt = await open_first_token(client, ["a", "b"], deadline=0.05, reserve=reserve)
+    assert attempt.model == "b"
+    await attempt.close()
+    # The extra slot goes back once the race is decided
+    assert released == [True]
+    assert "hedging with b" in caplog.text
+
+    # No capacity for a second stream: the primary is dropped instead
+    caplog.clear()
+    client, managers = _stream_client({"a": 0.1, "b": 1})
+    attempt = await open_first_token(client, ["a", "b"], deadline=0.05, reserve=lambda: None)
+    assert attempt.model == "b"
+    managers["a"].__aexit__.assert_awaited_once()
+    assert "switching with b" in caplog.text
+    await attempt.close()
+
+
+async def test_open_first_token_hedged_primary_can_still_win():
+    client, managers = _stream_client({"a": 0.1, "b": 1})
+    attempt = await open_first_token(client, ["a", "b"], deadline=0.05)
+    assert attempt.model == "a"
+    await attempt.close()
+    managers["b"].__aexit__.assert_awaited_once()
+
+
+async def test_open_first_token_cancel_strategy_drops_primary_at_deadline(caplog):
+    caplog.set_level(logging.INFO, logger="app.llm")
+    client, managers = _stream_client({"a": 0.2, "b": 0.3})
+    attempt = await open_first_token(client, ["a", "b"], deadline=0.05, strategy="cancel")
+    # "a" would have answered first, but was cancelled when the deadline passed
+    assert attempt.model == "b"
+    await attempt.close()
+    managers["a"].__aexit__.assert_awaited_once()
+    assert re.search(r"a cancelled after \d+\.\d{3}s", caplog.text)
+
+
+async def test_open_first_token_falls_back_on_error_and_raises_when_all_fail(caplog):
+    caplog.set_level(logging.INFO, logger="app.llm")
+    client, _ = _stream_client({"b": 0}, fail=("a",))
+    attempt = await open_first_token(client, ["a", "b"], deadline=None)
+    assert attempt.model == "b"
+    assert re.search(r"a failed after \d+\.\d{3}s", caplog.text)
+    await attempt.close()
+
+    client, _ = _stream_client({}, fail=("a", "b"))
+    with pytest.raises(anthropic.APIConnectionError):
+        await open_first_token(client, ["a", "b"], deadline=None)
@@ -54,3 +54,9 @@ def test_cors_headers_present(client):
     )
     # CORS middleware should handle OPTIONS or at least not error
     assert resp.status_code in (200, 204, 405)
+
+
+def test_stats_reports_phrase_cache(client):
+    client.get("/api/phrases/categories")
+    data = client.get("/api/stats").json()
+    assert {"hits", "misses", "size"} <= set(data["phrase_cache"])
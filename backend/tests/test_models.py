@@ -65,3 +65,44 @@ def test_phrase_id_autoincrement(db):
     db.refresh(p2)
     assert p1.id != p2.id
     assert p2.id > p1.id
+
+
+def _category_counts(db):
+    from app.models import CategoryStat
+    return {s.category: s.count for s in db.query(CategoryStat).all()}
+
+
+def test_category_stats_incremented_on_insert(db):
+    from app.models import Phrase
+    db.add_all([Phrase(content="a", category="开场白"), Phrase(content="b", category="开场白"),
+                Phrase(content="c", category="晚安问候")])
+    db.commit()
+    assert _category_counts(db) == {"开场白": 2, "晚安问候": 1}
+
+
+def test_category_stats_not_changed_on_rollback(db):
+    from app.models import Phrase
+    db.add(Phrase(content="a", category="开场白"))
+    db.flush()
+    db.rollback()
+    assert _category_counts(db) == {}
+
+
+def test_category_stats_decremented_on_delete(db):
+    from app.models import Phrase
+    p = Phrase(content="a", category="开场白")
+    db.add(p)
+    db.commit()
+    db.delete(p)
+    db.commit()
+    assert _category_counts(db) == {"开场白": 0}
+
+
+def test_category_stats_moved_on_category_change(db):
+    from app.models import Phrase
+    p = Phrase(content="a", category="开场白")
+    db.add(p)
+    db.commit()
+    p.category = "土味情话"
+    db.commit()
+    assert _category_counts(db) == {"开场白": 0, "土味情话": 1}
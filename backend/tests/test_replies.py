@@ -0,0 +1,52 @@
+from app.replies import ReplyParser
+
+REPLY = "1️⃣ 第一条\n\n2️⃣ 第二条\n\n3️⃣ 第三条"
+
+
+def _run(chunks):
+    parser = ReplyParser()
+    events = []
+    for chunk in chunks:
+        events += parser.feed(chunk)
+    return events + parser.close()
+
+
+def _ends(events):
+    return [(e["index"], e["text"]) for e in events if e["event"] == "reply_end"]
+
+
+def test_parses_whole_reply():
+    events = _run([REPLY])
+    assert _ends(events) == [(1, "第一条"), (2, "第二条"), (3, "第三条")]
+    assert [e["event"] for e in events[:3]] == ["reply_start", "reply_delta", "reply_end"]
+
+
+def test_markers_split_across_deltas():
+    # One code point per delta splits every marker
+    events = _run(list(REPLY))
+    assert _ends(events) == [(1, "第一条"), (2, "第二条"), (3, "第三条")]
+    deltas = "".join(e["text"] for e in events if e["event"] == "reply_delta" and e["index"] == 2)
+    assert deltas.strip() == "第二条"
+
+
+def test_reply_ends_as_soon_as_the_next_marker_arrives():
+    parser = ReplyParser()
+    parser.feed("1️⃣ 你好")
+    events = parser.feed("\n2")
+    assert not any(e["event"] == "reply_end" for e in events)
+    events = parser.feed("️⃣ 再见")
+    assert events[:2] == [
+        {"event": "reply_end", "index": 1, "text": "你好"},
+        {"event": "reply_start", "index": 2},
+    ]
+
+
+def test_marker_without_variation_selector_and_digits_in_text():
+    events = _run(["1⃣ 约在2点", "吧\n2⃣ 12月见"])
+    assert _ends(events) == [(1, "约在2点吧"), (2, "12月见")]
+
+
+def test_preamble_becomes_reply_zero_and_blank_preamble_is_dropped():
+    assert _ends(_run(["好的：\n", REPLY]))[0] == (0, "好的：")
+    assert _ends(_run(["\n\n", REPLY]))[0] == (1, "第一条")
+    assert _run([""]) == []
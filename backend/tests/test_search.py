@@ -0,0 +1,80 @@
+from sqlalchemy import text
+
+from app.search import build_any_match_query, build_match_query, ensure_search_index, ngram_tokens, FTS_TABLE
+
+
+def test_ngram_tokens_bigrams_with_trailing_char():
+    assert ngram_tokens("你好呀") == "你好 好呀 呀"
+
+
+def test_ngram_tokens_splits_on_punctuation():
+    assert ngram_tokens("你好，初次") == "你好 好 初次 次"
+
+
+def test_ngram_tokens_single_char_run():
+    assert ngram_tokens("爱") == "爱"
+
+
+def test_ngram_tokens_lowercases_latin():
+    assert ngram_tokens("WiFi") == "wi if fi i"
+
+
+def test_ngram_tokens_empty():
+    assert ngram_tokens(None) == ""
+    assert ngram_tokens("！？") == ""
+
+
+def test_build_match_query_phrase():
+    assert build_match_query("你笑起来") == '"你笑 笑起 起来"'
+
+
+def test_build_match_query_single_char_prefix():
+    assert build_match_query("爱") == '"爱" *'
+
+
+def test_build_match_query_multiple_runs():
+    assert build_match_query("你好 宇宙") == '"你好" AND "宇宙"'
+
+
+def test_build_match_query_nothing_indexable():
+    assert build_match_query("，。！") is None
+
+
+def test_build_any_match_query_ors_distinct_bigrams():
+    assert build_any_match_query("在吗在吗？嗯") == '"在吗" OR "吗在" OR "嗯"'
+    assert build_any_match_query("？！") is None
+
+
+def test_build_any_match_query_caps_terms():
+    assert build_any_match_query("一二三四五六", max_terms=2) == '"一二" OR "二三"'
+
+
+def test_insert_keeps_index_in_sync(db):
+    from app.models import Phrase
+    db.add(Phrase(content="你是我的宇宙", category="土味情话", tags="浪漫"))
+    db.commit()
+    rows = db.execute(text(f"SELECT content, tags FROM {FTS_TABLE}")).all()
+    assert rows == [("你是 是我 我的 的宇 宇宙 宙", "浪漫 漫")]
+
+
+def test_delete_removes_from_index(db):
+    from app.models import Phrase
+    p = Phrase(content="你是我的宇宙", category="土味情话")
+    db.add(p)
+    db.commit()
+    db.delete(p)
+    db.commit()
+    assert db.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar() == 0
+
+
+def test_ensure_search_index_rebuilds_on_drift(db):
+    from app.models import Phrase
+    db.add(Phrase(content="晚安，梦里都是你", category="早安晚安"))
+    db.commit()
+    db.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    db.commit()
+
+    conn = db.connection()
+    assert ensure_search_index(conn) is True
+    assert ensure_search_index(conn) is False
+    assert db.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar() == 1
@@ -0,0 +1,223 @@
+import asyncio
+import time
+
+from app.streaming import ReplayBuffer, ReplayStore, coalesce
+
+
+async def _texts(*items):
+    """Yield strings immediately; a float sleeps that many seconds instead."""
+    for item in items:
+        if isinstance(item, float):
+            await asyncio.sleep(item)
+        else:
+            yield item
+
+
+async def _collect(stream):
+    return [text async for text in stream]
+
+
+async def test_coalesce_disabled_passes_deltas_through():
+    assert await _collect(coalesce(_texts("a", "b", "c"), 64, 0)) == ["a", "b", "c"]
+
+
+async def test_coalesce_sends_first_delta_then_merges_a_burst():
+    assert await _collect(coalesce(_texts("a", "b", "c", "d"), 64, 0.03)) == ["a", "bcd"]
+
+
+async def test_coalesce_flushes_at_size_threshold():
+    out = await _collect(coalesce(_texts("a", "bb", "cc", "dd", "e"), 4, 1.0))
+    assert out == ["a", "bbcc", "dde"]
+    assert "".join(out) == "abbccdde"
+
+
+async def test_coalesce_flushes_on_timer_while_upstream_stalls():
+    stamps = []
+    start = time.monotonic()
+    async for text in coalesce(_texts("a", "b", 0.3, "c"), 64, 0.03):
+        stamps.append((text, time.monotonic() - start))
+    assert [text for text, _ in stamps] == ["a", "b", "c"]
+    # "b" goes out once the interval passes, not when "c" finally arrives
+    assert stamps[1][1] < 0.2
+    assert stamps[2][1] >= 0.3
+
+
+async def test_coalesce_close_cancels_pending_read():
+    cancelled = asyncio.Event()
+
+    async def slow():
+        yield "a"
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        yield "never"
+
+    stream = coalesce(slow(), 64, 0.03)
+    assert await stream.__anext__() == "a"
+    reader = asyncio.ensure_future(stream.__anext__())
+    await asyncio.sleep(0.01)
+    reader.cancel()
+    await asyncio.gather(reader, return_exceptions=True)
+    await stream.aclose()
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+async def _frames(*items):
+    async for item in _texts(*items):
+        yield item
+
+
+async def test_replay_buffer_followers_see_live_frames_from_any_point():
+    store = ReplayStore(ttl=60, max_bytes=1 << 20)
+    buffer = store.start(_frames("a", 0.05, "b", 0.05, "c"))
+    late = []
+
+    async def join_late():
+        await asyncio.sleep(0.07)
+        async for seq, frame in buffer.follow(1):
+            late.append((seq, frame))
+
+    joiner = asyncio.create_task(join_late())
+    early = [item async for item in buffer.follow()]
+    await joiner
+    assert early == [(0, "a"), (1, "b"), (2, "c")]
+    assert late == [(1, "b"), (2, "c")]
+    assert buffer.finished and buffer.task.done()
+
+
+async def test_replay_buffer_keeps_every_frame_of_a_running_stream():
+    buffer = ReplayBuffer("s")
+    for frame in "abcd":
+        buffer.append(frame)
+    assert buffer.has(0) and buffer.has(4) and not buffer.has(5)
+    reader = buffer.follow(0)
+    assert [await reader.__anext__() for _ in range(4)] == [(0, "a"), (1, "b"), (2, "c"), (3, "d")]
+    buffer.append("e")
+    buffer.finish()
+    assert [item async for item in reader] == [(4, "e")]
+    assert buffer.size == 5
+
+
+async def test_replay_store_runs_cleanup_and_survives_producer_errors(caplog):
+    calls = []
+
+    async def broken():
+        yield "a"
+        raise RuntimeError("upstream exploded")
+
+    async def close():
+        calls.append("async")
+
+    store = ReplayStore(ttl=60, max_bytes=1 << 20)
+    buffer = store.start(broken(), cleanup=[lambda: calls.append("sync"), close])
+    frames = [frame async for _, frame in buffer.follow()]
+    assert frames[0] == "a"
+    # The failure reaches followers as an error frame
+    assert '"error"' in frames[1] and len(frames) == 2
+    await buffer.task
+    assert calls == ["sync", "async"]
+    assert "upstream exploded" in caplog.text
+
+
+async def test_replay_store_finds_running_generations_by_key():
+    release = asyncio.Event()
+
+    async def frames():
+        yield "a"
+        await release.wait()
+
+    store = ReplayStore(ttl=60, max_bytes=1 << 20)
+    buffer = store.start(frames(), key="k")
+    assert store.running("k") is buffer
+    assert store.running("other") is None
+    release.set()
+    await buffer.task
+    # Finished generations are only reachable by id (for resumes)
+    assert store.running("k") is None
+    assert store.get(buffer.id) is buffer
+
+
+async def _endless(closed: list):
+    try:
+        while True:
+            await asyncio.sleep(0.01)
+            yield "x"
+    finally:
+        closed.append(True)
+
+
+async def _read(buffer, frames: int, seq: int = 0) -> list:
+    """Follow ``buffer`` for ``frames`` frames, then leave like a disconnecting client."""
+    follower = buffer.follow(seq)
+    read = [await follower.__anext__() for _ in range(frames)]
+    await follower.aclose()
+    return read
+
+
+async def test_replay_store_cancels_generation_when_last_follower_leaves():
+    closed, released = [], []
+    store = ReplayStore(ttl=60, max_bytes=1 << 20)
+    buffer = store.start(_endless(closed), cleanup=[lambda: released.append(True)], key="k")
+
+    first = buffer.follow()
+    await first.__anext__()
+    await _read(buffer, 2)
+    # Another follower is still there
+    assert not buffer.task.done()
+
+    await first.aclose()
+    await asyncio.gather(buffer.task, return_exceptions=True)
+    assert buffer.task.cancelled()
+    assert closed == [True] and released == [True]
+    assert store.running("k") is None
+    assert store.stats()["abandoned"] == 1
+    # A client resuming later is told the reply is incomplete
+    *_, (_, last) = [item async for item in buffer.follow()]
+    assert "生成已取消" in last
+
+
+async def test_replay_store_grace_period_leaves_time_to_resume():
+    closed = []
+    store = ReplayStore(ttl=60, max_bytes=1 << 20, grace=0.2)
+    buffer = store.start(_endless(closed))
+
+    [(seq, _)] = await _read(buffer, 1)
+    await asyncio.sleep(0.1)
+    # Back within the grace period: the generation carries on
+    await _read(buffer, 3, seq + 1)
+    await asyncio.sleep(0.1)
+    assert not buffer.task.done()
+
+    # Gone for longer than the grace period: cancelled
+    await asyncio.sleep(0.2)
+    assert buffer.task.done() and closed == [True]
+
+
+async def test_replay_store_expires_by_ttl_and_memory_cap():
+    clock = [1000.0]
+    store = ReplayStore(ttl=60, max_bytes=10, clock=lambda: clock[0])
+
+    old = store.start(_frames("x" * 4))
+    await old.task
+    clock[0] += 30
+    new = store.start(_frames("y" * 4))
+    await new.task
+    assert store.get(old.id) is old and store.stats()["bytes"] == 8
+
+    # Over the cap: finished buffers go, oldest first
+    running = store.start(_frames("z" * 4, 10.0))
+    await asyncio.sleep(0.01)
+    assert store.get(old.id) is None
+    assert store.get(new.id) is new
+    assert store.stats() == {
+        "streams": 2, "running": 1, "bytes": 8, "max_bytes": 10, "resumed": 0, "joined": 0, "abandoned": 0,
+    }
+
+    clock[0] += 61
+    assert store.get(new.id) is None
+    # Running generations never expire
+    assert store.get(running.id) is running
+    await store.close()
+    assert running.task.cancelled() or running.finished
@@ -0,0 +1,58 @@
+import pytest
+
+from app.models import Phrase
+from app.suggestions import suggest_phrases, suggestion_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_suggestion_cache():
+    suggestion_cache.clear()
+    yield
+    suggestion_cache.clear()
+
+
+@pytest.fixture
+def library(db):
+    phrases = [
+        Phrase(content="晚安，今晚的月亮很好看", category="早安晚安"),
+        Phrase(content="晚安呀，做个好梦", category="幽默回复"),
+        Phrase(content="在吗？我想你了", category="表白句子"),
+        Phrase(content="你是我的宇宙", category="土味情话"),
+        Phrase(content="陪你看一整晚的星星", category="高甜语录"),
+    ]
+    db.add_all(phrases)
+    db.commit()
+    return phrases
+
+
+async def test_ranks_phrases_sharing_words_with_the_message(async_db, library):
+    suggestions = await suggest_phrases(async_db, "在吗，想你了", "direct", 1)
+    assert suggestions == [{"id": library[2].id, "content": "在吗？我想你了", "category": "表白句子"}]
+
+
+async def test_style_categories_rank_higher(async_db, library):
+    gentle = await suggest_phrases(async_db, "晚安", "gentle", 2)
+    humorous = await suggest_phrases(async_db, "晚安", "humorous", 2)
+    assert gentle[0]["category"] == "早安晚安"
+    assert humorous[0]["category"] == "幽默回复"
+
+
+async def test_tops_up_with_style_phrases_when_few_match(async_db, library):
+    suggestions = await suggest_phrases(async_db, "在吗", "gentle", 3)
+    assert suggestions[0]["content"] == "在吗？我想你了"
+    assert {s["category"] for s in suggestions[1:]} <= {"高甜语录", "早安晚安", "深夜emo"}
+    assert len(suggestions) == 3
+    assert len({s["id"] for s in suggestions}) == 3
+
+    # Nothing indexable in the message: the style's phrases alone
+    assert {s["category"] for s in await suggest_phrases(async_db, "？", "humorous", 5)} == {"幽默回复", "土味情话"}
+
+
+async def test_results_are_cached_until_the_corpus_changes(async_db, db, library):
+    first = await suggest_phrases(async_db, "晚安", "gentle", 3)
+    assert await suggest_phrases(async_db, "晚安", "gentle", 3) is first
+
+    db.add(Phrase(content="晚安晚安，明天见", category="早安晚安"))
+    db.commit()
+    assert len(await suggest_phrases(async_db, "晚安", "gentle", 3)) == 3
+    assert await suggest_phrases(async_db, "晚安", "gentle", 3) is not first
@@ -1,5 +1,11 @@
 import { describe, it, expect, vi, beforeEach } from 'vitest'
-import { fetchPhrases, fetchRandomPhrase, fetchCategories, streamChat } from '../../api/client'
+import {
+  fetchPhrases,
+  fetchRandomPhrase,
+  fetchCategories,
+  fetchPhraseBatch,
+  streamChat,
+} from '../../api/client'
 
 describe('fetchPhrases', () => {
   it('calls correct URL with no params', async () => {
@@ -57,7 +63,39 @@ describe('fetchPhrases', () => {
     } as Response)
 
     const result = await fetchPhrases()
-    expect(result).toEqual(mockData)
+    expect(result.items).toEqual(mockData)
+  })
+
+  it('returns next cursor from response header', async () => {
+    vi.mocked(global.fetch).mockResolvedValueOnce({
+      ok: true,
+      headers: new Headers({ 'X-Next-Cursor': 'abc' }),
+      json: async () => [],
+    } as Response)
+
+    const result = await fetchPhrases()
+    expect(result.nextCursor).toBe('abc')
+  })
+
+  it('returns null cursor when header is absent', async () => {
+    vi.mocked(global.fetch).mockResolvedValueOnce({
+      ok: true,
+      headers: new Headers(),
+      json: async () => [],
+    } as Response)
+
+    const result = await fetchPhrases()
+    expect(result.nextCursor).toBeNull()
+  })
+
+  it('sends cursor instead of offset when given', async () => {
+    const mockFetch = vi.mocked(global.fetch)
+    mockFetch.mockResolvedValueOnce({ ok: true, json: async () => [] } as Response)
+
+    await fetchPhrases({ cursor: 'abc', offset: 20 })
+    const url = mockFetch.mock.calls[0][0] as string
+    expect(url).toContain('cursor=abc')
+    expect(url).not.toContain('offset=')
   })
 })
 
@@ -136,6 +174,75 @@ describe('fetchCategories', () => {
   })
 })
 
+describe('fetchPhraseBatch', () => {
+  it('posts the batch request as JSON', async () => {
+    const mockFetch = vi.mocked(global.fetch)
+    mockFetch.mockResolvedValueOnce({
+      ok: true,
+      json: async () => ({ ids: [], pages: [], random: [], categories: null }),
+    } as Response)
+
+    await fetchPhraseBatch({ ids: [1, 2] })
+    expect(mockFetch).toHaveBeenCalledWith('/api/phrases/batch', expect.objectContaining({ method: 'POST' }))
+    const body = JSON.parse(mockFetch.mock.calls[0][1]?.body as string)
+    expect(body).toEqual({ ids: [1, 2] })
+  })
+
+  it('throws on non-ok response', async () => {
+    vi.mocked(global.fetch).mockResolvedValueOnce({ ok: false, statusText: 'Bad Request' } as Response)
+
+    await expect(fetchPhraseBatch({})).rejects.toThrow('Failed to fetch phrase batch')
+  })
+})
+
+describe('lookup batching', () => {
+  it('coalesces lookups issued together into one batch request', async () => {
+    const phrase = { id: 1, content: '你好', category: '开场白', is_pickup_line: false }
+    const categories = [{ name: '开场白', count: 1 }]
+    const mockFetch = vi.mocked(global.fetch)
+    mockFetch.mockResolvedValueOnce({
+      ok: true,
+      json: async () => ({
+        ids: [],
+        pages: [{ items: [phrase], next_cursor: 'next' }],
+        random: [],
+        categories,
+      }),
+    } as Response)
+
+    const [page, cats] = await Promise.all([
+      fetchPhrases({ category: '开场白', limit: 20 }),
+      fetchCategories(),
+    ])
+
+    expect(mockFetch).toHaveBeenCalledTimes(1)
+    expect(mockFetch.mock.calls[0][0]).toBe('/api/phrases/batch')
+    const body = JSON.parse(mockFetch.mock.calls[0][1]?.body as string)
+    expect(body.pages).toEqual([{ category: '开场白', limit: 20 }])
+    expect(body.categories).toBe(true)
+    expect(page).toEqual({ items: [phrase], nextCursor: 'next' })
+    expect(cats).toEqual(categories)
+  })
+
+  it('rejects every batched lookup when the batch fails', async () => {
+    vi.mocked(global.fetch).mockResolvedValueOnce({ ok: false, statusText: 'Server Error' } as Response)
+
+    const results = await Promise.allSettled([fetchPhrases(), fetchCategories()])
+    expect(results.map((r) => r.status)).toEqual(['rejected', 'rejected'])
+    expect((results[1] as PromiseRejectedResult).reason.message).toContain('Failed to fetch categories')
+  })
+
+  it('rejects a batched random pick with no result', async () => {
+    vi.mocked(global.fetch).mockResolvedValueOnce({
+      ok: true,
+      json: async () => ({ ids: [], pages: [], random: [[]], categories: [] }),
+    } as Response)
+
+    const [random] = await Promise.allSettled([fetchRandomPhrase('不存在'), fetchCategories()])
+    expect(random.status).toBe('rejected')
+  })
+})
+
 describe('streamChat', () => {
   it('calls onError on non-ok response', async () => {
     vi.mocked(global.fetch).mockResolvedValueOnce({
@@ -167,7 +274,7 @@ describe('streamChat', () => {
     expect(onError).toHaveBeenCalledWith(expect.any(Error))
   })
 
-  it('sends POST request with correct headers', async () => {
+  it('sends a multipart POST to the upload endpoint', async () => {
     vi.mocked(global.fetch).mockResolvedValueOnce({
       ok: false,
       statusText: 'error',
@@ -175,26 +282,189 @@ describe('streamChat', () => {
 
     await streamChat({ their_message: 'hi', style: 'humorous' }, vi.fn(), vi.fn(), vi.fn())
 
-    expect(vi.mocked(global.fetch)).toHaveBeenCalledWith(
-      '/api/chat',
-      expect.objectContaining({
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: expect.stringContaining('humorous'),
-      })
-    )
+    const [url, init] = vi.mocked(global.fetch).mock.calls[0]
+    expect(url).toBe('/api/chat/upload')
+    expect(init?.method).toBe('POST')
+    // The browser must set the multipart boundary itself
+    expect(init?.headers).toBeUndefined()
+    const form = init?.body as FormData
+    expect(form).toBeInstanceOf(FormData)
+    expect(form.get('style')).toBe('humorous')
   })
 
-  it('sends request body with their_message', async () => {
+  it('sends their_message, context and images as form fields', async () => {
     vi.mocked(global.fetch).mockResolvedValueOnce({
       ok: false,
       statusText: 'error',
     } as Response)
 
-    await streamChat({ their_message: 'test message' }, vi.fn(), vi.fn(), vi.fn())
+    const image = new Blob(['png'], { type: 'image/png' })
+    await streamChat(
+      { their_message: 'test message', context: '刚认识', images: [image, image] },
+      vi.fn(),
+      vi.fn(),
+      vi.fn(),
+    )
+
+    const form = vi.mocked(global.fetch).mock.calls[0][1]?.body as FormData
+    expect(form.get('their_message')).toBe('test message')
+    expect(form.get('context')).toBe('刚认识')
+    expect(form.has('style')).toBe(false)
+    expect(form.getAll('images')).toHaveLength(2)
+  })
+
+  it('sends each requested style and passes style tags to onChunk', async () => {
+    const encoder = new TextEncoder()
+    const frames = [
+      'data: {"style": "gentle", "content": "温"}\n\n',
+      'data: {"style": "direct", "content": "直"}\n\n',
+      'data: {"style": "gentle", "done": true}\n\n',
+      'data: [DONE]\n\n',
+    ]
+    let i = 0
+    vi.mocked(global.fetch).mockResolvedValueOnce({
+      ok: true,
+      body: {
+        getReader: () => ({
+          read: async () =>
+            i < frames.length
+              ? { done: false, value: encoder.encode(frames[i++]) }
+              : { done: true, value: undefined },
+        }),
+      },
+    } as unknown as Response)
+
+    const onChunk = vi.fn()
+    await streamChat({ their_message: 'hi', styles: ['gentle', 'direct'] }, onChunk, vi.fn(), vi.fn())
+
+    const form = vi.mocked(global.fetch).mock.calls[0][1]?.body as FormData
+    expect(form.getAll('styles')).toEqual(['gentle', 'direct'])
+    expect(onChunk.mock.calls).toEqual([
+      ['温', 'gentle'],
+      ['直', 'direct'],
+    ])
+  })
+
+  it('requests reply events and passes them to onReply', async () => {
+    const encoder = new TextEncoder()
+    const frames = [
+      'id: s:0\nevent: reply_start\ndata: {"index": 1}\n\n',
+      'id: s:1\nevent: reply_delta\ndata: {"index": 1, "text": " 在呢"}\n\n',
+      'id: s:2\nevent: reply_end\ndata: {"index": 1, "text": "在呢"}\n\n',
+      'id: s:3\ndata: [DONE]\n\n',
+    ]
+    let i = 0
+    vi.mocked(global.fetch).mockResolvedValueOnce({
+      ok: true,
+      body: {
+        getReader: () => ({
+          read: async () =>
+            i < frames.length
+              ? { done: false, value: encoder.encode(frames[i++]) }
+              : { done: true, value: undefined },
+        }),
+      },
+    } as unknown as Response)
+
+    const onChunk = vi.fn()
+    const onReply = vi.fn()
+    await streamChat({ their_message: 'hi', events: 'replies' }, onChunk, vi.fn(), vi.fn(), onReply)
+
+    const form = vi.mocked(global.fetch).mock.calls[0][1]?.body as FormData
+    expect(form.get('events')).toBe('replies')
+    expect(onChunk).not.toHaveBeenCalled()
+    expect(onReply.mock.calls.map((call) => call[0])).toEqual([
+      { type: 'reply_start', index: 1 },
+      { type: 'reply_delta', index: 1, text: ' 在呢' },
+      { type: 'reply_end', index: 1, text: '在呢' },
+    ])
+  })
+
+  it('resumes a dropped stream with Last-Event-ID', async () => {
+    const encoder = new TextEncoder()
+    const dropping = [
+      'id: abc:0\ndata: {"content": "你"}\n\n',
+    ]
+    let i = 0
+    const resumed = ['id: abc:1\ndata: {"content": "好"}\n\n', 'id: abc:2\ndata: [DONE]\n\n']
+    let j = 0
+    vi.mocked(global.fetch)
+      .mockResolvedValueOnce({
+        ok: true,
+        body: {
+          getReader: () => ({
+            read: async () => {
+              if (i < dropping.length) return { done: false, value: encoder.encode(dropping[i++]) }
+              throw new TypeError('network error')
+            },
+          }),
+        },
+      } as unknown as Response)
+      .mockResolvedValueOnce({
+        ok: true,
+        body: {
+          getReader: () => ({
+            read: async () =>
+              j < resumed.length
+                ? { done: false, value: encoder.encode(resumed[j++]) }
+                : { done: true, value: undefined },
+          }),
+        },
+      } as unknown as Response)
+
+    const onChunk = vi.fn()
+    const onDone = vi.fn()
+    const onError = vi.fn()
+    await streamChat({ their_message: 'hi' }, onChunk, onDone, onError)
+
+    const [url, second] = vi.mocked(global.fetch).mock.calls[1]
+    // Resuming sends only the id, not the request and its images again
+    expect(url).toContain('/api/chat/resume')
+    expect(second?.method).toBeUndefined()
+    expect(second?.headers).toEqual({ 'Last-Event-ID': 'abc:0' })
+    expect(onChunk.mock.calls.map((call) => call[0])).toEqual(['你', '好'])
+    expect(onDone).toHaveBeenCalledTimes(1)
+    expect(onError).not.toHaveBeenCalled()
+  })
 
-    const callArgs = vi.mocked(global.fetch).mock.calls[0]
-    const body = JSON.parse(callArgs[1]?.body as string)
-    expect(body.their_message).toBe('test message')
+  it('starts over when a dropped stream can no longer be resumed', async () => {
+    const encoder = new TextEncoder()
+    const stream = (frames: string[], drop: boolean) => {
+      let i = 0
+      return {
+        ok: true,
+        status: 200,
+        body: {
+          getReader: () => ({
+            read: async () => {
+              if (i < frames.length) return { done: false, value: encoder.encode(frames[i++]) }
+              if (drop) throw new TypeError('network error')
+              return { done: true, value: undefined }
+            },
+          }),
+        },
+      } as unknown as Response
+    }
+    vi.mocked(global.fetch)
+      .mockResolvedValueOnce(stream(['id: abc:0\ndata: {"content": "你"}\n\n'], true))
+      .mockResolvedValueOnce({ ok: false, status: 410, statusText: 'Gone' } as Response)
+      .mockResolvedValueOnce(
+        stream(['id: def:0\ndata: {"content": "你好"}\n\n', 'id: def:1\ndata: [DONE]\n\n'], false),
+      )
+
+    const chunks: string[] = []
+    const onRestart = vi.fn(() => chunks.splice(0))
+    const onDone = vi.fn()
+    const onError = vi.fn()
+    await streamChat({ their_message: 'hi' }, (text) => chunks.push(text), onDone, onError, undefined, onRestart)
+
+    const calls = vi.mocked(global.fetch).mock.calls
+    expect(calls[2][0]).toContain('/api/chat/upload')
+    expect(calls[2][1]?.headers).toBeUndefined()
+    expect(onRestart).toHaveBeenCalledTimes(1)
+    // The partial "你" was dropped, not shown before the restarted reply
+    expect(chunks).toEqual(['你好'])
+    expect(onDone).toHaveBeenCalledTimes(1)
+    expect(onError).not.toHaveBeenCalled()
   })
 })
@@ -14,9 +14,20 @@ const mockCategories = [
   { name: '土味情话', count: 1 },
 ]
 
-function setupFetchMock(phrases = mockPhrases, categories = mockCategories) {
-  vi.mocked(global.fetch).mockImplementation((url: any) => {
+function setupFetchMock(phrases: typeof mockPhrases = mockPhrases, categories = mockCategories) {
+  vi.mocked(global.fetch).mockImplementation((url: any, init?: RequestInit) => {
     const urlStr = url.toString()
+    if (urlStr.includes('/api/phrases/batch')) {
+      // Initial load: category tabs and first page arrive in one batch
+      const request = JSON.parse(init?.body as string)
+      const batch = {
+        ids: [],
+        pages: (request.pages ?? []).map(() => ({ items: phrases, next_cursor: null })),
+        random: [],
+        categories: request.categories ? categories : null,
+      }
+      return Promise.resolve({ ok: true, json: async () => batch } as Response)
+    }
     if (urlStr.includes('/api/phrases/categories')) {
       return Promise.resolve({ ok: true, json: async () => categories } as Response)
     }
@@ -44,13 +55,7 @@ describe('PhraseLibrary', () => {
   })
 
   it('shows empty state when no phrases returned', async () => {
-    vi.mocked(global.fetch).mockImplementation((url: any) => {
-      const urlStr = url.toString()
-      if (urlStr.includes('categories')) {
-        return Promise.resolve({ ok: true, json: async () => [] } as Response)
-      }
-      return Promise.resolve({ ok: true, json: async () => [] } as Response)
-    })
+    setupFetchMock([], [])
     render(<PhraseLibrary />)
     await waitFor(() => expect(screen.getByText('暂无话术数据')).toBeInTheDocument())
   })
@@ -64,13 +69,7 @@ describe('PhraseLibrary', () => {
     await waitFor(() => screen.getByText('你好呀'))
 
     // Mock empty results for search
-    vi.mocked(global.fetch).mockImplementation((url: any) => {
-      const urlStr = url.toString()
-      if (urlStr.includes('categories')) {
-        return Promise.resolve({ ok: true, json: async () => mockCategories } as Response)
-      }
-      return Promise.resolve({ ok: true, json: async () => [] } as Response)
-    })
+    setupFetchMock([], mockCategories)
 
     const searchInput = screen.getByPlaceholderText('搜索话术...')
     await user.type(searchInput, '不存在的话术')
@@ -137,13 +136,7 @@ describe('PhraseLibrary', () => {
       category: '开场白',
       is_pickup_line: false,
     }))
-    vi.mocked(global.fetch).mockImplementation((url: any) => {
-      const urlStr = url.toString()
-      if (urlStr.includes('categories')) {
-        return Promise.resolve({ ok: true, json: async () => [] } as Response)
-      }
-      return Promise.resolve({ ok: true, json: async () => manyPhrases } as Response)
-    })
+    setupFetchMock(manyPhrases, [])
     render(<PhraseLibrary />)
     await waitFor(() => expect(screen.getByText('加载更多')).toBeInTheDocument())
   })
@@ -14,6 +14,12 @@ export interface PhraseParams {
   search?: string
   offset?: number
   limit?: number
+  cursor?: string
+}
+
+export interface PhrasePage {
+  items: Phrase[]
+  nextCursor: string | null
 }
 
 export interface Category {
@@ -21,23 +27,139 @@ export interface Category {
   count: number
 }
 
-export interface ImageContent {
-  data: string
-  media_type: string
+export interface PageRequest {
+  category?: string
+  search?: string
+  limit?: number
+  cursor?: string
+}
+
+export interface RandomRequest {
+  category?: string
+  n?: number
+}
+
+export interface PhraseBatchRequest {
+  ids?: number[]
+  pages?: PageRequest[]
+  random?: RandomRequest[]
+  categories?: boolean
+}
+
+export interface PhraseBatch {
+  ids: Phrase[]
+  pages: { items: Phrase[]; next_cursor: string | null }[]
+  random: Phrase[][]
+  categories: Category[] | null
 }
 
 export interface ChatRequest {
   their_message: string
   style?: string
+  // Generate several styles at once; chunks then arrive tagged with their style
+  styles?: string[]
+  // 'replies' streams reply_start/reply_delta/reply_end events per numbered reply
+  events?: 'content' | 'replies'
   context?: string
-  images?: ImageContent[]
+  images?: Blob[]
+}
+
+export interface ReplyEvent {
+  type: 'reply_start' | 'reply_delta' | 'reply_end'
+  index: number
+  // The delta for reply_delta, the whole reply for reply_end
+  text?: string
+  style?: string
+}
+
+// Sent as multipart/form-data: images go up as binary parts, not base64 in JSON
+function chatFormData(request: ChatRequest): FormData {
+  const form = new FormData()
+  form.append('their_message', request.their_message)
+  if (request.style) form.append('style', request.style)
+  for (const style of request.styles ?? []) {
+    form.append('styles', style)
+  }
+  if (request.events) form.append('events', request.events)
+  if (request.context) form.append('context', request.context)
+  for (const image of request.images ?? []) {
+    form.append('images', image)
+  }
+  return form
+}
+
+export async function fetchPhraseBatch(request: PhraseBatchRequest): Promise<PhraseBatch> {
+  const response = await fetch(`${BASE_URL}/api/phrases/batch`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify(request),
+  })
+  if (!response.ok) {
+    throw new Error(`Failed to fetch phrase batch: ${response.statusText}`)
+  }
+  return response.json()
+}
+
+// Lookups issued in the same tick (e.g. the category tabs and the first page
+// on app load) are coalesced into one /api/phrases/batch request. A lone
+// lookup still uses its GET endpoint so HTTP caching keeps working.
+interface QueuedLookup {
+  direct: () => Promise<unknown>
+  addTo: (request: Required<PhraseBatchRequest>) => (batch: PhraseBatch) => unknown
+  error: string
+  resolve: (value: unknown) => void
+  reject: (error: Error) => void
+}
+
+let queuedLookups: QueuedLookup[] = []
+
+function enqueueLookup<T>(lookup: Omit<QueuedLookup, 'resolve' | 'reject'>): Promise<T> {
+  return new Promise<T>((resolve, reject) => {
+    queuedLookups.push({ ...lookup, resolve: resolve as (value: unknown) => void, reject })
+    if (queuedLookups.length === 1) {
+      queueMicrotask(flushLookups)
+    }
+  })
+}
+
+async function flushLookups() {
+  const lookups = queuedLookups
+  queuedLookups = []
+  if (lookups.length === 1) {
+    lookups[0].direct().then(lookups[0].resolve, lookups[0].reject)
+    return
+  }
+
+  const request: Required<PhraseBatchRequest> = { ids: [], pages: [], random: [], categories: false }
+  const readers = lookups.map((lookup) => lookup.addTo(request))
+  let batch: PhraseBatch
+  try {
+    batch = await fetchPhraseBatch(request)
+  } catch (error) {
+    const message = error instanceof Error ? error.message : String(error)
+    lookups.forEach((lookup) => lookup.reject(new Error(`${lookup.error}: ${message}`)))
+    return
+  }
+  lookups.forEach((lookup, i) => {
+    try {
+      lookup.resolve(readers[i](batch))
+    } catch (error) {
+      lookup.reject(error instanceof Error ? error : new Error(String(error)))
+    }
+  })
 }
 
-export async function fetchPhrases(params: PhraseParams = {}): Promise<Phrase[]> {
+async function getPhrases(params: PhraseParams): Promise<PhrasePage> {
   const searchParams = new URLSearchParams()
   if (params.category) searchParams.set('category', params.category)
   if (params.search) searchParams.set('search', params.search)
-  if (params.offset !== undefined) searchParams.set('offset', String(params.offset))
+  if (params.cursor) {
+    searchParams.set('cursor', params.cursor)
+  } else if (params.offset !== undefined) {
+    searchParams.set('offset', String(params.offset))
+  }
   if (params.limit !== undefined) searchParams.set('limit', String(params.limit))
 
   const query = searchParams.toString()
@@ -47,10 +169,34 @@ export async function fetchPhrases(params: PhraseParams = {}): Promise<Phrase[]>
   if (!response.ok) {
     throw new Error(`Failed to fetch phrases: ${response.statusText}`)
   }
-  return response.json()
+  const items: Phrase[] = await response.json()
+  // Server sends the next page's cursor only when more rows may follow
+  const nextCursor = response.headers?.get('X-Next-Cursor') ?? null
+  return { items, nextCursor }
+}
+
+export function fetchPhrases(params: PhraseParams = {}): Promise<PhrasePage> {
+  // Batch pages are cursor based; an explicit offset needs the GET endpoint
+  if (!params.cursor && params.offset) {
+    return getPhrases(params)
+  }
+  return enqueueLookup<PhrasePage>({
+    direct: () => getPhrases(params),
+    addTo: (request) => {
+      const index = request.pages.length
+      request.pages.push({
+        category: params.category || undefined,
+        search: params.search || undefined,
+        limit: params.limit,
+        cursor: params.cursor || undefined,
+      })
+      return (batch) => ({ items: batch.pages[index].items, nextCursor: batch.pages[index].next_cursor })
+    },
+    error: 'Failed to fetch phrases',
+  })
 }
 
-export async function fetchRandomPhrase(category?: string): Promise<Phrase> {
+async function getRandomPhrase(category?: string): Promise<Phrase> {
   const searchParams = new URLSearchParams()
   if (category) searchParams.set('category', category)
 
@@ -64,7 +210,25 @@ export async function fetchRandomPhrase(category?: string): Promise<Phrase> {
   return response.json()
 }
 
-export async function fetchCategories(): Promise<Category[]> {
+export function fetchRandomPhrase(category?: string): Promise<Phrase> {
+  return enqueueLookup<Phrase>({
+    direct: () => getRandomPhrase(category),
+    addTo: (request) => {
+      const index = request.random.length
+      request.random.push({ category: category || undefined, n: 1 })
+      return (batch) => {
+        const [phrase] = batch.random[index]
+        if (!phrase) {
+          throw new Error('Failed to fetch random phrase: Not Found')
+        }
+        return phrase
+      }
+    },
+    error: 'Failed to fetch random phrase',
+  })
+}
+
+async function getCategories(): Promise<Category[]> {
   const url = `${BASE_URL}/api/phrases/categories`
   const response = await fetch(url)
   if (!response.ok) {
@@ -73,67 +237,116 @@ export async function fetchCategories(): Promise<Category[]> {
   return response.json()
 }
 
+export function fetchCategories(): Promise<Category[]> {
+  return enqueueLookup<Category[]>({
+    direct: getCategories,
+    addTo: (request) => {
+      request.categories = true
+      return (batch) => batch.categories ?? []
+    },
+    error: 'Failed to fetch categories',
+  })
+}
+
+// A dropped stream is picked up again from the last frame received, this many times
+const MAX_RESUMES = 3
+
 export async function streamChat(
   request: ChatRequest,
-  onChunk: (text: string) => void,
+  onChunk: (text: string, style?: string) => void,
   onDone: () => void,
   onError: (error: Error) => void,
+  onReply?: (event: ReplyEvent) => void,
+  onRestart?: () => void,
 ): Promise<void> {
-  try {
-    const response = await fetch(`${BASE_URL}/api/chat`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify(request),
-    })
-
-    if (!response.ok) {
-      throw new Error(`Chat request failed: ${response.statusText}`)
-    }
+  let lastEventId: string | null = null
+  let eventName: string | null = null
+  let resumes = 0
 
-    const reader = response.body?.getReader()
-    if (!reader) {
-      throw new Error('No response body')
-    }
+  while (true) {
+    try {
+      // A dropped stream is continued by its id alone, without uploading the
+      // request again. No Content-Type header on the upload: the browser sets
+      // it with the multipart boundary
+      const response = lastEventId
+        ? await fetch(`${BASE_URL}/api/chat/resume`, { headers: { 'Last-Event-ID': lastEventId } })
+        : await fetch(`${BASE_URL}/api/chat/upload`, { method: 'POST', body: chatFormData(request) })
 
-    const decoder = new TextDecoder()
-    let buffer = ''
+      if (lastEventId && (response.status === 409 || response.status === 410)) {
+        // The stream can't be resumed: drop the partial reply and generate it again
+        lastEventId = null
+        eventName = null
+        onRestart?.()
+        continue
+      }
 
-    while (true) {
-      const { done, value } = await reader.read()
-      if (done) {
-        onDone()
-        break
+      if (!response.ok) {
+        throw new Error(`Chat request failed: ${response.statusText}`)
       }
 
-      buffer += decoder.decode(value, { stream: true })
-      const lines = buffer.split('\n')
-      buffer = lines.pop() || ''
-
-      for (const line of lines) {
-        const trimmed = line.trim()
-        if (trimmed.startsWith('data: ')) {
-          const data = trimmed.slice(6)
-          if (data === '[DONE]') {
-            onDone()
-            return
+      const reader = response.body?.getReader()
+      if (!reader) {
+        throw new Error('No response body')
+      }
+
+      const decoder = new TextDecoder()
+      let buffer = ''
+
+      while (true) {
+        let chunk: ReadableStreamReadResult<Uint8Array>
+        try {
+          chunk = await reader.read()
+        } catch (error) {
+          // Connection lost mid-stream: resume after the last frame we saw
+          if (lastEventId && resumes < MAX_RESUMES) {
+            resumes++
+            break
           }
-          try {
-            const parsed = JSON.parse(data)
-            if (parsed.content) {
-              onChunk(parsed.content)
+          throw error
+        }
+        const { done, value } = chunk
+        if (done) {
+          onDone()
+          return
+        }
+
+        buffer += decoder.decode(value, { stream: true })
+        const lines = buffer.split('\n')
+        buffer = lines.pop() || ''
+
+        for (const line of lines) {
+          const trimmed = line.trim()
+          if (trimmed.startsWith('id: ')) {
+            lastEventId = trimmed.slice(4)
+          } else if (trimmed.startsWith('event: ')) {
+            eventName = trimmed.slice(7)
+          } else if (trimmed.startsWith('data: ')) {
+            const data = trimmed.slice(6)
+            const name = eventName
+            eventName = null
+            if (data === '[DONE]') {
+              onDone()
+              return
             }
-          } catch {
-            // If not JSON, treat as plain text
-            if (data) {
-              onChunk(data)
+            try {
+              const parsed = JSON.parse(data)
+              if (name?.startsWith('reply_')) {
+                onReply?.({ type: name as ReplyEvent['type'], ...parsed })
+              } else if (parsed.content) {
+                onChunk(parsed.content, parsed.style)
+              }
+            } catch {
+              // If not JSON, treat as plain text
+              if (data) {
+                onChunk(data)
+              }
             }
           }
         }
       }
+    } catch (error) {
+      onError(error instanceof Error ? error : new Error(String(error)))
+      return
     }
-  } catch (error) {
-    onError(error instanceof Error ? error : new Error(String(error)))
   }
 }
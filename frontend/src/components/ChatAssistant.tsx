@@ -1,10 +1,9 @@
 import { useState, useRef, useEffect } from 'react'
-import { streamChat, type ImageContent } from '../api/client'
+import { streamChat } from '../api/client'
 import ChatMessage from './ChatMessage'
 
 interface SelectedImage {
-  data: string
-  media_type: string
+  file: File
   preview: string
 }
 
@@ -66,16 +65,12 @@ export default function ChatAssistant() {
 
       const reader = new FileReader()
       reader.onload = () => {
-        const result = reader.result as string
-        const preview = result
-        // Strip "data:image/xxx;base64," prefix
-        const commaIndex = result.indexOf(',')
-        const data = result.slice(commaIndex + 1)
-        const media_type = file.type || 'image/jpeg'
+        // The data URL is only for the thumbnail; the file itself is uploaded
+        const preview = reader.result as string
 
         setSelectedImages((prev) => {
           if (prev.length >= 3) return prev
-          return [...prev, { data, media_type, preview }]
+          return [...prev, { file, preview }]
         })
       }
       reader.readAsDataURL(file)
@@ -98,9 +93,9 @@ export default function ChatAssistant() {
 
     // Capture current images for the message
     const currentImages = selectedImages.map((img) => ({ preview: img.preview }))
-    const imagesToSend: ImageContent[] | undefined =
+    const imagesToSend: File[] | undefined =
       selectedImages.length > 0
-        ? selectedImages.map((img) => ({ data: img.data, media_type: img.media_type }))
+        ? selectedImages.map((img) => img.file)
         : undefined
 
     // Add user message
@@ -176,6 +171,19 @@ export default function ChatAssistant() {
           ),
         )
       },
+      // onReply
+      undefined,
+      // onRestart: the reply is generated again from the start
+      () => {
+        accumulated = ''
+        setMessages((prev) =>
+          prev.map((msg) =>
+            msg.id === aiMsgId
+              ? { ...msg, content: '', isLoading: true }
+              : msg,
+          ),
+        )
+      },
     )
   }
 
@@ -13,6 +13,7 @@ export default function PhraseLibrary() {
   const [loading, setLoading] = useState(false)
   const [hasMore, setHasMore] = useState(true)
   const [offset, setOffset] = useState(0)
+  const [cursor, setCursor] = useState<string | null>(null)
   const debounceTimer = useRef<ReturnType<typeof setTimeout> | null>(null)
 
   // Debounce search input
@@ -34,19 +35,21 @@ export default function PhraseLibrary() {
   useEffect(() => {
     setPhrases([])
     setOffset(0)
+    setCursor(null)
     setHasMore(true)
-    loadPhrases(0, true)
+    loadPhrases(0, null, true)
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [category, debouncedSearch])
 
   const loadPhrases = useCallback(
-    async (currentOffset: number, reset = false) => {
+    async (currentOffset: number, currentCursor: string | null, reset = false) => {
       setLoading(true)
       try {
-        const data = await fetchPhrases({
+        const { items: data, nextCursor } = await fetchPhrases({
           category: category || undefined,
           search: debouncedSearch || undefined,
           offset: currentOffset,
+          cursor: currentCursor ?? undefined,
           limit: PAGE_SIZE,
         })
         if (reset) {
@@ -56,6 +59,7 @@ export default function PhraseLibrary() {
         }
         setHasMore(data.length === PAGE_SIZE)
         setOffset(currentOffset + data.length)
+        setCursor(nextCursor)
       } catch (err) {
         console.error('Failed to load phrases:', err)
       } finally {
@@ -66,7 +70,7 @@ export default function PhraseLibrary() {
   )
 
   const handleLoadMore = () => {
-    loadPhrases(offset)
+    loadPhrases(offset, cursor)
   }
 
   return (